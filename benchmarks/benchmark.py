@@ -130,7 +130,8 @@ class Benchmark:
     name: str = attr.ib()
     program: Path = attr.ib()
 
-    def command(self, stats_path: Optional[Path], memory_mb: Optional[int] = None) -> List[str]:
+    def command(self, stats_path: Optional[Path], memory_mb: Optional[int] = None,
+                extra_args: Optional[List[str]] = None) -> List[str]:
         command = [
             "poetry",
             "run",
@@ -143,6 +144,8 @@ class Benchmark:
             command.extend(["--stats-path", stats_path.joinpath(self.name)])
         if memory_mb is not None:
             command.extend(["--memory-limit", memory_mb])
+        if extra_args is not None:
+            command.extend(extra_args)
         return list(map(str, command))
 
 
@@ -194,7 +197,11 @@ def cli():
               type=click.INT,
               help='memory limit in megabytes per process',
               default=str(8 * 1024))
-def run(filter, timeout, memory):
+@click.option('--extra-args',
+              type=click.STRING,
+              help='additional arguments for kipro2, e.g. "--instantiation substitute"',
+              default="")
+def run(filter, timeout, memory, extra_args):
     limits = Limits.parse(timeout, int(2.5*memory))
     results = Counter()
     stats_timestamp = time.strftime('%Y-%m-%d-%H-%M-%S')
@@ -206,7 +213,8 @@ def run(filter, timeout, memory):
         stats_path.mkdir(parents=True)
         for benchmark in benchmarks:
             res = limits.run_with_limits(
-                benchmark.command(stats_path=stats_path, memory_mb=memory))
+                benchmark.command(stats_path=stats_path, memory_mb=memory,
+                                  extra_args=shlex.split(extra_args)))
             if isinstance(res, str):
                 results.update([res])
             else:
@@ -243,7 +251,11 @@ def run(filter, timeout, memory):
               type=click.INT,
               help='memory limit in megabytes per process',
               default=str(8 * 1024))
-def print_list(filter, timeout, memory):
+@click.option('--extra-args',
+              type=click.STRING,
+              help='additional arguments for kipro2, e.g. "--instantiation substitute"',
+              default="")
+def print_list(filter, timeout, memory, extra_args):
     limits = Limits.parse(timeout, int(2.5*memory))
     stats_timestamp = time.strftime('%Y-%m-%d-%H-%M-%S')
     for benchmark_set in BENCHMARK_SETS:
@@ -254,7 +266,8 @@ def print_list(filter, timeout, memory):
         stats_path.mkdir(parents=True)
         for benchmark in benchmarks:
             command_list = limits.command_with_limits(
-                benchmark.command(stats_path=stats_path, memory_mb=memory))
+                benchmark.command(stats_path=stats_path, memory_mb=memory,
+                                  extra_args=shlex.split(extra_args)))
             print(shlex.join(command_list))
 
 
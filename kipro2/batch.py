@@ -0,0 +1,210 @@
+"""
+Run the checks listed in a manifest on a pool of long-lived worker processes.
+
+Starting kipro2 once per check costs more than the check itself for small instances, mostly for importing probably,
+pysmt and z3. The workers of kipro2_batch import everything once and only reset the pysmt environment between tasks.
+
+The manifest is a JSONL file with one task per line, e.g.
+
+    {"program": "cav21/geo1.pgcl", "post": "c", "pre": "c+1", "checker": "kind", "timeout": 60}
+
+The keys program, post and pre are required. Relative program paths are resolved against the directory of the manifest.
+pre may also be a list of candidate upper bounds, which the checkers bmc, kind and combined check on one unrolling.
+Optional keys are name, checker (one of CHECKERS, default "combined"), ert, assert_inductive, assert_refute, the
+options of CheckTask in TASK_OPTIONS and the limits timeout (in seconds) and memory_limit (in megabytes, for the whole
+worker process as with kipro2 --memory-limit).
+
+Whenever a task finishes, a JSON line with its index in the manifest, its status and its statistics is written to the
+output.
+"""
+
+import json
+import os
+import resource
+import signal
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+from typing import List, Optional
+
+import attr
+import click
+import z3
+from pysmt.shortcuts import reset_env
+
+from kipro2.cmd import CheckTask, Checker, _run_check_task
+from kipro2.explicit.value_iteration import parse_box
+from kipro2.incremental_bmc.check_schedule import parse_check_schedule
+from kipro2.utils.statistics import StatisticsEncoder
+from kipro2.utils.utils import set_max_memory, setup_sigint_handler
+
+CHECKERS = {str(checker): checker for checker in Checker}
+
+TASK_OPTIONS = ["instantiation", "bmc_check_schedule", "box", "exact", "runs", "max_steps", "confidence", "seed"]
+
+MANIFEST_KEYS = {"program", "post", "pre", "name", "checker", "ert", "assert_inductive", "assert_refute", "timeout",
+                 "memory_limit"}.union(TASK_OPTIONS)
+
+# The value of z3's timeout parameter that means no limit
+Z3_NO_TIMEOUT = 4294967295
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def _raise_timeout(_signum, _frame):
+    raise TaskTimeout()
+
+
+@attr.s
+class BatchTask:
+    index: int = attr.ib()
+    check_task: CheckTask = attr.ib()
+    timeout: Optional[float] = attr.ib(default=None)
+    memory_limit: Optional[int] = attr.ib(default=None)
+
+
+def read_manifest(path: str, cache_dir: Optional[str] = None) -> List[BatchTask]:
+    """
+    :param cache_dir: The directory of the cache for preprocessed characteristic functionals of all tasks.
+    """
+    base = Path(path).parent
+    tasks = []
+    with open(path, "r") as manifest:
+        for (line_number, line) in enumerate(manifest, 1):
+            if line.strip() == "":
+                continue
+            try:
+                tasks.append(parse_task(json.loads(line), len(tasks), base, cache_dir))
+            except Exception as e:
+                raise Exception("Line %s of %s: %s" % (line_number, path, e))
+    return tasks
+
+
+def parse_task(entry: dict, index: int, base: Path, cache_dir: Optional[str] = None) -> BatchTask:
+    """
+    Create the task for a manifest entry.
+
+    :param base: The directory against which relative program paths are resolved.
+    """
+    unknown_keys = set(entry).difference(MANIFEST_KEYS)
+    if unknown_keys:
+        raise Exception("Unknown keys %s." % ", ".join(sorted(unknown_keys)))
+    for key in ["program", "post", "pre"]:
+        if key not in entry:
+            raise Exception("The key %s is missing." % key)
+    checker = entry.get("checker", "combined")
+    if checker not in CHECKERS:
+        raise Exception("Unknown checker %s (choose from %s)." % (checker, ", ".join(CHECKERS)))
+    candidates = entry["pre"] if isinstance(entry["pre"], list) else None
+    if candidates is not None and checker not in ["bmc", "kind", "combined"]:
+        raise Exception("Several candidate upper bounds are only supported by the checkers bmc, kind and combined.")
+    # Fail early on invalid schedules and boxes
+    parse_check_schedule(entry.get("bmc_check_schedule", "fixed:1"))
+    parse_box(entry.get("box") or "")
+
+    program = base.joinpath(entry["program"])
+    with program.open("r") as program_file:
+        program_code = program_file.read()
+    check_task = CheckTask(name=entry.get("name"),
+                           checker=CHECKERS[checker],
+                           program=program,
+                           program_code=program_code,
+                           post=entry["post"],
+                           pre=entry["pre"] if candidates is None else None,
+                           candidates=candidates,
+                           stats_path=None,
+                           assert_inductive=entry.get("assert_inductive"),
+                           assert_refute=entry.get("assert_refute"),
+                           ert=entry.get("ert", False),
+                           cache_dir=cache_dir,
+                           **{key: entry[key] for key in TASK_OPTIONS if key in entry})
+    return BatchTask(index=index, check_task=check_task, timeout=entry.get("timeout"),
+                     memory_limit=entry.get("memory_limit"))
+
+
+def run_batch_task(task: BatchTask) -> dict:
+    """
+    Run a task in this process and restore the state of the process afterwards.
+
+    The timeout of the task is enforced by a timer (SIGALRM). Since Python cannot interrupt a running z3 check, z3 is
+    given the timeout as well, but z3.set_param("timeout") limits each check on its own, not the task: A task with
+    many checks is stopped by the timer once the running check returned.
+
+    :return: The JSON record of the result.
+    """
+    reset_env()
+    statistics = task.check_task.make_statistics()
+    error = None
+    memory_limits = resource.getrlimit(resource.RLIMIT_AS)
+    if task.memory_limit is not None:
+        set_max_memory(task.memory_limit)
+    if task.timeout is not None:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, task.timeout)
+        # Python cannot interrupt a running z3 check, so every z3 check gets the time limit of the task as well.
+        z3.set_param("timeout", max(1, int(task.timeout * 1000)))
+    start = time.perf_counter()
+    try:
+        try:
+            _run_check_task(task.check_task, statistics)
+        finally:
+            # Disarm the timer before anything else. If it fires after the task returned but before it is disarmed,
+            # the TaskTimeout is raised here and handled below.
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except TaskTimeout:
+        statistics.status = "timeout"
+    except MemoryError:
+        statistics.status = "oom"
+    except Exception as e:
+        if task.timeout is not None and time.perf_counter() - start >= task.timeout:
+            statistics.status = "timeout"
+        else:
+            statistics.status = "err"
+            error = "%s: %s" % (type(e).__name__, e)
+    finally:
+        if task.timeout is not None:
+            z3.set_param("timeout", Z3_NO_TIMEOUT)
+        resource.setrlimit(resource.RLIMIT_AS, memory_limits)
+        reset_env()
+    return {"index": task.index, "status": statistics.status, "error": error, "statistics": statistics.__dict__}
+
+
+def _init_worker():
+    # The checkers print their results; the output of kipro2_batch is the JSONL output only.
+    sys.stdout = open(os.devnull, "w")
+
+
+@click.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output',
+              type=click.Path(dir_okay=False),
+              default="-",
+              help="The JSONL file to write the results to (standard output by default).")
+@click.option('--jobs', type=click.INT, default=1, help="The number of worker processes.")
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    help="A directory in which preprocessed characteristic functionals are cached across tasks and runs.")
+def main(manifest, output, jobs, cache_dir):
+    """
+    Run the checks of a JSONL MANIFEST (see kipro2.batch) and write one JSON line per result as tasks finish. Exits
+    with status 1 if a task failed with an error.
+    """
+    setup_sigint_handler()
+    tasks = read_manifest(manifest, cache_dir)
+    statuses = Counter()
+    with click.open_file(output, "w") as out, Pool(jobs, initializer=_init_worker) as pool:
+        for result in pool.imap_unordered(run_batch_task, tasks):
+            out.write(json.dumps(result, cls=StatisticsEncoder) + "\n")
+            out.flush()
+            statuses[result["status"]] += 1
+    click.echo(", ".join("%s %s" % (count, status) for (status, count) in sorted(statuses.items())), err=True)
+    sys.exit(1 if statuses["err"] > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
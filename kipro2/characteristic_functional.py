@@ -3,7 +3,6 @@
    and a given linear postexpectation X.
 """
 
-from itertools import product
 from probably.pgcl.parser import parse_pgcl, parse_expectation
 from probably.pgcl.wp import one_loop_wp_transformer, general_wp_transformer
 from probably.pgcl.check import CheckFail
@@ -14,17 +13,27 @@ from pysmt.typing import BOOL, INT, REAL
 from kipro2.utils.utils import *
 from kipro2.utils.probably import SnfLoopExpectationTransformer, normalize_expectation_simple
 from kipro2.utils.statistics import Statistics, StatisticsSolver
+from kipro2.utils.cache import CharacteristicFunctionalCache, SmtLibTermWriter, read_smtlib_terms
+from kipro2.utils.dnf import satisfiable_polarities, parallel_satisfiable_polarities
+from typing import Optional
+import multiprocessing
 import logging
 
 logger = logging.getLogger("kipro2")
 
+# For fewer guards, starting worker processes takes longer than checking all cells sequentially.
+MIN_LITERALS_FOR_PARALLEL_PREPROCESSING = 6
+
 class CharacteristicFunctional:
 
 
-    def __init__(self, program, post_expectation, statistics: Statistics):
+    def __init__(self, program, post_expectation, statistics: Statistics, cache: Optional[CharacteristicFunctionalCache] = None,
+                 preprocess_jobs: int = 1):
         """
         :param program: The program text.
         :param post_expectation: The postexpectation
+        :param cache: If given, the preprocessed DNFs are loaded from (resp. stored in) this cache.
+        :param preprocess_jobs: Number of worker processes for the satisfiability checks of the DNF cells.
         """
 
         logger.info("Program: \n  %s \n" % program)
@@ -47,11 +56,13 @@ class CharacteristicFunctional:
 
         # create a cached sat solver to use in the initialization
         self._sat_solver = StatisticsSolver(statistics, name="z3")
+        self._statistics = statistics
+        self._preprocess_jobs = preprocess_jobs
 
         self.declarations = self.program.variables.copy()
 
         # The euf for Monus is of type Int x Int -> Int
-        # And casted to a real whenever necessary (see utils.probably_expr_to_pysmt)
+        # And casted to a real whenever necessary (see utils.ProbablyExprConverter)
         self.monus_euf = Symbol("Monus", FunctionType(INT, [INT, INT]))
 
         # We need an additional euf RMonus in case Monus occurs in an arithmetic expression outside of iverson bracket such as
@@ -59,9 +70,25 @@ class CharacteristicFunctional:
         # However, during bmc/kinduction we do not need to generate copies f rmonus formulae since refutation/kinduction queries do not change.
         self.rmonus_euf = Symbol("RMonus", FunctionType(REAL, [REAL, REAL]))
 
-        # Compute loop_execute and loop_terminated DNFs)
-        (self._pysmt_loop_execute_dnf, self._pysmt_loop_terminated_dnf) \
-            = self._summation_snf_to_pysmt_dnf(post_expectation)
+        # Store encountered monus expressions Monus(a,b) as pairs (a,b) to build the corrsponding formula
+        # if b <=a then Monus(a,b) = a -b else Monus(a,b) = 0
+        # The converter collects them for this functional only.
+        self._converter = ProbablyExprConverter()
+        self.monus_pairs = self._converter.monus_pairs
+        self.rmonus_pairs = self._converter.real_monus_pairs
+
+        # Compute loop_execute and loop_terminated DNFs) or load them from the cache. The cache is keyed by the
+        # pretty-printed program, i.e., comments and formatting of the program text do not matter.
+        cache_key = cache.key(str(self.program), post_expectation) if cache is not None else None
+        cached_payload = cache.load(cache_key) if cache is not None else None
+        statistics.functional_cache_hit = cached_payload is not None if cache is not None else None
+        if cached_payload is not None:
+            self._load_cache_payload(cached_payload)
+        else:
+            (self._pysmt_loop_execute_dnf, self._pysmt_loop_terminated_dnf) \
+                = self._summation_snf_to_pysmt_dnf(post_expectation)
+            if cache is not None:
+                cache.store(cache_key, self._to_cache_payload())
 
         # Store all possible substitutions in a list
         # (We cannot use a set since dicts are not hashable)
@@ -71,12 +98,58 @@ class CharacteristicFunctional:
                 self._pysmt_loop_execute_substitutions.append(sub) if sub not in self._pysmt_loop_execute_substitutions \
                     else self._pysmt_loop_execute_substitutions
 
-        # Store encountered monus expressions Monus(a,b) as pairs (a,b) to build the corrsponding formula
-        # if b <=a then Monus(a,b) = a -b else Monus(a,b) = 0
-        self.monus_pairs = encountered_monus_pairs
-        self.rmonus_pairs = encountered_real_monus_pairs
         logger.debug("The encountered monus (rmonus) expressions are: %s   (%s)" % (self.monus_pairs, self.rmonus_pairs))
 
+    def _to_cache_payload(self):
+        """
+        Serialize the results of the preprocessing, i.e., the loop-execute and loop-terminated DNFs, the loop-done guard
+        and the encountered monus pairs.
+        """
+
+        writer = SmtLibTermWriter()
+        payload = {
+            "variables": [var.symbol_name() for var in self._pysmt_program_variables],
+            "is_linear": self.is_linear,
+            "loop_execute": [{"guard": writer.add(guard),
+                              "branches": [{"prob": writer.add(prob),
+                                            "sub": {var.symbol_name(): writer.add(exp) for (var, exp) in sub.items()},
+                                            "tick": writer.add(tick)}
+                                           for (prob, sub, tick) in prob_sub_ticks]}
+                             for (guard, prob_sub_ticks) in self._pysmt_loop_execute_dnf],
+            "loop_terminated": [[writer.add(guard), writer.add(arith)]
+                                for (guard, arith) in self._pysmt_loop_terminated_dnf],
+            "loop_done": writer.add(self._pysmt_loop_done),
+            "monus_pairs": [[writer.add(min_1), writer.add(min_2)] for (min_1, min_2) in self.monus_pairs],
+            "rmonus_pairs": [[writer.add(min_1), writer.add(min_2)] for (min_1, min_2) in self.rmonus_pairs],
+        }
+        payload["smtlib"] = writer.script()
+        return payload
+
+    def _load_cache_payload(self, payload):
+        """
+        Restore the state computed by _summation_snf_to_pysmt_dnf from a payload created by _to_cache_payload.
+        """
+
+        self._pysmt_program_variables = self._setup_variables()
+        self._pysmt_program_variables_argument = tuple(self._pysmt_program_variables)
+        assert [var.symbol_name() for var in self._pysmt_program_variables] == payload["variables"]
+        self.non_negative_constraint = And(GE(var, Int(0)) for var in self._pysmt_program_variables)
+        self.is_linear = self.is_linear and payload["is_linear"]
+
+        env = get_env()
+        terms = read_smtlib_terms(payload["smtlib"])
+        self._pysmt_loop_execute_dnf = [
+            (terms[entry["guard"]],
+             [(terms[branch["prob"]],
+               {env.formula_manager.get_symbol(var_name): terms[exp] for (var_name, exp) in branch["sub"].items()},
+               terms[branch["tick"]])
+              for branch in entry["branches"]])
+            for entry in payload["loop_execute"]]
+        self._pysmt_loop_terminated_dnf = [(terms[guard], terms[arith]) for (guard, arith) in payload["loop_terminated"]]
+        self._pysmt_loop_done = terms[payload["loop_done"]]
+        self.monus_pairs.update((terms[min_1], terms[min_2]) for (min_1, min_2) in payload["monus_pairs"])
+        self.rmonus_pairs.update((terms[min_1], terms[min_2]) for (min_1, min_2) in payload["rmonus_pairs"])
+
     def get_loop_execute_substitutions(self):
         """
 
@@ -133,7 +206,7 @@ class CharacteristicFunctional:
             pysmt_sub = {}
             for var_name, key in probably_sub.items():
                 # print(var_name,':', key)
-                pysmt_sub[env.formula_manager.get_symbol(var_name)] = probably_expr_to_pysmt(key, self._pysmt_infinity_variable, True, self.monus_euf)
+                pysmt_sub[env.formula_manager.get_symbol(var_name)] = self._converter.convert(key, self._pysmt_infinity_variable, True, self.monus_euf)
             # print()
             pysmt_subs.append(pysmt_sub)
 
@@ -207,13 +280,13 @@ class CharacteristicFunctional:
         # Convert guards and probabilities to pysmt formulae
         # Notice: We simplify the guards here as this reduces trivial conjuncts such as 2=2 that resulting from substitutions.
         # We also simplify the probabilities, e.g. 1 - 4/5   ->   1/5.
-        pysmt_guards = list(map(simplify, map(lambda guard:probably_expr_to_pysmt(guard, None, True, self.monus_euf), probably_guards)))
-        pysmt_probs = list(map(simplify, map(probably_expr_to_pysmt, probably_probs)))
+        pysmt_guards = list(map(simplify, map(lambda guard:self._converter.convert(guard, None, True, self.monus_euf), probably_guards)))
+        pysmt_probs = list(map(simplify, map(self._converter.convert, probably_probs)))
 
         # A sub is a list of dicts, where every dict is a map from variables to substitutions
         pysmt_subs = self._get_pysmt_subs(probably_subs)
 
-        pysmt_ticks = list(map(simplify, map(lambda guard:probably_expr_to_pysmt(guard, None, True, self.rmonus_euf, True), probably_ticks)))
+        pysmt_ticks = list(map(simplify, map(lambda guard:self._converter.convert(guard, None, True, self.rmonus_euf, True), probably_ticks)))
 
         pysmt_summation_nf = list()
         for i in range(0, len(pysmt_guards)):
@@ -248,20 +321,19 @@ class CharacteristicFunctional:
 
         pysmt_dnf_loop_execute = []
 
-        for bin_seq in product([True, False], repeat=len(pysmt_summation_nf)):
+        # We only want to add them, if they are satisfiable
+        guards = [guard for (guard, _, _, _) in pysmt_summation_nf]
+        for bin_seq in self._satisfiable_polarities(guards, self.non_negative_constraint):
             guard_seq, prob_seq, sub_seq, tick_seq = zip(*list(map(self._construct_guard_prob_tick_triple, bin_seq, pysmt_summation_nf)))
             conjuncted_B = And(guard_seq)
-            to_test = And(guard_seq + (self.non_negative_constraint,))
-            # We only want to add them, if they are satisfiable
-            if self._sat_solver.is_sat(to_test):
-                prob_sub_tick_list = [(prob_seq[i], sub_seq[i], tick_seq[i]) for i in range(0, len(prob_seq)) if
-                                 not prob_seq[i] == Real(0)]
-
-                # if the prob_sub_list is empty, then this entry of the dnf corresponds to the (not guard) part of
-                # the wp-characteristic functional. Omit this part in the loop_execute part.
-                if len(prob_sub_tick_list) != 0:
-                    pysmt_dnf_loop_execute.append((simplify(conjuncted_B),
-                                                   prob_sub_tick_list))
+            prob_sub_tick_list = [(prob_seq[i], sub_seq[i], tick_seq[i]) for i in range(0, len(prob_seq)) if
+                             not prob_seq[i] == Real(0)]
+
+            # if the prob_sub_list is empty, then this entry of the dnf corresponds to the (not guard) part of
+            # the wp-characteristic functional. Omit this part in the loop_execute part.
+            if len(prob_sub_tick_list) != 0:
+                pysmt_dnf_loop_execute.append((simplify(conjuncted_B),
+                                               prob_sub_tick_list))
 
         logger.info("PySMT Disjunctive NF (length = %s): \n %s \n" % (
             len(pysmt_dnf_loop_execute),
@@ -280,7 +352,7 @@ class CharacteristicFunctional:
         """
 
         logger.info(probably_summation_nf.done)
-        pysmt_loop_done = probably_expr_to_pysmt(probably_summation_nf.done, self._pysmt_infinity_variable, True, self.monus_euf)
+        pysmt_loop_done = self._converter.convert(probably_summation_nf.done, self._pysmt_infinity_variable, True, self.monus_euf)
 
         probably_postexpectation = parse_expectation(post_expectation)
 
@@ -295,20 +367,19 @@ class CharacteristicFunctional:
         logger.info("Flattened Postexpectation: %s \n Loop Done Expression: %s"
                     % (flattened_postexpectation, pysmt_loop_done))
 
-        pysmt_postexpectation_snf = [(probably_expr_to_pysmt(bool_exp, self._pysmt_infinity_variable, True, self.monus_euf),
-                                      probably_expr_to_pysmt(arith_exp, self._pysmt_infinity_variable, True, self.rmonus_euf, True))
+        pysmt_postexpectation_snf = [(self._converter.convert(bool_exp, self._pysmt_infinity_variable, True, self.monus_euf),
+                                      self._converter.convert(arith_exp, self._pysmt_infinity_variable, True, self.rmonus_euf, True))
                                      for bool_exp, arith_exp in flattened_postexpectation]
 
         pysmt_loop_terminated_dnf = []
 
-        for bin_seq in product([True, False], repeat=len(pysmt_postexpectation_snf)):
+        bool_exps = [bool_exp for (bool_exp, _) in pysmt_postexpectation_snf]
+        for bin_seq in self._satisfiable_polarities(bool_exps, And(pysmt_loop_done, self.non_negative_constraint)):
             guard_seq, arith_seq = zip(
                 *list(map(self._construct_boolexp_arithexp_par, bin_seq, pysmt_postexpectation_snf)))
-            to_test = And(guard_seq + (pysmt_loop_done, self.non_negative_constraint,))
-            if self._sat_solver.is_sat(to_test):
-                resulting_arith = simplify(Plus(arith_seq))
-                pysmt_loop_terminated_dnf.append(
-                    (simplify(And(guard_seq + (pysmt_loop_done,))), resulting_arith))
+            resulting_arith = simplify(Plus(arith_seq))
+            pysmt_loop_terminated_dnf.append(
+                (simplify(And(guard_seq + (pysmt_loop_done,))), resulting_arith))
 
         self._pysmt_loop_done = pysmt_loop_done
 
@@ -346,8 +417,8 @@ class CharacteristicFunctional:
 
         # Convert everything to pysmt objects. A probably expectation in snf of the form "[g_1]*a_1 + ... + [g_n]*a_n" is
         # now represented as [(g_1,a_1), ..., (g_n,a_n)]
-        pysmt_expectation_snf = [(probably_expr_to_pysmt(bool_exp, self._pysmt_infinity_variable, True, self.monus_euf, False),
-                                  probably_expr_to_pysmt(arith_exp, self._pysmt_infinity_variable, True, self.rmonus_euf, True))
+        pysmt_expectation_snf = [(self._converter.convert(bool_exp, self._pysmt_infinity_variable, True, self.monus_euf, False),
+                                  self._converter.convert(arith_exp, self._pysmt_infinity_variable, True, self.rmonus_euf, True))
                                      for bool_exp, arith_exp in probably_expectation_snf]
 
 
@@ -355,17 +426,16 @@ class CharacteristicFunctional:
         # As described in the paper: Go through all possible assignments from occurring Boolean expressions to truth values.
         pysmt_upper_bound_dnf = []
 
-        for bin_seq in product([True, False], repeat=len(pysmt_expectation_snf)):
+        bool_exps = [bool_exp for (bool_exp, _) in pysmt_expectation_snf]
+        for bin_seq in self._satisfiable_polarities(bool_exps, self.non_negative_constraint):
             guard_seq, arith_seq = zip(
                 *list(map(self._construct_boolexp_arithexp_par, bin_seq, pysmt_expectation_snf)))
-            to_test = And(guard_seq + (self.non_negative_constraint,))
-            if self._sat_solver.is_sat(to_test):
-                # If arith_seq contains infinity, then the whole arithmetic expression is to be interpreted as infinity
-                # Since nothing is greater than infinity, states satisfying And(guard_seq) can be disregarded when checking ... > "given expectation".
-                if not self._pysmt_infinity_variable in arith_seq or not ignore_conjuncts_with_infinity:
-                    resulting_arith = simplify(Plus(arith_seq))
-                    pysmt_upper_bound_dnf.append(
-                        (simplify(And(guard_seq)), resulting_arith))
+            # If arith_seq contains infinity, then the whole arithmetic expression is to be interpreted as infinity
+            # Since nothing is greater than infinity, states satisfying And(guard_seq) can be disregarded when checking ... > "given expectation".
+            if not self._pysmt_infinity_variable in arith_seq or not ignore_conjuncts_with_infinity:
+                resulting_arith = simplify(Plus(arith_seq))
+                pysmt_upper_bound_dnf.append(
+                    (simplify(And(guard_seq)), resulting_arith))
         # ----------------------------------------
 
 
@@ -378,6 +448,34 @@ class CharacteristicFunctional:
 
         return pysmt_upper_bound_dnf
 
+    def _satisfiable_polarities(self, literals, background):
+        """
+        Computes all sequences bin_seq of truth values (in the order of itertools.product([True, False], repeat=n))
+        such that the cell
+                background AND lit_1 AND ... AND lit_n,   where lit_i = literals[i] if bin_seq[i] else Not(literals[i]),
+        is satisfiable. See kipro2.utils.dnf. The number of pruned cells is recorded in the statistics.
+
+        :param literals: The Boolean expressions whose polarities are enumerated.
+        :param background: A formula that is conjoined to every cell.
+        :return: The list of satisfiable truth value sequences.
+        """
+
+        if self._preprocess_jobs > 1 and len(literals) >= MIN_LITERALS_FOR_PARALLEL_PREPROCESSING:
+            if multiprocessing.current_process().daemon:
+                logger.warning("Cannot start preprocessing workers from a daemonic process, checking sequentially.")
+            else:
+                self._statistics.sat_check_time.start_timer()
+                try:
+                    cells, pruned = parallel_satisfiable_polarities(literals, background, self._preprocess_jobs)
+                finally:
+                    self._statistics.sat_check_time.stop_timer()
+                self._statistics.dnf_cells_pruned += pruned
+                return cells
+
+        cells, pruned = satisfiable_polarities(self._sat_solver, literals, background)
+        self._statistics.dnf_cells_pruned += pruned
+        return cells
+
     def _construct_guard_prob_tick_triple(self, bin_val, pysmt_summation_nf_triple):
         """
         Construct the (b_i, prob_i) (resp. (not b_i, 0)) pairs.
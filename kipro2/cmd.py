@@ -4,15 +4,27 @@ import sys
 from enum import Enum, auto
 from multiprocessing import Pool
 from pathlib import Path
-from typing import Any, Optional, Union, Tuple
+from typing import Any, List, Optional, Union, Tuple
 import attr
 
 import click
 
-from kipro2.incremental_bmc.incremental_bmc import IncrementalBMC
+from kipro2.characteristic_functional import CharacteristicFunctional
+from kipro2.incremental_bmc.incremental_bmc import IncrementalBMC, _setup_logger
+from kipro2.incremental_bmc.multi_candidate_bmc import MultiCandidateBMC
+from kipro2.incremental_bmc.check_schedule import parse_check_schedule
 from kipro2.k_induction.incremental_k_induction import IncrementalKInduction
+from kipro2.k_induction.multi_candidate_k_induction import MultiCandidateKInduction
+from kipro2.explicit.value_iteration import ExplicitValueIteration, DEFAULT_BOX_BOUND, parse_box
+from kipro2.explicit.simulation import MonteCarloSimulation, DEFAULT_RUNS, DEFAULT_MAX_STEPS, DEFAULT_CONFIDENCE
 from kipro2.utils.cmd import CommentArgsCommand
-from kipro2.utils.statistics import Statistics
+from kipro2.utils.statistics import Statistics, add_preprocessing_statistics
+from kipro2.solvers.factory import BACKENDS, SolverBackend
+from kipro2.solvers.activation import SCOPINGS
+from kipro2.solvers.smtlib_process import DEFAULT_SMTLIB_COMMAND
+from kipro2.utils.cache import CharacteristicFunctionalCache, InMemoryFunctionalCache
+from kipro2.pysmt_extensions.formula_template import INSTANTIATION_METHODS
+from kipro2.pysmt_extensions.simplifier import DEFAULT_SIMPLIFIER_CACHE_SIZE
 from kipro2.utils.utils import setup_sigint_handler, picklable_exceptions
 from kipro2.utils.utils import set_max_memory
 
@@ -24,7 +36,8 @@ logger = logging.getLogger("kipro2")
 @click.option('--post', type=click.STRING, help="The post-expectation.")
 @click.option('--pre',
               type=click.STRING,
-              help="The upper bound to the pre-expectation.")
+              multiple=True,
+              help="The upper bound to the pre-expectation. If given several times, the checkers bmc, kind and combined check all candidate upper bounds on one unrolling.")
 @click.option('--stats-path',
               type=click.Path(),
               help="A path where to write a statistics file into.")
@@ -37,10 +50,10 @@ logger = logging.getLogger("kipro2")
               help="Throw an error if refutation cannot be done in N steps.")
 @click.option(
     '--checker',
-    type=click.Choice(['bmc', 'kind', 'both']),
+    type=click.Choice(['bmc', 'kind', 'both', 'combined', 'explicit', 'simulate']),
     default="both",
     help=
-    "Which checker to use. If 'both' is selected, the stats path will be modified."
+    "Which checker to use. If 'both' is selected, the stats path will be modified. 'combined' runs k-induction and BMC in one process on a shared unrolling, each with its own solver. 'explicit' runs value iteration on the states of --box to refute the upper bound, 'simulate' estimates the values of the states of --box by Monte Carlo simulation to falsify it."
 )
 @click.option('--name',
               type=click.STRING,
@@ -53,8 +66,123 @@ logger = logging.getLogger("kipro2")
 )
 @click.option('--memory-limit',
               help="Maximum memory for each process in megabytes.")
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    help=
+    "A directory in which preprocessed characteristic functionals are cached across runs."
+)
+@click.option(
+    '--preprocess-jobs',
+    type=click.INT,
+    default=1,
+    help=
+    "Number of worker processes for the satisfiability checks during preprocessing."
+)
+@click.option(
+    '--instantiation',
+    type=click.Choice(INSTANTIATION_METHODS),
+    default="template",
+    help=
+    "How formulae are instantiated when unrolling: by substituting and simplifying whole formulae or from precompiled templates."
+)
+@click.option(
+    '--simplifier-cache-size',
+    type=click.INT,
+    default=DEFAULT_SIMPLIFIER_CACHE_SIZE,
+    help=
+    "Maximum number of memoized simplification results kept across unrolling depths."
+)
+@click.option(
+    '--bmc-check-schedule',
+    type=click.STRING,
+    default="fixed:1",
+    help=
+    "At which unrolling depths BMC checks for a refutation: fixed:N (every N unrollings), geometric:F (depths growing by factor F), cost-ratio:R (while SAT check time is at most R times formula generation time, at the latest when the depth doubled) or explicit:D1,D2,... ."
+)
+@click.option(
+    '--backend',
+    type=click.Choice(BACKENDS),
+    default="pysmt",
+    help=
+    "The solver backend: pysmt's z3 solver, z3 terms built directly through the z3 API (z3-native) or an external SMT-LIB2 solver process (smtlib)."
+)
+@click.option(
+    '--smtlib-solver',
+    type=click.STRING,
+    default=DEFAULT_SMTLIB_COMMAND,
+    help="The command line of the SMT-LIB2 solver for --backend smtlib.")
+@click.option(
+    '--solver-timeout',
+    type=click.FLOAT,
+    help="Time limit in seconds for every check of the SMT-LIB2 solver (--backend smtlib).")
+@click.option(
+    '--solver-memory-limit',
+    type=click.INT,
+    help="Memory limit in megabytes for the SMT-LIB2 solver process (--backend smtlib).")
+@click.option(
+    '--scoping',
+    type=click.Choice(SCOPINGS),
+    default="push-pop",
+    help=
+    "How the checkers retract temporary formulae: by popping solver scopes (push-pop) or by disabling activation literals that guard them (activation), which keeps the lemmas the solver learned."
+)
+@click.option(
+    '--pipeline/--no-pipeline',
+    default=False,
+    help=
+    "For --checker bmc and kind: Whether to generate the formulae for the next unrolling depth in a background thread while the solver checks the current depth."
+)
+@click.option(
+    '--box',
+    type=click.STRING,
+    help=
+    "For --checker explicit and simulate: The states explored, as comma-separated bounds like 'toSend<=10, maxFailed<=5' (forms x<=N, x<N, x=N and M<=x<=N). Unbounded variables range from 0 to %s."
+    % DEFAULT_BOX_BOUND)
+@click.option(
+    '--exact/--no-exact',
+    default=False,
+    help=
+    "For --checker explicit: Whether to compute with exact fractions instead of floating point numbers (refutations found in floating point are confirmed exactly anyway)."
+)
+@click.option(
+    '--runs',
+    type=click.INT,
+    default=DEFAULT_RUNS,
+    help="For --checker simulate: The number of simulated runs per initial state.")
+@click.option(
+    '--max-steps',
+    type=click.INT,
+    default=DEFAULT_MAX_STEPS,
+    help=
+    "For --checker simulate: The number of loop iterations after which a run is cut off.")
+@click.option(
+    '--confidence',
+    type=click.FLOAT,
+    default=DEFAULT_CONFIDENCE,
+    help=
+    "For --checker simulate: The confidence level for flagging initial states whose estimated value exceeds the upper bound (for all initial states together)."
+)
+@click.option('--seed',
+              type=click.INT,
+              help="For --checker simulate: A seed for the random number generator.")
+@click.option(
+    '--simulate-first/--no-simulate-first',
+    default=False,
+    help=
+    "Run the Monte Carlo simulation (see --checker simulate) before the checker and stop if it flags a state."
+)
+@click.option(
+    '--dump-smt2',
+    type=click.Path(file_okay=False),
+    help=
+    "A directory into which the interaction with the solver is written as an SMT-LIB2 script per checker (see kipro2_replay)."
+)
 def main(program, post, pre, stats_path, assert_inductive, assert_refute,
-         checker, name, ert, memory_limit):
+         checker, name, ert, memory_limit, cache_dir, preprocess_jobs,
+         instantiation, simplifier_cache_size, bmc_check_schedule, backend,
+         smtlib_solver, solver_timeout, solver_memory_limit, scoping, pipeline, box, exact,
+         runs, max_steps, confidence, seed, simulate_first, dump_smt2):
     setup_sigint_handler()
     if memory_limit is not None:
         set_max_memory(int(memory_limit))
@@ -66,6 +194,22 @@ def main(program, post, pre, stats_path, assert_inductive, assert_refute,
         assert_inductive is not None and assert_refute is not None
     ), "--assert-inductive and --assert-refute are mutually exclusive"
 
+    # Several upper bounds are candidates that are checked on one unrolling
+    candidates = list(pre) if len(pre) > 1 else None
+    pre = pre[0] if len(pre) == 1 else None
+    if candidates is not None and (checker not in ['bmc', 'kind', 'combined'] or simulate_first):
+        raise Exception("Several --pre values are only supported by --checker bmc, kind and combined (without --simulate-first).")
+
+    # Fail early on invalid schedules and boxes
+    parse_check_schedule(bmc_check_schedule)
+    parse_box(box if box is not None else "")
+
+    solver_backend = SolverBackend(name=backend,
+                                   smtlib_command=smtlib_solver,
+                                   timeout=solver_timeout,
+                                   memory_limit=solver_memory_limit,
+                                   scoping=scoping)
+
     if assert_inductive is not None:
         assert_inductive = int(assert_inductive)
     if assert_refute is not None:
@@ -88,10 +232,20 @@ def main(program, post, pre, stats_path, assert_inductive, assert_refute,
                          program_code=program_code,
                          post=post,
                          pre=pre,
+                         candidates=candidates,
                          stats_path=stats_path_bmc,
                          assert_inductive=assert_inductive,
                          assert_refute=assert_refute,
-                         ert=ert)
+                         ert=ert,
+                         cache_dir=cache_dir,
+                         functional_cache=functional_cache,
+                         preprocess_jobs=preprocess_jobs,
+                         instantiation=instantiation,
+                         simplifier_cache_size=simplifier_cache_size,
+                         bmc_check_schedule=bmc_check_schedule,
+                         backend=solver_backend,
+                         dump_smt2=dump_smt2,
+                         pipeline=pipeline)
 
     def kind_task() -> 'CheckTask':
         if stats_path is not None:
@@ -107,19 +261,117 @@ def main(program, post, pre, stats_path, assert_inductive, assert_refute,
                          program_code=program_code,
                          post=post,
                          pre=pre,
+                         candidates=candidates,
                          stats_path=stats_path_kind,
                          assert_inductive=assert_inductive,
                          assert_refute=assert_refute,
-                         ert=ert)
+                         ert=ert,
+                         cache_dir=cache_dir,
+                         functional_cache=functional_cache,
+                         preprocess_jobs=preprocess_jobs,
+                         instantiation=instantiation,
+                         simplifier_cache_size=simplifier_cache_size,
+                         backend=solver_backend,
+                         dump_smt2=dump_smt2,
+                         pipeline=pipeline)
+
+    def combined_task() -> 'CheckTask':
+        return CheckTask(name=name,
+                         checker=Checker.COMBINED,
+                         program=program,
+                         program_code=program_code,
+                         post=post,
+                         pre=pre,
+                         candidates=candidates,
+                         stats_path=stats_path,
+                         assert_inductive=assert_inductive,
+                         assert_refute=assert_refute,
+                         ert=ert,
+                         cache_dir=cache_dir,
+                         functional_cache=functional_cache,
+                         preprocess_jobs=preprocess_jobs,
+                         instantiation=instantiation,
+                         simplifier_cache_size=simplifier_cache_size,
+                         backend=solver_backend,
+                         dump_smt2=dump_smt2,
+                         pipeline=pipeline)
+
+    def explicit_task() -> 'CheckTask':
+        return CheckTask(name=name,
+                         checker=Checker.EXPLICIT,
+                         program=program,
+                         program_code=program_code,
+                         post=post,
+                         pre=pre,
+                         stats_path=stats_path,
+                         assert_inductive=assert_inductive,
+                         assert_refute=assert_refute,
+                         ert=ert,
+                         cache_dir=cache_dir,
+                         functional_cache=functional_cache,
+                         preprocess_jobs=preprocess_jobs,
+                         box=box,
+                         exact=exact)
+
+    def simulate_task() -> 'CheckTask':
+        if stats_path is not None and checker != 'simulate':
+            stats_path_simulate = Path(str(_append_stem(stats_path, "simulate")))
+        else:
+            stats_path_simulate = stats_path
+        return CheckTask(name=name,
+                         checker=Checker.SIMULATE,
+                         program=program,
+                         program_code=program_code,
+                         post=post,
+                         pre=pre,
+                         stats_path=stats_path_simulate,
+                         assert_inductive=assert_inductive,
+                         assert_refute=assert_refute,
+                         ert=ert,
+                         cache_dir=cache_dir,
+                         functional_cache=functional_cache,
+                         preprocess_jobs=preprocess_jobs,
+                         box=box,
+                         runs=runs,
+                         max_steps=max_steps,
+                         confidence=confidence,
+                         seed=seed)
+
+    # Tasks after the first (in this process or in the workers of 'both') load the characteristic functional
+    # preprocessed by the first one instead of preprocessing it again.
+    functional_cache = None
+    if checker == 'both' or simulate_first:
+        functional_cache = InMemoryFunctionalCache(
+            CharacteristicFunctionalCache(cache_dir) if cache_dir is not None else None)
+
+    if simulate_first and checker != 'simulate':
+        if _run_check_task(simulate_task()).status == "likely-refuted":
+            return
 
     if checker == 'bmc':
         _run_check_task(bmc_task())
+    elif checker == 'simulate':
+        _run_check_task(simulate_task())
+    elif checker == 'explicit':
+        _run_check_task(explicit_task())
     elif checker == 'kind':
         _run_check_task(kind_task())
+    elif checker == 'combined':
+        _run_check_task(combined_task())
     else:
+        tasks = [bmc_task(), kind_task()]
+        # The statistics of preprocessing here are part of the statistics of both checkers.
+        preprocessing_statistics = Statistics(dict())
+        for task in tasks:
+            task.preprocessing_statistics = preprocessing_statistics
+        try:
+            CharacteristicFunctional(program_code, post, preprocessing_statistics, functional_cache, preprocess_jobs)
+        except Exception as e:
+            for task in tasks:
+                task.write_statistics(task.make_statistics(), "oom" if isinstance(e, MemoryError) else "err")
+            raise e
         pool = Pool(2)
-        for _done in pool.imap_unordered(_run_check_task_picklable_exceptions,
-                                         [bmc_task(), kind_task()]):
+        for _done in pool.imap_unordered(_run_check_task_picklable_exceptions, tasks):
             pool.terminate()
             break
         pool.close()
@@ -129,8 +381,17 @@ def main(program, post, pre, stats_path, assert_inductive, assert_refute,
 class Checker(Enum):
     BMC = auto()
     K_INDUCTION = auto()
+    EXPLICIT = auto()
+    SIMULATE = auto()
+    COMBINED = auto()
 
     def __str__(self) -> str:
+        if self == Checker.COMBINED:
+            return "combined"
+        elif self == Checker.EXPLICIT:
+            return "explicit"
+        elif self == Checker.SIMULATE:
+            return "simulate"
         return "bmc" if self == Checker.BMC else "kind"
 
 
@@ -141,14 +402,34 @@ class CheckTask:
     program: Path = attr.ib()
     program_code: str = attr.ib()
     post: str = attr.ib()
-    pre: str = attr.ib()
+    pre: Optional[str] = attr.ib()
     stats_path: Optional[Path] = attr.ib()
     assert_inductive: Optional[int] = attr.ib()
     assert_refute: Optional[int] = attr.ib()
     ert: Optional[bool] = attr.ib()
+    cache_dir: Optional[str] = attr.ib(default=None)
+    functional_cache: Optional[InMemoryFunctionalCache] = attr.ib(default=None)
+    """A cache of preprocessed functionals to use instead of the one in cache_dir."""
+    preprocess_jobs: int = attr.ib(default=1)
+    instantiation: str = attr.ib(default="template")
+    simplifier_cache_size: Optional[int] = attr.ib(default=DEFAULT_SIMPLIFIER_CACHE_SIZE)
+    bmc_check_schedule: str = attr.ib(default="fixed:1")
+    backend: SolverBackend = attr.ib(factory=SolverBackend)
+    dump_smt2: Optional[str] = attr.ib(default=None)
+    pipeline: bool = attr.ib(default=False)
+    box: Optional[str] = attr.ib(default=None)
+    exact: bool = attr.ib(default=False)
+    runs: int = attr.ib(default=DEFAULT_RUNS)
+    max_steps: int = attr.ib(default=DEFAULT_MAX_STEPS)
+    confidence: float = attr.ib(default=DEFAULT_CONFIDENCE)
+    seed: Optional[int] = attr.ib(default=None)
+    candidates: Optional[List[str]] = attr.ib(default=None)
+    """Several upper bounds to check on one unrolling instead of pre (for the checkers bmc, kind and combined)."""
+    preprocessing_statistics: Optional[Statistics] = attr.ib(default=None)
+    """The statistics of preprocessing the characteristic functional in another process (see --checker both)."""
 
     def make_statistics(self) -> Statistics:
-        return Statistics({
+        args = {
             "name": self.name,
             "checker": str(self.checker),
             "program": str(self.program),
@@ -156,32 +437,163 @@ class CheckTask:
             "pre": self.pre,
             "assert_inductive": self.assert_inductive,
             "assert_refute": self.assert_refute,
-        })
+        }
+        if self.candidates is not None:
+            args["candidates"] = self.candidates
+        statistics = Statistics(args)
+        if self.preprocessing_statistics is not None:
+            add_preprocessing_statistics(statistics, self.preprocessing_statistics)
+        return statistics
+
+    def make_cache(self) -> Optional[Union[CharacteristicFunctionalCache, InMemoryFunctionalCache]]:
+        if self.functional_cache is not None:
+            return self.functional_cache
+        if self.cache_dir is None:
+            return None
+        return CharacteristicFunctionalCache(self.cache_dir)
+
+    def smt2_path(self, checker: Optional[Checker] = None) -> Optional[str]:
+        """
+        :param checker: The checker whose solver is recorded, if not the checker of this task.
+        """
+        if self.dump_smt2 is None:
+            return None
+        Path(self.dump_smt2).mkdir(parents=True, exist_ok=True)
+        stem = self.name if self.name is not None else Path(self.program).stem
+        return str(Path(self.dump_smt2).joinpath(f"{stem}-{checker if checker is not None else self.checker}.smt2"))
 
     def make_bmc(self, statistics: Statistics) -> IncrementalBMC:
         assert self.checker == Checker.BMC
+        if self.candidates is not None:
+            self._check_candidate_options(["assert_inductive", "assert_refute"])
+            return MultiCandidateBMC(program=self.program_code,
+                                     post_expectation=self.post,
+                                     upper_bound_expectations=self.candidates,
+                                     statistics=statistics,
+                                     ert=self.ert,
+                                     cache=self.make_cache(),
+                                     preprocess_jobs=self.preprocess_jobs,
+                                     instantiation=self.instantiation,
+                                     simplifier_cache_size=self.simplifier_cache_size,
+                                     check_schedule=parse_check_schedule(self.bmc_check_schedule),
+                                     backend=self.backend,
+                                     dump_smt2=self.smt2_path(),
+                                     pipeline=self.pipeline)
         return IncrementalBMC(program=self.program_code,
                               post_expectation=self.post,
                               upper_bound_expectation=self.pre,
                               statistics=statistics,
                               assert_refute=self.assert_refute,
-                              ert=self.ert)
-
-    def make_kind(self, statistics: Statistics) -> IncrementalKInduction:
+                              ert=self.ert,
+                              cache=self.make_cache(),
+                              preprocess_jobs=self.preprocess_jobs,
+                              instantiation=self.instantiation,
+                              simplifier_cache_size=self.simplifier_cache_size,
+                              check_schedule=parse_check_schedule(self.bmc_check_schedule),
+                              backend=self.backend,
+                              dump_smt2=self.smt2_path(),
+                              pipeline=self.pipeline)
+
+    def make_kind(self, statistics: Statistics) -> Union[IncrementalKInduction, MultiCandidateKInduction]:
         assert self.checker == Checker.K_INDUCTION
+        if self.candidates is not None:
+            return self.make_multi_candidate_kind(statistics)
         return IncrementalKInduction(program=self.program_code,
                                      post_expectation=self.post,
                                      upper_bound_expectation=self.pre,
                                      statistics=statistics,
                                      assert_inductive=self.assert_inductive,
                                      assert_refute=self.assert_refute,
-                                     ert=self.ert)
+                                     ert=self.ert,
+                                     cache=self.make_cache(),
+                                     preprocess_jobs=self.preprocess_jobs,
+                                     instantiation=self.instantiation,
+                                     simplifier_cache_size=self.simplifier_cache_size,
+                                     backend=self.backend,
+                                     dump_smt2=self.smt2_path(),
+                                     pipeline=self.pipeline)
+
+    def make_combined(self, statistics: Statistics) -> Union[IncrementalKInduction, MultiCandidateKInduction]:
+        assert self.checker == Checker.COMBINED
+        if self.candidates is not None:
+            return self.make_multi_candidate_kind(statistics)
+        return IncrementalKInduction(program=self.program_code,
+                                     post_expectation=self.post,
+                                     upper_bound_expectation=self.pre,
+                                     statistics=statistics,
+                                     bmc_if_not_k_inductive=True,
+                                     assert_inductive=self.assert_inductive,
+                                     assert_refute=self.assert_refute,
+                                     ert=self.ert,
+                                     cache=self.make_cache(),
+                                     preprocess_jobs=self.preprocess_jobs,
+                                     instantiation=self.instantiation,
+                                     simplifier_cache_size=self.simplifier_cache_size,
+                                     backend=self.backend,
+                                     dump_smt2=self.smt2_path(Checker.K_INDUCTION),
+                                     pipeline=self.pipeline,
+                                     bmc_dump_smt2=self.smt2_path(Checker.BMC))
+
+    def make_multi_candidate_kind(self, statistics: Statistics) -> MultiCandidateKInduction:
+        assert self.checker in [Checker.K_INDUCTION, Checker.COMBINED]
+        self._check_candidate_options(["assert_inductive", "assert_refute", "pipeline", "dump_smt2"])
+        return MultiCandidateKInduction(program=self.program_code,
+                                        post_expectation=self.post,
+                                        upper_bound_expectations=self.candidates,
+                                        statistics=statistics,
+                                        bmc_if_not_k_inductive=self.checker == Checker.COMBINED,
+                                        ert=self.ert,
+                                        cache=self.make_cache(),
+                                        preprocess_jobs=self.preprocess_jobs,
+                                        instantiation=self.instantiation,
+                                        simplifier_cache_size=self.simplifier_cache_size,
+                                        backend=self.backend)
+
+    def _check_candidate_options(self, unsupported: List[str]):
+        for option in unsupported:
+            if getattr(self, option):
+                raise Exception("%s is not supported with several candidate upper bounds." % option)
+
+    def make_explicit(self, statistics: Statistics) -> ExplicitValueIteration:
+        assert self.checker == Checker.EXPLICIT
+        return ExplicitValueIteration(program=self.program_code,
+                                      post_expectation=self.post,
+                                      upper_bound_expectation=self.pre,
+                                      statistics=statistics,
+                                      box=self.box,
+                                      assert_refute=self.assert_refute,
+                                      ert=self.ert,
+                                      exact=self.exact,
+                                      cache=self.make_cache(),
+                                      preprocess_jobs=self.preprocess_jobs)
+
+    def make_simulation(self, statistics: Statistics) -> MonteCarloSimulation:
+        assert self.checker == Checker.SIMULATE
+        return MonteCarloSimulation(program=self.program_code,
+                                    post_expectation=self.post,
+                                    upper_bound_expectation=self.pre,
+                                    statistics=statistics,
+                                    box=self.box,
+                                    runs=self.runs,
+                                    max_steps=self.max_steps,
+                                    confidence=self.confidence,
+                                    ert=self.ert,
+                                    seed=self.seed,
+                                    cache=self.make_cache(),
+                                    preprocess_jobs=self.preprocess_jobs)
 
     def make_checker(
         self, statistics: Statistics
-    ) -> Union[IncrementalBMC, IncrementalKInduction]:
+    ) -> Union[IncrementalBMC, IncrementalKInduction, MultiCandidateKInduction, ExplicitValueIteration,
+               MonteCarloSimulation]:
         if self.checker == Checker.BMC:
             return self.make_bmc(statistics)
+        elif self.checker == Checker.EXPLICIT:
+            return self.make_explicit(statistics)
+        elif self.checker == Checker.SIMULATE:
+            return self.make_simulation(statistics)
+        elif self.checker == Checker.COMBINED:
+            return self.make_combined(statistics)
         else:
             return self.make_kind(statistics)
 
@@ -197,10 +609,14 @@ def _run_check_task_picklable_exceptions(check_task: CheckTask) -> Statistics:
     return picklable_exceptions(_run_check_task)(check_task)
 
 
-def _run_check_task(check_task: CheckTask) -> Statistics:
+def _run_check_task(check_task: CheckTask, statistics: Optional[Statistics] = None) -> Statistics:
+    """
+    :param statistics: The statistics to update (by default new ones from check_task.make_statistics()).
+    """
     setup_sigint_handler()
 
-    statistics = check_task.make_statistics()
+    if statistics is None:
+        statistics = check_task.make_statistics()
 
     check_task.write_statistics(statistics, "started")
 
@@ -215,9 +631,19 @@ def _run_check_task(check_task: CheckTask) -> Statistics:
         if isinstance(checker, IncrementalBMC):
             res = checker.apply_bmc()
             status = "undecided" if res else "refuted"
+        elif isinstance(checker, ExplicitValueIteration):
+            res = checker.apply_value_iteration()
+            status = "undecided" if res else "refuted"
+        elif isinstance(checker, MonteCarloSimulation):
+            res = checker.apply_simulation()
+            status = "undecided" if res else "likely-refuted"
         else:
             res = checker.apply_k_induction()
-            status = "inductive" if res else "undecided"
+            status = "inductive" if res else ("refuted" if checker.was_refuted() else "undecided")
+        if statistics.candidates is not None:
+            # The status of all candidates if they agree
+            statuses = {candidate["status"] for candidate in statistics.candidates}
+            status = statuses.pop() if len(statuses) == 1 else "mixed"
     except MemoryError as e:
         check_task.write_statistics(statistics, "oom")
         raise e
@@ -232,28 +658,6 @@ def _run_check_task(check_task: CheckTask) -> Statistics:
     return statistics
 
 
-def _setup_logger(logfile, cmd_loglevel, file_loglevel):
-    logger = logging.getLogger("kipro2")
-    logger.setLevel(cmd_loglevel)
-
-    # create file handler which logs even debug messages
-    fh = logging.FileHandler(logfile)
-    fh.setLevel(file_loglevel)
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(cmd_loglevel)
-    # create formatter and add it to the handlers
-    fileformatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    consoleformatter = logging.Formatter('%(name)s: %(message)s')
-
-    ch.setFormatter(consoleformatter)
-    fh.setFormatter(fileformatter)
-    # add the handlers to logger
-    logger.addHandler(ch)
-    logger.addHandler(fh)
-
-
 def _append_stem(path: str, text: str) -> str:
     p = Path(path)
     name_parts = p.name.split(".")
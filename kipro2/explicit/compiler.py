@@ -0,0 +1,186 @@
+"""
+Compilation of the pysmt terms of a characteristic functional into Python functions.
+
+The generated functions take the values of the program variables as arguments and work on scalars as well as on
+NumPy arrays of states (one entry per state). Every subterm is computed once, even if it is shared by several terms,
+so all guards, probabilities, substitutions and expectations of a functional are best compiled into one function.
+"""
+
+from fractions import Fraction
+from typing import Callable, List, Optional, Tuple
+
+import attr
+import numpy as np
+import pysmt.operators as op
+from pysmt.fnode import FNode
+
+from kipro2.characteristic_functional import CharacteristicFunctional
+
+# The uninterpreted functions with which CharacteristicFunctional encodes monus (see ProbablyExprConverter)
+MONUS_FUNCTIONS = {"Monus", "RMonus"}
+
+_to_fraction = np.vectorize(Fraction, otypes=[object])
+
+
+def _not(x):
+    return np.logical_not(x)
+
+
+def _ite(condition, then_value, else_value):
+    if isinstance(condition, np.ndarray):
+        return np.where(condition, then_value, else_value)
+    return then_value if condition else else_value
+
+
+def _monus(a, b):
+    difference = a - b
+    if isinstance(difference, np.ndarray):
+        return np.maximum(difference, 0)
+    return max(difference, 0)
+
+
+def _exact_div(a, b):
+    # Python's / on integers yields floats
+    return (_to_fraction(a) if isinstance(a, np.ndarray) else Fraction(a)) / b
+
+
+_INFIX_OPERATORS = {
+    op.PLUS: " + ",
+    op.TIMES: " * ",
+    op.MINUS: " - ",
+    op.LE: " <= ",
+    op.LT: " < ",
+    op.EQUALS: " == ",
+    op.IFF: " == ",
+    op.AND: " & ",
+    op.OR: " | ",
+}
+
+
+def compile_terms(terms: List[FNode], variables: List[FNode], exact: bool = False,
+                  infinity: Optional[FNode] = None) -> Callable[..., Tuple]:
+    """
+    :param terms: The terms to compile. Their symbols must be variables (or infinity).
+    :param variables: The program variables, in the order of the arguments of the compiled function.
+    :param exact: Whether to compute with Fractions instead of floats. Values of Boolean and integer terms are the
+        same either way.
+    :param infinity: The symbol that represents infinity (see CharacteristicFunctional). It is a float infinity in
+        both cases.
+    :return: A function mapping the values of the variables to the tuple of the values of the terms.
+    """
+    namespace = {"_not": _not, "_ite": _ite, "_monus": _monus, "_exact_div": _exact_div, "_inf": float("inf")}
+    names = {var: "x%s" % i for (i, var) in enumerate(variables)}
+    if infinity is not None:
+        names[infinity] = "_inf"
+    lines = []
+
+    def constant(value) -> str:
+        name = "_k%s" % len(namespace)
+        namespace[name] = value
+        return name
+
+    def compile_node(node: FNode, args: List[str]) -> str:
+        node_type = node.node_type()
+        if node_type in _INFIX_OPERATORS:
+            return "(%s)" % _INFIX_OPERATORS[node_type].join(args) if args else repr(node_type == op.AND)
+        elif node_type == op.BOOL_CONSTANT or node_type == op.INT_CONSTANT:
+            return repr(node.constant_value())
+        elif node_type == op.REAL_CONSTANT:
+            return constant(Fraction(node.constant_value())) if exact else repr(float(node.constant_value()))
+        elif node_type == op.DIV:
+            return "_exact_div(%s, %s)" % tuple(args) if exact else "(%s / %s)" % tuple(args)
+        elif node_type == op.TOREAL:
+            return args[0] if exact else "(%s * 1.0)" % args[0]
+        elif node_type == op.NOT:
+            return "_not(%s)" % args[0]
+        elif node_type == op.IMPLIES:
+            return "(_not(%s) | %s)" % tuple(args)
+        elif node_type == op.ITE:
+            return "_ite(%s, %s, %s)" % tuple(args)
+        elif node_type == op.FUNCTION and node.function_name().symbol_name() in MONUS_FUNCTIONS:
+            return "_monus(%s, %s)" % tuple(args)
+        raise Exception("Cannot compile %s." % op.op_to_str(node_type))
+
+    # Assign the value of every compound subterm to a local variable, children first
+    for term in terms:
+        stack = [(term, False)]
+        while stack:
+            (node, children_compiled) = stack.pop()
+            if node in names:
+                continue
+            if node.is_symbol():
+                raise Exception("The symbol %s is not a variable." % node.symbol_name())
+            if not children_compiled:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.args() if child not in names)
+                continue
+            expression = compile_node(node, [names[child] for child in node.args()])
+            if node.args():
+                names[node] = "t%s" % len(lines)
+                lines.append("    %s = %s" % (names[node], expression))
+            else:
+                names[node] = expression
+
+    source = "def _compiled(%s):\n%s\n    return (%s%s)\n" % (", ".join(names[var] for var in variables),
+                                                             "\n".join(lines),
+                                                             ", ".join(names[term] for term in terms),
+                                                             "," if len(terms) == 1 else "")
+    exec(compile(source, "<kipro2 compiled terms>", "exec"), namespace)
+    return namespace["_compiled"]
+
+
+@attr.s
+class FunctionalValues:
+    """
+    The values of the DNFs of a characteristic functional (and of an upper bound) in some states.
+    """
+    loop_terminated: List[Tuple] = attr.ib()
+    """(guard, arith) for every entry of the loop terminated DNF."""
+    loop_execute: List[Tuple] = attr.ib()
+    """(guard, [(prob, substitution index, tick), ...]) for every entry of the loop execute DNF."""
+    successors: List[Tuple] = attr.ib()
+    """The values of the variables after applying each of the loop execute substitutions."""
+    upper_bound: List[Tuple] = attr.ib()
+    """(guard, arith) for every entry of the upper bound DNF."""
+
+
+class CompiledFunctional:
+    """
+    The guards, probabilities, substitutions, ticks and expectations of a characteristic functional and of an upper
+    bound DNF, compiled into one function (see compile_terms).
+    """
+
+    def __init__(self, characteristic_functional: CharacteristicFunctional, upper_bound_dnf, exact: bool = False):
+        """
+        :param upper_bound_dnf: An upper bound DNF (see CharacteristicFunctional.probably_string_expectation_to_pysmt_dnf).
+        :param exact: Whether to compute with Fractions instead of floats.
+        """
+        terms = []
+
+        def add(term: FNode) -> int:
+            terms.append(term)
+            return len(terms) - 1
+
+        variables = characteristic_functional.get_pysmt_program_variables()
+        substitutions = characteristic_functional.get_loop_execute_substitutions()
+        self._loop_terminated = [(add(guard), add(arith)) for (guard, arith)
+                                 in characteristic_functional.get_loop_terminated_guard_and_arith_exp_pairs()]
+        self._loop_execute = [(add(guard), [(add(prob), substitutions.index(sub), add(tick))
+                                            for (prob, sub, tick) in prob_sub_ticks])
+                              for (guard, prob_sub_ticks)
+                              in characteristic_functional.get_loop_execute_guard_and_prob_sub_pairs()]
+        self._successors = [[add(sub.get(var, var)) for var in variables] for sub in substitutions]
+        self._upper_bound = [(add(guard), add(arith)) for (guard, arith) in upper_bound_dnf]
+        self._function = compile_terms(terms, variables, exact, characteristic_functional._pysmt_infinity_variable)
+
+    def evaluate(self, values) -> FunctionalValues:
+        """
+        :param values: The values of the program variables (scalars or arrays of the same length).
+        """
+        results = self._function(*values)
+        return FunctionalValues(
+            loop_terminated=[(results[guard], results[arith]) for (guard, arith) in self._loop_terminated],
+            loop_execute=[(results[guard], [(results[prob], sub, results[tick]) for (prob, sub, tick) in branches])
+                          for (guard, branches) in self._loop_execute],
+            successors=[tuple(results[i] for i in successor) for successor in self._successors],
+            upper_bound=[(results[guard], results[arith]) for (guard, arith) in self._upper_bound])
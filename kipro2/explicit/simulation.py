@@ -0,0 +1,184 @@
+"""
+Monte Carlo simulation of the loop to falsify candidate upper bounds cheaply.
+
+Every initial state of a box (see kipro2.explicit.value_iteration.parse_box) is simulated many times. All runs are
+executed at once with NumPy arrays: In every step, the runs that are still active evaluate the guards of the
+loop-execute and loop-terminated DNFs of the characteristic functional, sample a probabilistic branch and apply its
+substitution (and add its tick in case of ert). A run that leaves the loop yields the value of the loop-terminated
+part. Runs that are still active after max_steps steps yield the ticks collected so far (i.e., 0 for wp), so the
+mean value of the runs from a state s estimates Phi^max_steps(0)(s), a lower bound of lfp Phi at s.
+
+An initial state is flagged if the lower end of the confidence interval of its estimate exceeds the candidate upper
+bound. The confidence level holds for all initial states together (Bonferroni correction). Unlike the other
+checkers, a flagged state is strong evidence but no proof that the upper bound is wrong.
+"""
+
+import logging
+import math
+from typing import List, Optional
+
+import numpy as np
+from kipro2.characteristic_functional import CharacteristicFunctional
+from kipro2.explicit.compiler import CompiledFunctional
+from kipro2.explicit.value_iteration import StateBox, parse_box
+from kipro2.utils.cache import CharacteristicFunctionalCache
+from kipro2.utils.statistics import Statistics
+
+logger = logging.getLogger("kipro2")
+
+DEFAULT_RUNS = 10000
+DEFAULT_MAX_STEPS = 1000
+DEFAULT_CONFIDENCE = 0.999
+
+# The maximal number of runs that are simulated at once
+MAX_BATCH_SIZE = 1000000
+
+
+def normal_quantile(p: float) -> float:
+    """
+    :return: The x with P(X <= x) = p for a standard normally distributed X.
+    """
+    (low, high) = (-40.0, 40.0)
+    for _ in range(100):
+        middle = (low + high) / 2
+        if 0.5 * math.erfc(-middle / math.sqrt(2)) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+class MonteCarloSimulation:
+
+    def __init__(self, program, post_expectation, upper_bound_expectation, statistics: Statistics,
+                 box: Optional[str] = None, runs: int = DEFAULT_RUNS, max_steps: int = DEFAULT_MAX_STEPS,
+                 confidence: float = DEFAULT_CONFIDENCE, ert: Optional[bool] = False, seed: Optional[int] = None,
+                 cache: Optional[CharacteristicFunctionalCache] = None, preprocess_jobs: int = 1):
+        """
+        :param program: The pGCL program.
+        :param post_expectation: The postexpectation.
+        :param upper_bound_expectation: The candidate upper bound expectation that is to be falsified.
+        :param box: The bounds of the initial states (see parse_box).
+        :param runs: The number of runs per initial state.
+        :param max_steps: The number of loop iterations after which a run is cut off.
+        :param confidence: The confidence level of the intervals (for all initial states together).
+        :param seed: An optional seed for the random number generator.
+        :param cache: An optional cache for the preprocessed characteristic functional.
+        :param preprocess_jobs: Number of worker processes for preprocessing the characteristic functional.
+        """
+        if runs < 2:
+            raise Exception("At least 2 runs per initial state are needed to estimate the variance.")
+        self._runs = runs
+        self._max_steps = max_steps
+        self._confidence = confidence
+        self._ert = ert
+        self._random = np.random.default_rng(seed)
+        self._statistics = statistics
+
+        self._characteristic_functional = CharacteristicFunctional(program, post_expectation, statistics, cache,
+                                                                   preprocess_jobs)
+        self._upper_bound_dnf = self._characteristic_functional.probably_string_expectation_to_pysmt_dnf(
+            upper_bound_expectation)
+        self._variables = self._characteristic_functional.get_pysmt_program_variables()
+        self._box = StateBox(self._variables, parse_box(box if box is not None else ""))
+        self._compiled_functional = CompiledFunctional(self._characteristic_functional, self._upper_bound_dnf)
+        self._truncated_runs = 0
+
+    def apply_simulation(self) -> bool:
+        """
+        Simulate the runs from all initial states of the box.
+
+        Returns `False` if the upper bound is (very likely) wrong, `True` otherwise.
+        """
+        z = normal_quantile(1 - (1 - self._confidence) / self._box.size)
+        states_per_batch = max(1, MAX_BATCH_SIZE // self._runs)
+        for start in range(0, self._box.size, states_per_batch):
+            initial_states = np.arange(start, min(start + states_per_batch, self._box.size))
+            values = self._simulate([np.repeat(c[initial_states], self._runs) for c in self._box.coordinates])
+            values = values.reshape(len(initial_states), self._runs)
+            means = values.mean(axis=1)
+            half_widths = z * values.std(axis=1, ddof=1) / math.sqrt(self._runs)
+            upper_bounds = self._upper_bounds(initial_states)
+
+            flagged = np.flatnonzero(means - half_widths > upper_bounds)
+            if len(flagged) > 0:
+                i = flagged[0]
+                self._statistics.total_time.stop_timer()
+                print("Likely refuted. (State: %s. Estimated value: %.6g +- %.2g at %s confidence. Upper bound: %.6g)"
+                      % (self._box.state(initial_states[i]), means[i], half_widths[i], self._confidence,
+                         upper_bounds[i]))
+                print(self._statistics)
+                return False
+
+        self._statistics.total_time.stop_timer()
+        print("No state clearly exceeds the upper bound. (%s states, %s runs each, %s runs cut off after %s steps)"
+              % (self._box.size, self._runs, self._truncated_runs, self._max_steps))
+        print(self._statistics)
+        return True
+
+    def _simulate(self, states: List[np.ndarray]) -> np.ndarray:
+        """
+        Simulate one run from each of the given states.
+
+        :param states: The arrays of the values of the program variables.
+        :return: The values of the runs.
+        """
+        values = np.zeros(len(states[0]))
+        # The runs that are still active and their current states
+        active = np.arange(len(states[0]))
+        for _ in range(self._max_steps):
+            if len(active) == 0:
+                break
+            functional_values = self._compiled_functional.evaluate(states)
+
+            def array(value):
+                return np.broadcast_to(np.asarray(value, dtype=float), (len(active),))
+
+            def mask(value):
+                return np.broadcast_to(np.asarray(value, dtype=bool), (len(active),))
+
+            for (guard, arith) in functional_values.loop_terminated:
+                terminated = mask(guard)
+                values[active[terminated]] += array(arith)[terminated]
+
+            # Runs that do not execute the loop body stop. If they did not terminate either (i.e., the probabilities
+            # of the branches sum up to less than 1), they stop with the ticks collected so far.
+            continuing = np.zeros(len(active), dtype=bool)
+            successors = list(states)
+            sample = self._random.random(len(active))
+            for (guard, branches) in functional_values.loop_execute:
+                guard_mask = mask(guard)
+                cumulative = np.zeros(len(active))
+                for (prob, sub, tick) in branches:
+                    next_cumulative = cumulative + array(prob)
+                    chosen = guard_mask & (cumulative <= sample) & (sample < next_cumulative)
+                    cumulative = next_cumulative
+                    continuing |= chosen
+                    # The compiled function returns the very same array for variables the substitution keeps.
+                    successors = [successor if value is state else np.where(chosen, value, successor)
+                                  for (state, value, successor)
+                                  in zip(states, functional_values.successors[sub], successors)]
+                    if self._ert:
+                        values[active[chosen]] += array(tick)[chosen]
+            if continuing.all():
+                states = successors
+            else:
+                states = [successor[continuing] for successor in successors]
+                active = active[continuing]
+
+        self._truncated_runs += len(active)
+        return values
+
+    def _upper_bounds(self, initial_states: np.ndarray) -> np.ndarray:
+        """
+        :return: The candidate upper bound at the given states (infinity where it is infinite).
+        """
+        functional_values = self._compiled_functional.evaluate([c[initial_states] for c in self._box.coordinates])
+        upper_bounds = np.full(len(initial_states), float("inf"))
+        for (guard, arith) in functional_values.upper_bound:
+            upper_bounds = np.where(np.broadcast_to(np.asarray(guard, dtype=bool), (len(initial_states),)),
+                                    np.asarray(arith, dtype=float), upper_bounds)
+        return upper_bounds
+
+    def get_characteristic_functional(self):
+        return self._characteristic_functional
@@ -0,0 +1,294 @@
+"""
+Explicit-state value iteration on a bounded box of program states.
+
+For the states s in a box such as 0 <= toSend <= 10, 0 <= maxFailed <= 5, ..., the ExplicitValueIteration computes
+V_k(s) with V_0 = 0 and V_{k+1} = Phi(V_k), where Phi is the characteristic functional and every state outside the
+box has value 0. Since Phi is monotonic, V_k <= Phi^k(0) <= lfp Phi, so every state s with V_k(s) > pre(s) refutes
+the candidate upper bound pre. States near the border of the box are under-approximated, which is sound for
+refutations.
+
+All states of the box are evaluated at once with NumPy arrays, either in floating point or exactly (with Fractions).
+Refutations found in floating point are confirmed before they are reported by computing Phi^k(0) exactly at the
+violating state.
+"""
+
+import logging
+import re
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pysmt.fnode import FNode
+
+from kipro2.characteristic_functional import CharacteristicFunctional
+from kipro2.explicit.compiler import CompiledFunctional
+from kipro2.utils.cache import CharacteristicFunctionalCache
+from kipro2.utils.statistics import Statistics
+
+logger = logging.getLogger("kipro2")
+
+# The upper bound of the variables for which the box does not specify one
+DEFAULT_BOX_BOUND = 10
+
+# The number of violating states at which a refutation found in floating point is confirmed
+MAX_CONFIRMATIONS = 10
+
+_BOUND_PATTERN = re.compile(r"^\s*(?:(\d+)\s*<=\s*)?([A-Za-z_]\w*)\s*(<=|<|=)\s*(\d+)\s*$")
+
+
+def parse_box(box: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parse a comma-separated list of bounds of the form "x<=N", "x<N", "x=N" or "M<=x<=N".
+
+    :return: The (inclusive) lower and upper bound of every variable occurring in box.
+    """
+    bounds = dict()
+    for bound in box.split(","):
+        if bound.strip() == "":
+            continue
+        match = _BOUND_PATTERN.match(bound)
+        if match is None:
+            raise Exception("Invalid bound %s. Bounds are of the form x<=N, x<N, x=N or M<=x<=N." % bound.strip())
+        (lower, var, relation, upper) = match.groups()
+        upper = int(upper)
+        if relation == "<":
+            upper -= 1
+        lower = upper if relation == "=" else int(lower) if lower is not None else 0
+        if lower > upper:
+            raise Exception("The bound %s is empty." % bound.strip())
+        bounds[var] = (lower, upper)
+    return bounds
+
+
+class StateBox:
+    """
+    The states of a box, enumerated in row-major order.
+    """
+
+    def __init__(self, variables: List[FNode], bounds: Dict[str, Tuple[int, int]]):
+        """
+        :param variables: The program variables.
+        :param bounds: The bounds of (some of) the variables. Other variables range from 0 to DEFAULT_BOX_BOUND.
+        """
+        unknown = set(bounds) - {var.symbol_name() for var in variables}
+        if unknown:
+            raise Exception("The box bounds unknown variables %s." % ", ".join(sorted(unknown)))
+        self.variables = variables
+        self.lower = np.array([bounds.get(var.symbol_name(), (0, DEFAULT_BOX_BOUND))[0] for var in variables])
+        self.upper = np.array([bounds.get(var.symbol_name(), (0, DEFAULT_BOX_BOUND))[1] for var in variables])
+        self.shape = tuple(self.upper - self.lower + 1)
+        self.size = int(np.prod(self.shape))
+        coordinates = np.meshgrid(*[np.arange(l, u + 1) for (l, u) in zip(self.lower, self.upper)], indexing="ij")
+        self.coordinates = [c.ravel() for c in coordinates]
+
+    def values(self, exact: bool) -> List[np.ndarray]:
+        """
+        :return: The arrays of the values of the variables (as Python integers if exact).
+        """
+        return [c.astype(object) if exact else c for c in self.coordinates]
+
+    def indices(self, coordinates: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: The indices of the states with the given coordinates and a mask of the states that lie in the box.
+            The indices of states outside the box are arbitrary.
+        """
+        coordinates = [np.broadcast_to(np.asarray(c, dtype=np.int64), (self.size,)) for c in coordinates]
+        inside = np.logical_and.reduce([(c >= l) & (c <= u) for (c, l, u) in zip(coordinates, self.lower, self.upper)])
+        clipped = [np.clip(c, l, u) - l for (c, l, u) in zip(coordinates, self.lower, self.upper)]
+        return np.ravel_multi_index(clipped, self.shape), inside
+
+    def state(self, index: int) -> Dict[str, int]:
+        return {var.symbol_name(): int(c[index]) for (var, c) in zip(self.variables, self.coordinates)}
+
+
+class _Iteration:
+    """
+    The characteristic functional, evaluated on all states of a box (in floating point or exactly).
+    """
+
+    def __init__(self, compiled_functional: CompiledFunctional, box: StateBox, ert: bool, exact: bool):
+        zero = Fraction(0) if exact else 0.0
+        dtype = object if exact else float
+        functional_values = compiled_functional.evaluate(box.values(exact))
+
+        def array(value):
+            return np.broadcast_to(np.asarray(value, dtype=dtype), (box.size,))
+
+        def mask(value):
+            return np.broadcast_to(np.asarray(value, dtype=bool), (box.size,))
+
+        # The successor indices for every substitution
+        self._successors = [box.indices(successor) for successor in functional_values.successors]
+
+        # The value of the loop terminated part (and of the ticks in case of ert), and the weight of every
+        # substitution, i.e., the sum of the probabilities of the branches applying the substitution.
+        self._base = np.full(box.size, zero, dtype=dtype)
+        for (guard, arith) in functional_values.loop_terminated:
+            self._base = np.where(mask(guard), array(arith), self._base)
+        self._weights = [np.full(box.size, zero, dtype=dtype) for _ in self._successors]
+        for (guard, branches) in functional_values.loop_execute:
+            guard_mask = mask(guard)
+            for (prob, sub, tick) in branches:
+                weighted = np.where(guard_mask, array(prob), zero)
+                self._weights[sub] = self._weights[sub] + weighted
+                if ert:
+                    self._base = self._base + np.where(guard_mask, weighted * array(tick), zero)
+
+        # The candidate upper bound. Nothing exceeds the states for which it is infinite (and not part of the DNF).
+        self.upper_bound = np.full(box.size, float("inf"), dtype=dtype)
+        for (guard, arith) in functional_values.upper_bound:
+            self.upper_bound = np.where(mask(guard), array(arith), self.upper_bound)
+
+        self.values = np.full(box.size, zero, dtype=dtype)
+
+    def step(self):
+        values = self._base
+        for ((indices, inside), weight) in zip(self._successors, self._weights):
+            successor_values = np.where(inside, self.values[indices], 0)
+            # States that do not apply the substitution must not inherit infinite values of its successors (0*inf)
+            with np.errstate(invalid="ignore"):
+                values = values + np.where(weight != 0, weight * successor_values, 0)
+        self.values = values
+
+    def violations(self) -> np.ndarray:
+        return np.flatnonzero(self.values > self.upper_bound)
+
+
+class ExplicitValueIteration:
+
+    def __init__(self, program, post_expectation, upper_bound_expectation, statistics: Statistics,
+                 box: Optional[str] = None, max_iterations=500, assert_refute: Optional[int] = None,
+                 ert: Optional[bool] = False, exact: bool = False, cache: Optional[CharacteristicFunctionalCache] = None,
+                 preprocess_jobs: int = 1):
+        """
+        :param program: The pGCL program.
+        :param post_expectation: The postexpectation.
+        :param upper_bound_expectation: The candidate upper bound expectation that is to be refuted.
+        :param box: The bounds of the states that are explored (see parse_box).
+        :param max_iterations: Maximum number of iterations.
+        :param exact: Whether to compute with Fractions instead of floats.
+        :param cache: An optional cache for the preprocessed characteristic functional.
+        :param preprocess_jobs: Number of worker processes for preprocessing the characteristic functional.
+        """
+        self._max_iterations = max_iterations
+        self._assert_refute = assert_refute
+        self._ert = ert
+        self._exact = exact
+        self._statistics = statistics
+
+        self._characteristic_functional = CharacteristicFunctional(program, post_expectation, statistics, cache,
+                                                                   preprocess_jobs)
+        self._upper_bound_dnf = self._characteristic_functional.probably_string_expectation_to_pysmt_dnf(
+            upper_bound_expectation)
+        self._box = StateBox(self._characteristic_functional.get_pysmt_program_variables(),
+                             parse_box(box if box is not None else ""))
+        logger.debug("Explicit value iteration on %s states." % self._box.size)
+        # exact -> CompiledFunctional
+        self._compiled_functionals = dict()
+        # state -> result of _exact_transitions
+        self._transitions = dict()
+
+    def _compiled_functional(self, exact: bool) -> CompiledFunctional:
+        if exact not in self._compiled_functionals:
+            self._compiled_functionals[exact] = CompiledFunctional(self._characteristic_functional,
+                                                                   self._upper_bound_dnf, exact)
+        return self._compiled_functionals[exact]
+
+    def _make_iteration(self, exact: bool) -> _Iteration:
+        self._statistics.compute_formulae_time.start_timer()
+        iteration = _Iteration(self._compiled_functional(exact), self._box, self._ert, exact)
+        self._statistics.compute_formulae_time.stop_timer()
+        return iteration
+
+    def apply_value_iteration(self) -> bool:
+        """
+        Run value iteration. As in BMC, unrolling depth k refers to Phi^(k+1)(0).
+
+        Returns `False` for refutations, `True` otherwise.
+        """
+        iteration = self._make_iteration(self._exact)
+        depth = 0
+        for depth in range(self._max_iterations):
+            previous_values = iteration.values
+            iteration.step()
+            violations = iteration.violations()
+            if len(violations) > 0:
+                witness = violations[0] if self._exact else self._confirm(depth, violations)
+                if witness is not None:
+                    return self._refute(depth, witness)
+            if np.array_equal(previous_values, iteration.values):
+                logger.info("Value iteration converged at unrolling depth %s." % depth)
+                break
+
+        self._statistics.total_time.stop_timer()
+        print("No refute on %s states until unrolling depth %s." % (self._box.size, depth))
+        print(self._statistics)
+        return True
+
+    def _confirm(self, depth: int, violations: np.ndarray) -> Optional[int]:
+        """
+        Rule out rounding errors by computing Phi^(depth+1)(0) exactly at (some of) the violating states.
+
+        :return: A state among violations that is a refutation, or None if rounding errors caused all violations.
+        """
+        for witness in violations[:MAX_CONFIRMATIONS]:
+            state = tuple(int(c[witness]) for c in self._box.coordinates)
+            if self._exact_value(state, depth + 1) > self._exact_upper_bound(state):
+                return witness
+        logger.warning("Violations at unrolling depth %s are caused by rounding errors." % depth)
+        return None
+
+    def _exact_value(self, state: Tuple[int, ...], applications: int):
+        """
+        :return: Phi^applications(0) at state (not restricted to the box).
+        """
+        # The states reachable in j steps for j < applications
+        layers = [{state}]
+        for _ in range(applications - 1):
+            layers.append({successor for s in layers[-1] for (_, successor) in self._exact_transitions(s)[1]})
+        values = dict()
+        for layer in reversed(layers):
+            values = {s: self._exact_transitions(s)[0] + sum(weight * values.get(successor, 0)
+                                                             for (weight, successor) in self._exact_transitions(s)[1])
+                      for s in layer}
+        return values[state]
+
+    def _exact_transitions(self, state: Tuple[int, ...]):
+        """
+        :return: The value of the loop terminated part (and the ticks in case of ert) at state, and the weight and
+            successor of every branch of the loop body.
+        """
+        if state not in self._transitions:
+            functional_values = self._compiled_functional(True).evaluate(state)
+            base = 0
+            for (guard, arith) in functional_values.loop_terminated:
+                if guard:
+                    base = arith
+            branches = []
+            for (guard, prob_sub_ticks) in functional_values.loop_execute:
+                if guard:
+                    for (prob, sub, tick) in prob_sub_ticks:
+                        branches.append((prob, tuple(int(value) for value in functional_values.successors[sub])))
+                        if self._ert:
+                            base = base + prob * tick
+            self._transitions[state] = (base, branches)
+        return self._transitions[state]
+
+    def _exact_upper_bound(self, state: Tuple[int, ...]):
+        for (guard, arith) in self._compiled_functional(True).evaluate(state).upper_bound:
+            if guard:
+                return arith
+        return float("inf")
+
+    def _refute(self, depth: int, witness: int) -> bool:
+        self._statistics.total_time.stop_timer()
+        print("Refute. (Unrolling_depth = %s. State: %s)" % (depth, self._box.state(witness)))
+        print(self._statistics)
+        self._statistics.k = depth
+        if self._assert_refute is not None:
+            # The values are under-approximated, so a refutation may be found later than with BMC.
+            assert depth >= self._assert_refute, "Unrolling depth does not match assertion"
+        return False
+
+    def get_characteristic_functional(self):
+        return self._characteristic_functional
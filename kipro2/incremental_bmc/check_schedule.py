@@ -0,0 +1,119 @@
+"""
+Schedules deciding at which unrolling depths IncrementalBMC checks for a refutation.
+
+Checking every depth is wasteful for deep refutations: All checks before the refuting depth are UNSAT, and each of them
+is at least as expensive as the previous one. Skipping checks is sound, since Phi^k(0) is monotonic in k. A refutation
+is then found at some depth between the last UNSAT check and the true refutation depth (inclusive).
+
+A schedule is given on the command line as "<name>:<parameter>", e.g. "fixed:1", "geometric:2", "cost-ratio:0.5" or
+"explicit:1,2,4,8".
+"""
+
+import math
+from typing import List
+
+from kipro2.utils.statistics import Statistics
+
+CHECK_SCHEDULES = ["fixed", "geometric", "cost-ratio", "explicit"]
+
+
+class CheckSchedule:
+
+    def should_check(self, depth: int, statistics: Statistics) -> bool:
+        """
+        Whether to check for a refutation at the given unrolling depth. Called once per depth (depth = 1, 2, ...),
+        before the formulae for this depth are generated.
+        """
+        raise NotImplementedError()
+
+
+class FixedCheckSchedule(CheckSchedule):
+    """
+    Check every `interval` unrollings.
+    """
+
+    def __init__(self, interval: int = 1):
+        if interval < 1:
+            raise Exception("There has to be at least one unrolling between two SAT checks.")
+        self._interval = interval
+
+    def should_check(self, depth: int, statistics: Statistics) -> bool:
+        return depth % self._interval == 0
+
+
+class GeometricCheckSchedule(CheckSchedule):
+    """
+    Check at depth 1 and then at depth max(d+1, ceil(d*factor)) after a check at depth d.
+    """
+
+    def __init__(self, factor: float = 2):
+        if factor < 1:
+            raise Exception("The factor of a geometric schedule must be at least 1.")
+        self._factor = factor
+        self._next_depth = 1
+
+    def should_check(self, depth: int, statistics: Statistics) -> bool:
+        if depth < self._next_depth:
+            return False
+        self._next_depth = max(depth + 1, math.ceil(depth * self._factor))
+        return True
+
+
+class CostRatioCheckSchedule(CheckSchedule):
+    """
+    Check only while the time spent in SAT checks is at most `ratio` times the time spent computing formulae.
+    This bounds the overhead of (UNSAT) refutation checks relative to the unrolling itself.
+
+    To guarantee progress, we check at the latest when the depth has doubled since the last check.
+    """
+
+    def __init__(self, ratio: float):
+        if ratio <= 0:
+            raise Exception("The ratio of a cost ratio schedule must be positive.")
+        self._ratio = ratio
+        self._last_check_depth = 0
+
+    def should_check(self, depth: int, statistics: Statistics) -> bool:
+        if depth >= 2 * self._last_check_depth or \
+                statistics.sat_check_time.value <= self._ratio * statistics.compute_formulae_time.value:
+            self._last_check_depth = depth
+            return True
+        return False
+
+
+class ExplicitCheckSchedule(CheckSchedule):
+    """
+    Check at the given depths. After the last given depth, the distance between the last two depths is kept.
+    """
+
+    def __init__(self, depths: List[int]):
+        depths = sorted(set(depths))
+        if len(depths) == 0 or depths[0] < 1:
+            raise Exception("An explicit schedule needs at least one depth and all depths must be positive.")
+        self._depths = set(depths)
+        self._last_depth = depths[-1]
+        self._interval = depths[-1] - depths[-2] if len(depths) > 1 else 1
+
+    def should_check(self, depth: int, statistics: Statistics) -> bool:
+        if depth <= self._last_depth:
+            return depth in self._depths
+        return (depth - self._last_depth) % self._interval == 0
+
+
+def parse_check_schedule(spec: str) -> CheckSchedule:
+    """
+    Parse a schedule of the form "<name>:<parameter>" (see CHECK_SCHEDULES).
+    """
+    (name, _, parameter) = spec.partition(":")
+    try:
+        if name == "fixed":
+            return FixedCheckSchedule(int(parameter) if parameter else 1)
+        elif name == "geometric":
+            return GeometricCheckSchedule(float(parameter) if parameter else 2)
+        elif name == "cost-ratio":
+            return CostRatioCheckSchedule(float(parameter) if parameter else 1)
+        elif name == "explicit":
+            return ExplicitCheckSchedule([int(depth) for depth in parameter.split(",")])
+    except ValueError:
+        raise Exception("Invalid parameter for check schedule %s." % spec)
+    raise Exception("Unknown check schedule %s. Known schedules are %s." % (spec, ", ".join(CHECK_SCHEDULES)))
@@ -2,7 +2,8 @@ from pysmt.shortcuts import GE, GT, Symbol, FunctionType, REAL, INT, Equals, Ite
 from kipro2.characteristic_functional import CharacteristicFunctional
 from kipro2.utils.utils import *
 from kipro2.pysmt_extensions.euf_substituter import EUFMGSubstituter
-from kipro2.pysmt_extensions.simplifier import Simplifier
+from kipro2.pysmt_extensions.simplifier import Simplifier, DEFAULT_SIMPLIFIER_CACHE_SIZE
+from kipro2.pysmt_extensions.formula_template import FormulaInstantiator
 import logging
 
 logger = logging.getLogger("kipro2")
@@ -12,7 +13,7 @@ class FormulaGenerator:
     Class responsible for generating the (loop_terminate and loop_execute) formulae for incremental BMC.
     """
 
-    def __init__(self, characteristic_functional : CharacteristicFunctional, upper_bound_expectation, simplify_formulae, ert):
+    def __init__(self, characteristic_functional : CharacteristicFunctional, upper_bound_expectation, simplify_formulae, ert, instantiation = "template", simplifier_cache_size = DEFAULT_SIMPLIFIER_CACHE_SIZE):
 
         self._characteristic_functional = characteristic_functional
         self._pysmt_program_variables = self._characteristic_functional.get_pysmt_program_variables()
@@ -20,6 +21,7 @@ class FormulaGenerator:
         self._upper_bound_dnf = self._characteristic_functional.probably_string_expectation_to_pysmt_dnf(upper_bound_expectation)
         self._simplify_formulae = simplify_formulae
         self._ert = ert
+        self._instantiation = instantiation
 
         # The uninterpreted functions are of type Int^(#program variables) -> Real
 
@@ -29,10 +31,15 @@ class FormulaGenerator:
         # For unrolling_depth==0, we do not have an uninterpreted function
         self._eufs = []
         self._euf_substituter = EUFMGSubstituter(get_env())
-        self._simplifier = Simplifier(get_env())
+        # The simplifier is shared by all unrolling depths (and by the k-induction formula generator). It brings
+        # linear arguments (including decrements by monus) into a canonical form, so equivalent argument tuples coincide.
+        self._simplifier = Simplifier(get_env(), simplifier_cache_size, normalize_affine=True,
+                                      monus_euf=self._characteristic_functional.monus_euf,
+                                      non_negative_atoms=self._pysmt_program_variables)
         # Store Real(0) for later use
         self._realzero = Real(0)
-        self._new_loop_execute_formulae = None
+        # The distinct argument tuples with which the newest uninterpreted function is applied (see prepare_next_depth)
+        self._frontier = [self._characteristic_functional.get_pysmt_program_variables_argument()]
         self._prepare_first_formulae()
 
     def _prepare_first_formulae(self):
@@ -45,7 +52,7 @@ class FormulaGenerator:
 
         # P_1 is supposed to encode Phi^(unrolling_depth)(0).
         # Hence, the refutation query has to involve P_1.
-        self._refute_query = self._construct_refute_query_for_euf(first_euf)
+        self._refute_query = self._construct_refute_query_for_euf(first_euf, self._upper_bound_dnf)
 
         # There are three kinds of formulae:
         # 1. loop_terminated formulae are of the form
@@ -85,6 +92,13 @@ class FormulaGenerator:
                                     Equals(Function(self._characteristic_functional.rmonus_euf, (min_1, min_2)), Real(0))))
             for (min_1, min_2) in self._characteristic_functional.rmonus_pairs}
 
+        # Formulae for deeper unrollings are instances of the formulae for the first one
+        self._loop_terminated_instantiator = self._formula_instantiator(self._loop_terminated_formulae)
+        self._zero_step_not_terminated_instantiator = self._formula_instantiator(self._zero_step_not_terminated_formulae)
+        self._loop_execute_instantiator = self._formula_instantiator(self._loop_execute_formulae)
+        self._monus_instantiator = self._formula_instantiator(self._monus_formulae)
+        self._rmonus_instantiator = self._formula_instantiator(self._rmonus_formulae)
+
         logger.debug("\n" * 2)
         logger.debug("Loop terminated formulae: \n %s" % [form.serialize() for form in self._loop_terminated_formulae])
         logger.debug("Zero step not terminated formulae: \n %s" % [form.serialize() for form in self._zero_step_not_terminated_formulae])
@@ -122,67 +136,97 @@ class FormulaGenerator:
         return self._rmonus_formulae
 
     def prepare_next_depth(self):
-        #print(self._simplifier.simplify(Plus(Plus(Symbol("bla", INT), Int(1)), Int(1))))
-        if self._new_loop_execute_formulae != None:
-            self._loop_execute_formulae = self._new_loop_execute_formulae
-
-        old_euf = self._eufs[-2]
-        new_euf = self._eufs[-1]
-
-        new_loop_terminated_formulae = set()
-        new_zero_step_not_terminated_formulae = set()
-        new_monus_formulae = set()
-        new_rmonus_formulae = set()
-
-        for sub in self._characteristic_functional.get_loop_execute_substitutions():
-            sub_copy = sub.copy()
-            sub_copy[old_euf] = new_euf
-
-            new_loop_terminated_formulae.update(substitute_all_formulae(self._loop_terminated_formulae, sub_copy,
-                                                                   self._euf_substituter, self._simplify_formulae, self._simplifier))
-            new_zero_step_not_terminated_formulae.update(substitute_all_formulae(self._zero_step_not_terminated_formulae,
-                                                                            sub_copy, self._euf_substituter, self._simplify_formulae,
-                                                                            self._simplifier))
-            if len(self._monus_formulae) > 0:
-                new_monus_formulae.update(substitute_all_formulae(self._monus_formulae, sub_copy, self._euf_substituter, self._simplify_formulae,
-                                                         self._simplifier))
-            if len(self._rmonus_formulae) > 0:
-                new_rmonus_formulae.update(substitute_all_formulae(self._rmonus_formulae, sub_copy, self._euf_substituter, self._simplify_formulae,
-                                                         self._simplifier))
-
-        self._loop_terminated_formulae = new_loop_terminated_formulae
-        self._zero_step_not_terminated_formulae = new_zero_step_not_terminated_formulae
-        self._monus_formulae = new_monus_formulae
-        self._rmonus_formulae = new_rmonus_formulae
-
-        #TODO: Do we need to copy ?
-        self._new_loop_execute_formulae = set()
+        """
+        Compute the formulae for the next unrolling depth.
+
+        Rather than applying every loop execute substitution to every formula of the previous depth, we keep track of
+        the frontier, i.e., the distinct argument tuples with which the newest uninterpreted function is applied.
+        Argument tuples are canonicalized (simplified) before comparing them, so substitution sequences leading to
+        the same state (e.g. x+1-1 and x) yield a single tuple. The formulae of the first depth are then instantiated
+        at the arguments of the frontier only.
+        """
+        current_euf = self._eufs[-2]
+        next_euf = self._eufs[-1]
+
+        # The loop execute formulae define P_i at the arguments of the current frontier in terms of P_{i+1}.
+        self._loop_execute_formulae = self._loop_execute_instantiator.instantiate(self._frontier, [current_euf, next_euf])
+
+        # The remaining formulae define P_{i+1} at the arguments of the next frontier.
+        self._frontier = self._successor_arguments(self._frontier)
+        logger.debug("Frontier size at unrolling depth %s: %s" % (self.get_unrolling_depth() + 1, len(self._frontier)))
+
+        self._loop_terminated_formulae = self._loop_terminated_instantiator.instantiate(self._frontier, [next_euf])
+        self._zero_step_not_terminated_formulae = self._zero_step_not_terminated_instantiator.instantiate(self._frontier, [next_euf])
+        self._monus_formulae = self._monus_instantiator.instantiate(self._frontier, [next_euf])
+        self._rmonus_formulae = self._rmonus_instantiator.instantiate(self._frontier, [next_euf])
+
         new_new_euf = Symbol("P_%s" % (len(self._eufs) + 1), FunctionType(*self._euf_type))
         self._eufs.append(new_new_euf)
-        for sub in self._characteristic_functional.get_loop_execute_substitutions():
-            intermediate_sub = {new_euf : new_new_euf}
-            sub_copy = sub.copy()
-            sub_copy[old_euf] = new_euf
-            for formula in self._loop_execute_formulae:
-                intermediate_formula = self._euf_substituter.substitute(formula, intermediate_sub)
-                self._new_loop_execute_formulae.add(self._simplifier.simplify(self._euf_substituter.substitute(intermediate_formula, sub_copy))
-                                                    if self._simplify_formulae else self._euf_substituter.substitute(intermediate_formula, sub_copy))
+
+    def _successor_arguments(self, frontier):
+        """
+        Apply every loop execute substitution to every argument tuple of the frontier.
+
+        :return: The distinct canonicalized successor argument tuples (in the order of their first occurrence).
+        """
+        # The right-hand sides of all loop execute substitutions, applied to all arguments in a single walk
+        number_variables = len(self._pysmt_program_variables)
+        updates = [sub.get(var, var) for sub in self._pysmt_loop_execute_substitutions
+                   for var in self._pysmt_program_variables]
+        updates_per_argument = self._euf_substituter.substitute_many(
+            updates, [dict(zip(self._pysmt_program_variables, argument)) for argument in frontier])
+
+        successors = dict()
+        for substituted_updates in updates_per_argument:
+            for i in range(0, len(substituted_updates), number_variables):
+                successor = tuple(map(self._canonicalize, substituted_updates[i:i + number_variables]))
+                successors.setdefault(successor, None)
+        return list(successors)
+
+    def _canonicalize(self, arithmetic_expression):
+        return self._simplifier.simplify(arithmetic_expression) if self._simplify_formulae else arithmetic_expression
+
+    def _formula_instantiator(self, formulae):
+        """
+        Formulae of the first depth (i.e., formulae in the program variables and P_1, P_2) that are instantiated at
+        the arguments of a frontier for other uninterpreted functions.
+        """
+        return FormulaInstantiator(formulae, self._pysmt_program_variables, self._eufs[:2], self._instantiation,
+                                   self._euf_substituter, self._simplifier if self._simplify_formulae else None)
+
+    def get_frontier(self):
+        """
+        Get the distinct argument tuples with which the newest loop terminated formulae apply their uninterpreted function.
+        """
+        return self._frontier
+
+    def get_simplifier(self):
+        return self._simplifier
 
     def get_refute_query(self):
         return self._refute_query
 
-    def _construct_refute_query_for_euf(self, euf):
+    def construct_refute_query(self, upper_bound_expectation):
+        """
+        Constructs the refutation query (see get_refute_query) for another upper bound. The other formulae do not
+        depend on the upper bound.
+        """
+        upper_bound_dnf = self._characteristic_functional.probably_string_expectation_to_pysmt_dnf(upper_bound_expectation)
+        return self._construct_refute_query_for_euf(self._eufs[0], upper_bound_dnf)
+
+    def _construct_refute_query_for_euf(self, euf, upper_bound_dnf):
         """
         Constructs a formula encoding the query
             exists s: Phi^(unrolling_depth)[s] > post_expectation[s]
 
         :param euf: The uninterpreted function encoding the current unrolling depth.
+        :param upper_bound_dnf: The DNF of the upper bound.
         :return: The formula encoding the query.
         """
 
         # TODO: Explain why this query is sound in case we encounter infinity? (unconstrained real,..)
         return Or([And(guard, GT(Function(euf, self._characteristic_functional._pysmt_program_variables_argument), arith))
-                   for (guard, arith) in self._upper_bound_dnf])
+                   for (guard, arith) in upper_bound_dnf])
 
     def get_program_variables_non_negative_constraints(self):
         formulae = set()
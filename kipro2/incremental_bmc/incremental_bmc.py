@@ -1,18 +1,24 @@
 from kipro2.characteristic_functional import CharacteristicFunctional
 from pysmt.shortcuts import Solver
 from kipro2.incremental_bmc.formula_generator import FormulaGenerator
+from kipro2.incremental_bmc.check_schedule import CheckSchedule, FixedCheckSchedule
 from pysmt.logics import QF_UFLIRA
 import logging
 from copy import copy
 from kipro2.utils.utils import *
 from kipro2.utils.statistics import *
-from typing import Optional
+from kipro2.utils.cache import CharacteristicFunctionalCache
+from kipro2.solvers.factory import close_solver, make_solver, SolverBackend
+from kipro2.solvers.pipeline import is_sat_while
+from kipro2.solvers.trace import write_marker
+from kipro2.pysmt_extensions.simplifier import DEFAULT_SIMPLIFIER_CACHE_SIZE
+from typing import Optional, Union
 
 logger = logging.getLogger("kipro2")
 
 class IncrementalBMC:
 
-    def __init__(self, program, post_expectation, upper_bound_expectation, statistics: Statistics, max_iterations = 500, unrollings_between_sat_checks = 1 , simplify_formulae = True, assert_refute: Optional[int] = None, ert:Optional[bool] = False):
+    def __init__(self, program, post_expectation, upper_bound_expectation, statistics: Statistics, max_iterations = 500, unrollings_between_sat_checks = 1 , simplify_formulae = True, assert_refute: Optional[int] = None, ert:Optional[bool] = False, cache: Optional[CharacteristicFunctionalCache] = None, preprocess_jobs: int = 1, instantiation: str = "template", simplifier_cache_size: Optional[int] = DEFAULT_SIMPLIFIER_CACHE_SIZE, check_schedule: Optional[CheckSchedule] = None, backend: Union[str, SolverBackend] = "pysmt", dump_smt2: Optional[str] = None, pipeline: bool = False, characteristic_functional: Optional[CharacteristicFunctional] = None, formula_generator: Optional[FormulaGenerator] = None):
         """
 
         :param var_decl: The variable declarations of the pGCL program.
@@ -20,45 +26,62 @@ class IncrementalBMC:
         :param post_expectation: The postexpectation.
         :param upper_bound_expectation: The candidate upper bound expectation that is to be verified or refuted.
         :param max_iterations: Maximum number of BMC iterations.
-        :param unrollings_between_sat_checks: Number of unrollings between SAT checks.
+        :param unrollings_between_sat_checks: Number of unrollings between SAT checks. Ignored if check_schedule is given.
         :param simplify_formulae: Whether to simplify the formulae or not. Simplification seems to speed things up.
+        :param cache: An optional cache for the preprocessed characteristic functional.
+        :param preprocess_jobs: Number of worker processes for preprocessing the characteristic functional.
+        :param instantiation: How formulae are instantiated when unrolling ("substitute" or "template").
+        :param simplifier_cache_size: Maximum number of memoized simplification results (None for no bound).
+        :param check_schedule: Decides at which unrolling depths to check for a refutation.
+        :param backend: The solver backend (a kipro2.solvers.factory.SolverBackend or the name of one).
+        :param dump_smt2: A file to record the interaction with the solver to (as an SMT-LIB2 script).
+        :param pipeline: Whether to generate the formulae for the next unrolling depth while the solver checks the
+            current one (see kipro2.solvers.pipeline).
+        :param characteristic_functional: Together with formula_generator: An existing unrolling to share with another
+            checker instead of building one. The other checker advances the formula generator (see add_prepared_depth).
+        :param formula_generator: See characteristic_functional.
         """
 
         _setup_logger("log.txt", logging.DEBUG, logging.DEBUG)
         self._max_iterations = max_iterations
         self._ert = ert
+        self._pipeline = pipeline
 
         if ert:
             logger.debug("Checking ERT ...")
         else:
             logger.debug("Checking WP ...")
 
-        self._characteristic_functional = CharacteristicFunctional(program, post_expectation, statistics)
-
-        self._formula_generator = FormulaGenerator(self._characteristic_functional, upper_bound_expectation, simplify_formulae, ert)
+        if formula_generator is not None:
+            assert characteristic_functional is not None, "A shared formula generator needs its characteristic functional"
+            self._characteristic_functional = characteristic_functional
+            self._formula_generator = formula_generator
+        else:
+            self._characteristic_functional = CharacteristicFunctional(program, post_expectation, statistics, cache, preprocess_jobs)
+            self._formula_generator = FormulaGenerator(self._characteristic_functional, upper_bound_expectation, simplify_formulae, ert, instantiation, simplifier_cache_size)
 
         self._statistics = statistics
         self._assert_refute = assert_refute
 
         logger.debug("Program, Pre- and Postexpectations are %s" % ("linear" if self._characteristic_functional.is_linear
                                                                     else "*NON*-linear"))
-        if self._characteristic_functional.is_linear:
-            self._solver = StatisticsSolver(statistics, name="z3", logic=QF_UFLIRA)
-        else:
-            self._solver = StatisticsSolver(statistics, name="z3")
+        logic = QF_UFLIRA if self._characteristic_functional.is_linear else None
+        self._solver = make_solver(statistics, backend, logic, dump_smt2)
 
         self._prepare_for_bmc()
 
-        if unrollings_between_sat_checks < 1:
-            raise Exception("There has to be at least one unrolling between two SAT checks.")
-        self._unrollings_between_sat_checks = unrollings_between_sat_checks - 1
-        self._unrollings_until_next_check = unrollings_between_sat_checks
+        self._check_schedule = check_schedule if check_schedule is not None else FixedCheckSchedule(unrollings_between_sat_checks)
+        # Whether to check for a refutation at the current unrolling depth
+        self._check_current_depth = False
+        # The last unrolling depth at which no refutation was found
+        self._last_checked_depth = 0
 
     def _prepare_for_bmc(self):
         """
         Create first uninterpreted function, construct refutation query, and push first formulae.
         """
         self._statistics.compute_formulae_time.start_timer()
+        write_marker(self._solver, "depth 0")
         # Assert that all program variables evaluate to some non_negative integer
         self._push_program_variables_non_negative_constraints()
 
@@ -78,34 +101,46 @@ class IncrementalBMC:
         # and replaced by loop_execute formulae.
         for formula in self._formula_generator.get_zero_step_not_terminated_formulae():
             self._solver.add_assertion(formula)
+        update_simplifier_statistics(self._statistics, self._formula_generator.get_simplifier())
         self._statistics.compute_formulae_time.stop_timer()
 
     def apply_bmc(self) -> bool:
         """
         Run bounded model checking.
 
-        Returns `False` for refutations, `True` otherwise.
+        Returns `False` for refutations, `True` otherwise. The solver is closed afterwards.
         """
+        try:
+            return self._apply_bmc()
+        finally:
+            self.close()
 
+    def _apply_bmc(self) -> bool:
         for i in range(self._max_iterations):
             #logger.debug("\n"*5)
             #print_all_formulae(self._solver, logger.debug)
-            if self._unrollings_until_next_check == 0:
-                self._unrollings_until_next_check = self._unrollings_between_sat_checks
-                if self.check_refute():
+            # In pipelined mode, the formula generator is already at the next depth after a check.
+            depth = self._formula_generator.get_unrolling_depth()
+            prepared = False
+            if self._check_current_depth:
+                self._statistics.refute_checks += 1
+                if self.check_refute(self._prepare_next_depth if self._pipeline else None):
                     self._statistics.total_time.stop_timer()
-                    print("Refute. (Unrolling_depth = %s. Number formulae = %s)" % (self._formula_generator.get_unrolling_depth(), len(self._solver.assertions)))
+                    print("Refute. (Unrolling_depth = %s. Number formulae = %s)" % (depth, len(self._solver.assertions)))
                     print(self._statistics)
-                    self._statistics.k = self._formula_generator.get_unrolling_depth()
+                    self._statistics.k = depth
                     self._statistics.number_formulae = len(self._solver.assertions)
                     if self._assert_refute is not None:
-                        assert self._assert_refute == self._formula_generator.get_unrolling_depth(), "Unrolling depth does not match assertion"
+                        # If depths were skipped, we only know that the smallest refuting depth lies between the
+                        # last unsuccessful check and the current depth.
+                        assert self._last_checked_depth < self._assert_refute <= depth, "Unrolling depth does not match assertion"
                     return False
-            else:
-                self._unrollings_until_next_check -= 1
+                self._last_checked_depth = depth
+                prepared = self._pipeline
 
             # add zero_step_not_terminated formulae only if we perform a sat check in the next iteration
-            self._increment_unrolling_depth(True if self._unrollings_until_next_check == 0 else False)
+            self._check_current_depth = self._check_schedule.should_check(depth + 1, self._statistics)
+            self._increment_unrolling_depth(self._check_current_depth, prepared)
 
         self._statistics.total_time.stop_timer()
         print("No refute after max_iterations = %s." % self._max_iterations)
@@ -114,33 +149,51 @@ class IncrementalBMC:
             assert self._assert_refute == self._formula_generator.get_unrolling_depth(), "Unrolling depth does not match assertion"
         return True
 
-    def check_refute(self):
+    def check_refute(self, background = None):
         """
         Checks whether there is a program state s such that
                 Phi^(unrolling_depth)[s] > post_expectation[s].
+        :param background: An optional function that is run in another thread during the sat check
+            (see kipro2.solvers.pipeline.is_sat_while).
         :return: True iff there is a state s with Phi^(unrolling_depth)[s] > post_expectation[s].
         """
         #print_all_formulae(self._solver, logger.debug)
         logger.debug("Refutation Check. Current number of formulas: %s" % len(self._solver.assertions))
-        logger.debug("Query: %s" % self._formula_generator.get_refute_query().serialize())
+        query = self._formula_generator.get_refute_query()
+        logger.debug("Query: %s" % query.serialize())
 
         # Create a new solver just for refutation checking. This avoids the use of the incremental solver
         # for the hard problem of the full refutation query, speeding up the runtime overall.
-        if self._solver.is_sat(self._formula_generator.get_refute_query()):
-            logger.info("SAT. Model: \n %s" % self._solver.get_model())
+        (sat, model) = is_sat_while(self._solver, query, background)
+        if sat:
+            logger.info("SAT. Model: \n %s" % model)
             return True
         else:
             return False
 
-    def _increment_unrolling_depth(self, push_onto_solver = True):
+    def add_prepared_depth(self):
+        """
+        Add the formulae for the depth another checker advanced the shared formula generator to (see __init__).
+        """
+        self._increment_unrolling_depth(True, prepared=True)
+
+    def _prepare_next_depth(self):
+        self._statistics.compute_formulae_time.start_timer()
+        # Formula generator needs to generate formulae for next unrolling depth
+        self._formula_generator.prepare_next_depth()
+        self._statistics.compute_formulae_time.stop_timer()
+
+    def _increment_unrolling_depth(self, push_onto_solver = True, prepared = False):
         """
         Add all formulae for encoding Phi^(self._unrolling_depth + 1) onto the solver.
         :param push_onto_solver: Whether to add the zero_step_not_terminated formulae onto the solver or not.
+        :param prepared: Whether the formula generator already is at the next unrolling depth.
         :return:
         """
+        if not prepared:
+            self._prepare_next_depth()
         self._statistics.compute_formulae_time.start_timer()
-        # Formula generator needs to generate formulae for next unrolling depth
-        self._formula_generator.prepare_next_depth()
+        write_marker(self._solver, "depth %s" % self._formula_generator.get_unrolling_depth())
 
         # First pop the last zero_step_not_terminated_formula ..
         self._solver.pop()
@@ -159,6 +212,7 @@ class IncrementalBMC:
             for formula in self._formula_generator.get_zero_step_not_terminated_formulae():
                 self._solver.add_assertion(formula)
 
+        update_simplifier_statistics(self._statistics, self._formula_generator.get_simplifier())
         logger.info("New depth: %s. Number formulae: %s" % (self._formula_generator.get_unrolling_depth(), len(self._solver.assertions)))
         self._statistics.compute_formulae_time.stop_timer()
 
@@ -172,6 +226,15 @@ class IncrementalBMC:
             self._solver.add_assertion(formula)
         self._solver.push()
 
+    def get_solver(self):
+        return self._solver
+
+    def close(self):
+        """
+        Release the solver (and the file given by dump_smt2).
+        """
+        close_solver(self._solver)
+
     def get_formula_generator(self):
         return self._formula_generator
 
@@ -181,6 +244,10 @@ class IncrementalBMC:
 def _setup_logger(logfile, cmd_loglevel, file_loglevel):
     logger = logging.getLogger("kipro2")
     logger.setLevel(cmd_loglevel)
+    # Every checker calls this. Add the handlers only once, otherwise running several checkers in one process
+    # (kipro2_batch, --checker combined) repeats every log line.
+    if logger.handlers:
+        return
 
     # create file handler which logs even debug messages
     fh = logging.FileHandler(logfile)
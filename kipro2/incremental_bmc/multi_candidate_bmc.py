@@ -0,0 +1,118 @@
+from kipro2.characteristic_functional import CharacteristicFunctional
+from kipro2.incremental_bmc.incremental_bmc import IncrementalBMC
+from kipro2.incremental_bmc.formula_generator import FormulaGenerator
+from kipro2.pysmt_extensions.simplifier import DEFAULT_SIMPLIFIER_CACHE_SIZE
+from kipro2.solvers.pipeline import is_sat_while
+from kipro2.utils.cache import CharacteristicFunctionalCache
+from kipro2.utils.statistics import Statistics, record_candidate_results
+from typing import Iterable, List, Optional
+import logging
+
+logger = logging.getLogger("kipro2")
+
+
+class MultiCandidateBMC(IncrementalBMC):
+    """
+    BMC for several candidate upper bounds at once.
+
+    Only the refutation query depends on the upper bound, the unrolling does not. All candidates share one unrolling
+    and one solver. At every depth that is checked, the query of every candidate that is not refuted yet is checked in
+    a scope of its own.
+    """
+
+    def __init__(self, program, post_expectation, upper_bound_expectations: List[str], statistics: Statistics, simplify_formulae = True, ert: Optional[bool] = False, cache: Optional[CharacteristicFunctionalCache] = None, preprocess_jobs: int = 1, instantiation: str = "template", simplifier_cache_size: Optional[int] = DEFAULT_SIMPLIFIER_CACHE_SIZE, characteristic_functional: Optional[CharacteristicFunctional] = None, formula_generator: Optional[FormulaGenerator] = None, **kwargs):
+        """
+        :param upper_bound_expectations: The candidate upper bounds.
+        :param kwargs: Further options of IncrementalBMC, except for assert_refute.
+        """
+        assert "assert_refute" not in kwargs, "assert_refute is not supported for several candidates"
+        if formula_generator is None:
+            characteristic_functional = CharacteristicFunctional(program, post_expectation, statistics, cache, preprocess_jobs)
+            # The formula generator defines Monus (RMonus) for the pairs the functional has encountered so far, so all
+            # candidates have to be translated before. A shared formula generator has to be built the same way.
+            for upper_bound_expectation in upper_bound_expectations:
+                characteristic_functional.probably_string_expectation_to_pysmt_dnf(upper_bound_expectation)
+            formula_generator = FormulaGenerator(characteristic_functional, upper_bound_expectations[0], simplify_formulae, ert, instantiation, simplifier_cache_size)
+        # The refutation queries are built before the solver, whose logic depends on whether all candidates are linear.
+        self._refute_queries = [formula_generator.construct_refute_query(upper_bound_expectation)
+                                for upper_bound_expectation in upper_bound_expectations]
+        super().__init__(program, post_expectation, upper_bound_expectations[0], statistics, ert=ert,
+                         characteristic_functional=characteristic_functional, formula_generator=formula_generator, **kwargs)
+        self._upper_bound_expectations = upper_bound_expectations
+        # The unrolling depth at which every candidate was refuted (None if it is not refuted yet)
+        self._refuting_depths: List[Optional[int]] = [None for _ in upper_bound_expectations]
+        # The number of formulae on the solver when every candidate was refuted
+        self._refuting_numbers_formulae: List[Optional[int]] = [None for _ in upper_bound_expectations]
+
+    def _apply_bmc(self) -> bool:
+        """
+        Run bounded model checking until all candidates are refuted (see apply_bmc). The results per candidate are
+        recorded in statistics.candidates.
+
+        Returns `False` if all candidates are refuted, `True` otherwise.
+        """
+
+        for i in range(self._max_iterations):
+            depth = self._formula_generator.get_unrolling_depth()
+            prepared = False
+            if self._check_current_depth:
+                self.check_candidates(background=self._prepare_next_depth if self._pipeline else None)
+                if None not in self._refuting_depths:
+                    self._statistics.total_time.stop_timer()
+                    print("All candidates refuted. (Unrolling_depth = %s. Number formulae = %s)" % (depth, len(self._solver.assertions)))
+                    self._record_results()
+                    return False
+                prepared = self._pipeline
+
+            # add zero_step_not_terminated formulae only if we perform a sat check in the next iteration
+            self._check_current_depth = self._check_schedule.should_check(depth + 1, self._statistics)
+            self._increment_unrolling_depth(self._check_current_depth, prepared)
+
+        self._statistics.total_time.stop_timer()
+        print("Not all candidates refuted after max_iterations = %s." % self._max_iterations)
+        self._record_results()
+        return True
+
+    def check_candidates(self, candidates: Optional[Iterable[int]] = None, background = None) -> List[int]:
+        """
+        Check the candidates that are not refuted yet for a refutation at the current unrolling depth.
+
+        :param candidates: The indices of the candidates to check (by default all).
+        :param background: An optional function that is run in another thread during the first sat check
+            (see kipro2.solvers.pipeline.is_sat_while). It is run in any case.
+        :return: The indices of the candidates refuted at this depth.
+        """
+        depth = self._formula_generator.get_unrolling_depth()
+        if candidates is None:
+            candidates = range(len(self._upper_bound_expectations))
+        refuted = []
+        for index in candidates:
+            if self._refuting_depths[index] is not None:
+                continue
+            self._statistics.refute_checks += 1
+            logger.debug("Refutation check for %s. Current number of formulas: %s" % (self._upper_bound_expectations[index], len(self._solver.assertions)))
+            (sat, model) = is_sat_while(self._solver, self._refute_queries[index], background)
+            background = None
+            if sat:
+                logger.info("SAT. Model: \n %s" % model)
+                print("Refute %s. (Unrolling_depth = %s)" % (self._upper_bound_expectations[index], depth))
+                self._refuting_depths[index] = depth
+                self._refuting_numbers_formulae[index] = len(self._solver.assertions)
+                refuted.append(index)
+        if background is not None:
+            background()
+        return refuted
+
+    def _record_results(self):
+        record_candidate_results(self._statistics, [
+            {"pre": upper_bound_expectation, "status": "refuted" if depth is not None else "undecided", "k": depth,
+             "number_formulae": number_formulae}
+            for (upper_bound_expectation, depth, number_formulae) in
+            zip(self._upper_bound_expectations, self._refuting_depths, self._refuting_numbers_formulae)])
+        print(self._statistics)
+
+    def get_refuting_depths(self) -> List[Optional[int]]:
+        return self._refuting_depths
+
+    def get_refuting_numbers_formulae(self) -> List[Optional[int]]:
+        return self._refuting_numbers_formulae
@@ -1,7 +1,7 @@
 from kipro2.characteristic_functional import CharacteristicFunctional
 from pysmt.shortcuts import get_env, Symbol, Implies, And, Not, Equals, Function, Or, GT, FunctionType
-from kipro2.pysmt_extensions.simplifier import Simplifier
 from kipro2.pysmt_extensions.euf_substituter import EUFMGSubstituter
+from kipro2.pysmt_extensions.formula_template import FormulaInstantiator
 from kipro2.utils.utils import *
 import logging
 
@@ -9,14 +9,23 @@ logger = logging.getLogger("kipro2")
 
 class FormulaGenerator():
 
-    def __init__(self, characteristic_functional : CharacteristicFunctional, incremental_bmc, upper_bound_expectation, simplify_formulae, ert):
+    def __init__(self, characteristic_functional : CharacteristicFunctional, bmc_formula_generator, upper_bound_expectation, simplify_formulae, ert, instantiation = "template", advance_bmc_formula_generator = True):
+        """
+        :param bmc_formula_generator: The (kipro2.incremental_bmc) formula generator of the BMC encoding this encoding
+            is built on. It is advanced by this formula generator.
+        :param advance_bmc_formula_generator: Whether this formula generator advances the BMC formula generator. If
+            not (e.g. because formula generators for several upper bounds share it), the caller advances the BMC formula
+            generator after creating this formula generator and after every prepare_next_depth, and then calls
+            complete_depth.
+        """
 
         self._characteristic_functional = characteristic_functional
-        self._incremental_bmc = incremental_bmc
-        self._bmc_formula_generator = incremental_bmc.get_formula_generator()
+        self._bmc_formula_generator = bmc_formula_generator
         self._upper_bound_dnf = self._characteristic_functional.probably_string_expectation_to_pysmt_dnf(upper_bound_expectation, ignore_conjuncts_with_infinity=False)
         self._simplify_formulae = simplify_formulae
         self._ert = ert
+        self._instantiation = instantiation
+        self._advance_bmc_formula_generator = advance_bmc_formula_generator
 
         # For the query, we can disregard arithmetic expressions that equal infinity since nothing is greater than infinity.
         self._upper_bound_dnf_for_k_inductive_query = self._characteristic_functional.probably_string_expectation_to_pysmt_dnf(upper_bound_expectation, ignore_conjuncts_with_infinity=True)
@@ -26,14 +35,14 @@ class FormulaGenerator():
         # We have an uninterpreted function K_i for P_i (i=2,3,...) starting with K_2
         self._eufs = [Symbol("K_1", FunctionType(*self._euf_type))]
         self._euf_substituter = EUFMGSubstituter(get_env())
-        self._simplifier = Simplifier(get_env())
-
-        self._prepare_first_formulae()
+        self._simplifier = self._bmc_formula_generator.get_simplifier()
 
         self._unrolling_depth = 1
         # Let I be the candidate upper bound.
         # Invariant: P_1 (from BMC) encodes Phi(Psi^{unrolling_depth -1} (I) .
 
+        self._prepare_first_formulae()
+
     def _prepare_first_formulae(self):
         """
         Prepare formulae for checking 1-inductivity, i.e., whether Phi(I) <= I holds.
@@ -79,26 +88,23 @@ class FormulaGenerator():
                                                       Equals(Function(self._eufs[0], arg), arith_I))))
 
 
+        self._pointwise_minimum_instantiator = self._formula_instantiator(self._pointwise_minimum_formulae,
+                                                                          [first_bmc_euf, self._eufs[0]])
+
         # Next, wee need P_2 to encode the DNF of I ..
         second_bmc_euf = self._bmc_formula_generator.get_eufs()[1]
-        self._continuation_formulae = { Implies(guard,
-                           Equals(Function(second_bmc_euf, self._characteristic_functional.get_pysmt_program_variables_argument()), arith))
-                           for (guard, arith) in self._upper_bound_dnf}
-
-        # and to apply the loop_execute_substitutions
-        new_continuation_formulae = set()
-
-        for sub in self._characteristic_functional.get_loop_execute_substitutions():
-             new_continuation_formulae.update(substitute_all_formulae(self._continuation_formulae, sub, self._euf_substituter, self._simplify_formulae, self._simplifier))
-
-        self._continuation_formulae = new_continuation_formulae
+        self._continuation_instantiator = self._formula_instantiator(
+            {self._simplify(Implies(guard, Equals(Function(second_bmc_euf, self._characteristic_functional.get_pysmt_program_variables_argument()), arith)))
+             for (guard, arith) in self._upper_bound_dnf}, [second_bmc_euf])
 
         # Increment BMC unrolling depth for monus formulae
         # In contrast to BMC, we need the next level of monus/rmonus formulae since the 1-induction check already
         # involves loop execute formulae (for P_1 and P_2).
         self._first_monus_formulae = self._bmc_formula_generator.get_monus_formulae().copy()
         self._first_rmonus_formulae = self._bmc_formula_generator.get_rmonus_formulae().copy()
-        self._incremental_bmc._increment_unrolling_depth(True)
+        if self._advance_bmc_formula_generator:
+            self._bmc_formula_generator.prepare_next_depth()
+            self.complete_depth()
 
         # Now P_1 (self._loop_execute_formulae + self._loop_terminated_formulae + self._continuation_formurlae) encodes Phi(I).
         # Recall that Psi_I(I) = Phi(I) min I
@@ -106,8 +112,6 @@ class FormulaGenerator():
         logger.debug("\n" * 2)
         logger.debug("Loop terminated formulae: \n %s" % [form.serialize() for form in self._loop_terminated_formulae])
         logger.debug("Loop execute formulae: \n %s" % [form.serialize() for form in self._loop_execute_formulae])
-        logger.debug("Continuation formulae: \n %s" % [form.serialize() for form in
-                                                                   self._continuation_formulae])
         logger.debug("The pointwise minimum formulae are: \n %s" % [form.serialize() for form in
                                                        self._pointwise_minimum_formulae])
 
@@ -128,41 +132,40 @@ class FormulaGenerator():
                                                                           self._euf_substituter)
 
 
-        # New continuation_formulae are obtained by subsituting the one-but-last bmc euf by the last one
-        # and by subsequently applying the loop execute substitutions
-        new_continuation_formulae = set()
-        for sub in self._characteristic_functional.get_loop_execute_substitutions():
-            new_sub = sub.copy()
-            new_sub[self._bmc_formula_generator.get_eufs()[-2]] = self._bmc_formula_generator.get_eufs()[-1]
-            new_continuation_formulae.update(
-                substitute_all_formulae(self._continuation_formulae, new_sub, self._euf_substituter,
-                                        self._simplify_formulae, self._simplifier))
+        # The new pointwise minimum formulae are those for the one-but-last bmc euf and the last k_ind_euf,
+        # instantiated at the arguments with which the BMC encoding applies the one-but-last bmc euf
+        self._pointwise_minimum_formulae = self._pointwise_minimum_instantiator.instantiate(
+            self._bmc_formula_generator.get_frontier(), [self._bmc_formula_generator.get_eufs()[-2], self._eufs[-1]])
 
-        self._continuation_formulae = new_continuation_formulae
-
-        # The new continuation formulae are obtained from substituting the one-but-last-last bmc_euf by the one-but-last last bmc_euf
-        # and by the one-but-last k_ind_euf by the last k_ind_euf
-        new_pointwise_minimum_formulae = set()
-        for sub in self._characteristic_functional.get_loop_execute_substitutions():
-            new_sub = sub.copy()
-            #print(self._bmc_formula_generator.get_eufs())
-            new_sub[self._bmc_formula_generator.get_eufs()[-3]] = self._bmc_formula_generator.get_eufs()[-2]
-            new_sub[self._eufs[-2]] = self._eufs[-1]
-            #print(new_sub)
-            new_pointwise_minimum_formulae.update(substitute_all_formulae(self._pointwise_minimum_formulae, new_sub, self._euf_substituter,
-                                        self._simplify_formulae, self._simplifier))
-
-
-        #print({form.serialize() for form in new_pointwise_minimum_formulae})
-
-        self._pointwise_minimum_formulae = new_pointwise_minimum_formulae
         # The loop_terminate_formulae are those from BMC
         self._loop_terminated_formulae = self._bmc_formula_generator.get_loop_terminate_formulae()
 
         # Increment BMC unrolling depth for monus formulae and loop_execute
-        self._incremental_bmc._increment_unrolling_depth(True)
+        if self._advance_bmc_formula_generator:
+            self._bmc_formula_generator.prepare_next_depth()
+            self.complete_depth()
+
+    def complete_depth(self):
+        """
+        Compute the formulae of the current depth that depend on the next depth of the BMC encoding, once the BMC
+        formula generator has been advanced (see advance_bmc_formula_generator).
+        """
+        if self._unrolling_depth > 1:
+            self._loop_execute_formulae = self._bmc_formula_generator.get_loop_execute_formulae()
+
+        # The continuation_formulae encode I for the one-but-last bmc euf at the new frontier of the BMC encoding,
+        # i.e., they apply the loop_execute_substitutions.
+        self._continuation_formulae = self._continuation_instantiator.instantiate(
+            self._bmc_formula_generator.get_frontier(), [self._bmc_formula_generator.get_eufs()[-2]])
+        logger.debug("Continuation formulae: \n %s" % [form.serialize() for form in self._continuation_formulae])
+
+    def _simplify(self, formula):
+        return self._simplifier.simplify(formula) if self._simplify_formulae else formula
 
-        self._loop_execute_formulae = self._bmc_formula_generator.get_loop_execute_formulae()
+    def _formula_instantiator(self, formulae, functions):
+        return FormulaInstantiator(formulae, self._characteristic_functional.get_pysmt_program_variables(), functions,
+                                   self._instantiation, self._euf_substituter,
+                                   self._simplifier if self._simplify_formulae else None)
 
     def get_loop_terminate_formulae(self):
         """
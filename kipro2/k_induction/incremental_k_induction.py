@@ -1,72 +1,121 @@
-from kipro2.incremental_bmc.incremental_bmc import IncrementalBMC
+from kipro2.characteristic_functional import CharacteristicFunctional
+from kipro2.incremental_bmc.formula_generator import FormulaGenerator as BMCFormulaGenerator
+from kipro2.incremental_bmc.incremental_bmc import IncrementalBMC, _setup_logger
 from kipro2.k_induction.formula_generator import FormulaGenerator
 from pysmt.shortcuts import Solver
 from pysmt.logics import QF_UFLIRA
 from kipro2.utils.utils import *
 import logging
 from kipro2.utils.statistics import *
+from kipro2.utils.cache import CharacteristicFunctionalCache
+from kipro2.solvers.factory import close_solver, make_solver, SolverBackend
+from kipro2.solvers.pipeline import is_sat_while
+from kipro2.solvers.trace import write_marker
+from kipro2.pysmt_extensions.simplifier import DEFAULT_SIMPLIFIER_CACHE_SIZE
 import math
-from typing import Optional
+from typing import Optional, Union
 
 logger = logging.getLogger("kipro2")
 
 class IncrementalKInduction():
 
-    def __init__(self, program, post_expectation, upper_bound_expectation, statistics: Statistics, max_iterations = 500, simplify_formulae = True, bmc_if_not_k_inductive = False, assert_inductive: Optional[int] = None, assert_refute: Optional[int] = None, ert:Optional[bool] = False):
+    def __init__(self, program, post_expectation, upper_bound_expectation, statistics: Statistics, max_iterations = 500, simplify_formulae = True, bmc_if_not_k_inductive = False, assert_inductive: Optional[int] = None, assert_refute: Optional[int] = None, ert:Optional[bool] = False, cache: Optional[CharacteristicFunctionalCache] = None, preprocess_jobs: int = 1, instantiation: str = "template", simplifier_cache_size: Optional[int] = DEFAULT_SIMPLIFIER_CACHE_SIZE, backend: Union[str, SolverBackend] = "pysmt", dump_smt2: Optional[str] = None, pipeline: bool = False, bmc_dump_smt2: Optional[str] = None, characteristic_functional: Optional[CharacteristicFunctional] = None, bmc_formula_generator: Optional[BMCFormulaGenerator] = None):
 
-        # We build our encoding for incremental k-induction encoding on top of the BMC encoding
-        self._incremental_bmc = IncrementalBMC(program, post_expectation, upper_bound_expectation, statistics=Statistics(dict()), ert = ert)
+        """
+        :param bmc_if_not_k_inductive: Whether to also check for a refutation at every depth at which the property is
+            not k-inductive. The BMC checker shares the unrolling of this checker but has its own solver.
+        :param bmc_dump_smt2: With bmc_if_not_k_inductive: A file to record the interaction with the BMC solver to.
+        :param characteristic_functional: Together with bmc_formula_generator: An existing unrolling to share with
+            checkers for other upper bounds. The caller advances the BMC formula generator (see prepare_shared_depth
+            and add_prepared_depth) and runs the checks; apply_k_induction is not supported.
+        :param bmc_formula_generator: See characteristic_functional.
+        """
+        _setup_logger("log.txt", logging.DEBUG, logging.DEBUG)
+
+        # We build our encoding for incremental k-induction encoding on top of the BMC encoding. Only the BMC formulae
+        # are needed, not a BMC solver.
         self._ert = ert
-        self._characteristic_functional = self._incremental_bmc.get_characteristic_functional()
-        self._formula_generator = FormulaGenerator(self._characteristic_functional, self._incremental_bmc, upper_bound_expectation, simplify_formulae, ert)
+        shared = bmc_formula_generator is not None
+        if shared:
+            assert characteristic_functional is not None, "A shared formula generator needs its characteristic functional"
+            assert not bmc_if_not_k_inductive, "A shared formula generator is advanced by the caller"
+            self._characteristic_functional = characteristic_functional
+            self._bmc_formula_generator = bmc_formula_generator
+        else:
+            self._characteristic_functional = CharacteristicFunctional(program, post_expectation, statistics, cache, preprocess_jobs)
+            self._bmc_formula_generator = BMCFormulaGenerator(self._characteristic_functional, upper_bound_expectation, simplify_formulae, ert, instantiation, simplifier_cache_size)
         self._bmc_if_not_k_inductive = bmc_if_not_k_inductive
+        self._refuted = False
+        if bmc_if_not_k_inductive:
+            # The BMC checker has to add the formulae of depth 0 before the k-induction encoding advances the unrolling
+            self._incremental_bmc = IncrementalBMC(program, post_expectation, upper_bound_expectation, statistics, ert=ert, backend=backend, dump_smt2=bmc_dump_smt2, characteristic_functional=self._characteristic_functional, formula_generator=self._bmc_formula_generator)
+        self._formula_generator = FormulaGenerator(self._characteristic_functional, self._bmc_formula_generator, upper_bound_expectation, simplify_formulae, ert, instantiation, advance_bmc_formula_generator=not shared)
+        if bmc_if_not_k_inductive:
+            self._incremental_bmc.add_prepared_depth()
 
         self._max_iterations = max_iterations
+        # Whether to generate the formulae for the next unrolling depth during the sat check (see kipro2.solvers.pipeline)
+        self._pipeline = pipeline
 
         logger.debug(
             "Program, Pre- and Postexpectations are %s" % ("linear" if self._characteristic_functional.is_linear
                                                            else "*NON*-linear"))
-        if self._characteristic_functional.is_linear:
-            self._solver = StatisticsSolver(statistics, name="z3", logic=QF_UFLIRA)
-        else:
-            self._solver = StatisticsSolver(statistics, name="z3")
+        logic = QF_UFLIRA if self._characteristic_functional.is_linear else None
+        self._solver = make_solver(statistics, backend, logic, dump_smt2)
 
         self._statistics = statistics
 
         self._assert_inductive = assert_inductive
         self._assert_refute = assert_refute
 
-        self._prepare_for_k_induction()
+        # With a shared unrolling, the first formulae are complete once the caller advanced the BMC formula generator.
+        if not shared:
+            self._prepare_for_k_induction()
 
     def apply_k_induction(self):
+        """
+        Run k-induction (and BMC if bmc_if_not_k_inductive). The solvers are closed afterwards.
+
+        Returns `True` if the property is k-inductive for some k, `False` otherwise.
+        """
+        try:
+            return self._apply_k_induction()
+        finally:
+            self.close()
 
+    def _apply_k_induction(self):
         for i in range(self._max_iterations):
             logger.debug("\n"*5)
             # print_all_formulae(self._solver, logger.debug)
-            if self.is_k_inductive():
+            # In pipelined mode, the formula generator is already at the next depth after the check.
+            depth = self._formula_generator.get_unrolling_depth()
+            if self.is_k_inductive(self._prepare_next_depth if self._pipeline else None):
                 self._statistics.total_time.stop_timer()
-                print("Property is %s-inductive. (Number formulae on k-induction solver = %s)" % (self._formula_generator.get_unrolling_depth(), len(self._solver.assertions)))
+                print("Property is %s-inductive. (Number formulae on k-induction solver = %s)" % (depth, len(self._solver.assertions)))
                 print(self._statistics)
-                self._statistics.k = self._formula_generator.get_unrolling_depth()
+                self._statistics.k = depth
                 self._statistics.number_formulae = len(self._solver.assertions)
                 if self._assert_inductive is not None:
-                    assert self._assert_inductive == self._formula_generator.get_unrolling_depth(), "Unrolling depth does not match assertion"
+                    assert self._assert_inductive == depth, "Unrolling depth does not match assertion"
                 return True
 
             else:
                 if self._bmc_if_not_k_inductive:
-                    raise Exception("Not supported.")
-
-                    # if self._incremental_bmc.check_refute():
-                    #     self._statistics.total_time.stop_timer()
-                    #     print("Refute. (Unrolling_depth = %s. Number formulae on refutation solver = %s)" % (
-                    #     self._formula_generator._bmc_formula_generator.get_unrolling_depth(), len(self._solver.assertions)))
-                    #     print(self._statistics)
-                    #     if self._assert_refute is not None:
-                    #         assert self._assert_refute == self._formula_generator.get_unrolling_depth(), "Unrolling depth does not match assertion"
-                    #     return False
-
-            self._increment_unrolling_depth(True)
+                    self._statistics.refute_checks += 1
+                    if self._incremental_bmc.check_refute():
+                        self._refuted = True
+                        self._statistics.total_time.stop_timer()
+                        print("Refute. (Unrolling_depth = %s. Number formulae on refutation solver = %s)" % (depth, len(self._incremental_bmc.get_solver().assertions)))
+                        print(self._statistics)
+                        self._statistics.k = depth
+                        self._statistics.number_formulae = len(self._incremental_bmc.get_solver().assertions)
+                        if self._assert_refute is not None:
+                            assert self._assert_refute == depth, "Unrolling depth does not match assertion"
+                        return False
+
+            self._increment_unrolling_depth(True, self._pipeline)
+            if self._bmc_if_not_k_inductive:
+                self._incremental_bmc.add_prepared_depth()
 
         self._statistics.total_time.stop_timer()
         print("Not k-inductive until k=%s." % self._max_iterations)
@@ -74,15 +123,23 @@ class IncrementalKInduction():
             assert self._assert_inductive == self._formula_generator.get_unrolling_depth(), "Unrolling depth does not match assertion"
         return False
 
-    def _increment_unrolling_depth(self, push_onto_solver):
+    def _prepare_next_depth(self):
+        self._statistics.compute_formulae_time.start_timer()
+        # Formula generator needs to generate formulae for next unrolling depth
+        self._formula_generator.prepare_next_depth()
+        self._statistics.compute_formulae_time.stop_timer()
+
+    def _increment_unrolling_depth(self, push_onto_solver, prepared = False):
         """
         Add all formulae for encoding Phi^(self._unrolling_depth + 1) onto the solver.
         :param push_onto_solver: Whether to add the zero_step_not_terminated formulae onto the solver or not.
+        :param prepared: Whether the formula generator already is at the next unrolling depth.
         :return:
         """
+        if not prepared:
+            self._prepare_next_depth()
         self._statistics.compute_formulae_time.start_timer()
-        # Formula generator needs to generate formulae for next unrolling depth
-        self._formula_generator.prepare_next_depth()
+        write_marker(self._solver, "depth %s" % self._formula_generator.get_unrolling_depth())
 
         # Pop the last loop_execute_formulae and continuation_formulae
         self._solver.pop()
@@ -108,14 +165,58 @@ class IncrementalKInduction():
         for formula in self._formula_generator.get_continuation_formulae():
             self._solver.add_assertion(formula)
 
+        update_simplifier_statistics(self._statistics, self._bmc_formula_generator.get_simplifier())
         logger.info("New depth: %s. Number formulae: %s" % (
         self._formula_generator.get_unrolling_depth(), len(self._solver.assertions)))
         self._statistics.compute_formulae_time.stop_timer()
 
-    def is_k_inductive(self):
-        logger.debug("Query: %s" % self._formula_generator.get_k_inductive_query().serialize())
-        if self._solver.is_sat(self._formula_generator.get_k_inductive_query()):
-            logger.info("SAT. Model: \n %s" % self._solver.get_model())
+    def prepare_shared_depth(self):
+        """
+        With a shared BMC formula generator (see __init__): Compute the formulae for the next depth, before the caller
+        advances the BMC formula generator.
+        """
+        self._prepare_next_depth()
+
+    def add_prepared_depth(self):
+        """
+        With a shared BMC formula generator (see __init__): Complete the formulae of the next depth and add them, after
+        the caller advanced the BMC formula generator.
+        """
+        self._statistics.compute_formulae_time.start_timer()
+        self._formula_generator.complete_depth()
+        self._statistics.compute_formulae_time.stop_timer()
+        if self._formula_generator.get_unrolling_depth() == 1:
+            self._prepare_for_k_induction()
+        else:
+            self._increment_unrolling_depth(True, prepared=True)
+
+    def was_refuted(self) -> bool:
+        """
+        Whether apply_k_induction returned False because of a refutation (only with bmc_if_not_k_inductive).
+        """
+        return self._refuted
+
+    def get_solver(self):
+        return self._solver
+
+    def close(self):
+        """
+        Release the solvers (and the files given by dump_smt2 and bmc_dump_smt2).
+        """
+        close_solver(self._solver)
+        if self._bmc_if_not_k_inductive:
+            self._incremental_bmc.close()
+
+    def is_k_inductive(self, background = None):
+        """
+        :param background: An optional function that is run in another thread during the sat check
+            (see kipro2.solvers.pipeline.is_sat_while).
+        """
+        query = self._formula_generator.get_k_inductive_query()
+        logger.debug("Query: %s" % query.serialize())
+        (sat, model) = is_sat_while(self._solver, query, background)
+        if sat:
+            logger.info("SAT. Model: \n %s" % model)
             return False
         else:
             return True
@@ -123,6 +224,7 @@ class IncrementalKInduction():
     def _prepare_for_k_induction(self):
 
         self._statistics.compute_formulae_time.start_timer()
+        write_marker(self._solver, "depth %s" % self._formula_generator.get_unrolling_depth())
         # Assert that all program variables evaluate to some non_negative integer
         self._push_program_variables_non_negative_constraints()
 
@@ -147,6 +249,7 @@ class IncrementalKInduction():
         for formula in self._formula_generator.get_loop_execute_formulae():
             self._solver.add_assertion(formula)
 
+        update_simplifier_statistics(self._statistics, self._bmc_formula_generator.get_simplifier())
         self._statistics.compute_formulae_time.stop_timer()
 
     def _push_program_variables_non_negative_constraints(self):
@@ -0,0 +1,125 @@
+from kipro2.characteristic_functional import CharacteristicFunctional
+from kipro2.incremental_bmc.formula_generator import FormulaGenerator as BMCFormulaGenerator
+from kipro2.incremental_bmc.multi_candidate_bmc import MultiCandidateBMC
+from kipro2.k_induction.incremental_k_induction import IncrementalKInduction
+from kipro2.utils.statistics import Statistics, record_candidate_results
+from kipro2.utils.cache import CharacteristicFunctionalCache
+from kipro2.solvers.factory import SolverBackend
+from kipro2.pysmt_extensions.simplifier import DEFAULT_SIMPLIFIER_CACHE_SIZE
+from typing import Dict, List, Optional, Union
+import logging
+
+logger = logging.getLogger("kipro2")
+
+
+class MultiCandidateKInduction:
+    """
+    k-induction for several candidate upper bounds at once.
+
+    The BMC encoding that k-induction is built on does not depend on the upper bound. All candidates share the
+    characteristic functional and the BMC formula generator, which is advanced once per depth. The formulae that depend
+    on the upper bound (the pointwise minimum and continuation formulae and the query) are generated per candidate, and
+    every candidate has its own solver (an IncrementalKInduction on the shared unrolling).
+    """
+
+    def __init__(self, program, post_expectation, upper_bound_expectations: List[str], statistics: Statistics, max_iterations = 500, simplify_formulae = True, bmc_if_not_k_inductive = False, ert: Optional[bool] = False, cache: Optional[CharacteristicFunctionalCache] = None, preprocess_jobs: int = 1, instantiation: str = "template", simplifier_cache_size: Optional[int] = DEFAULT_SIMPLIFIER_CACHE_SIZE, backend: Union[str, SolverBackend] = "pysmt"):
+        """
+        :param upper_bound_expectations: The candidate upper bounds.
+        :param bmc_if_not_k_inductive: Whether to also check the candidates that are not k-inductive for a refutation
+            at every depth, with one MultiCandidateBMC on the shared unrolling.
+        """
+        self._upper_bound_expectations = upper_bound_expectations
+        self._statistics = statistics
+        self._max_iterations = max_iterations
+
+        self._characteristic_functional = CharacteristicFunctional(program, post_expectation, statistics, cache, preprocess_jobs)
+        # Translating the candidates tells whether all of them are linear, which decides the logic of all solvers, and
+        # collects the Monus (RMonus) pairs of all of them, for which the BMC formula generator creates definitions.
+        for upper_bound_expectation in upper_bound_expectations:
+            self._characteristic_functional.probably_string_expectation_to_pysmt_dnf(upper_bound_expectation)
+        self._bmc_formula_generator = BMCFormulaGenerator(self._characteristic_functional, upper_bound_expectations[0], simplify_formulae, ert, instantiation, simplifier_cache_size)
+        self._incremental_bmc = None
+        if bmc_if_not_k_inductive:
+            # The BMC checker has to add the formulae of depth 0 before the unrolling is advanced
+            self._incremental_bmc = MultiCandidateBMC(program, post_expectation, upper_bound_expectations, statistics, ert=ert, backend=backend, characteristic_functional=self._characteristic_functional, formula_generator=self._bmc_formula_generator)
+        self._checkers = [IncrementalKInduction(program, post_expectation, upper_bound_expectation, statistics, max_iterations, simplify_formulae, ert=ert, instantiation=instantiation, backend=backend, characteristic_functional=self._characteristic_functional, bmc_formula_generator=self._bmc_formula_generator)
+                          for upper_bound_expectation in upper_bound_expectations]
+        # The status ("inductive" or "refuted"), depth and number of formulae of every decided candidate
+        self._results: Dict[int, Dict] = dict()
+        self._unrolling_depth = 1
+        self._advance_unrolling(range(len(upper_bound_expectations)))
+
+    def apply_k_induction(self) -> bool:
+        """
+        Check the candidates until all of them are decided. The results per candidate are recorded in
+        statistics.candidates.
+
+        Returns `True` if all candidates are k-inductive (for some k), `False` otherwise. The solvers are closed
+        afterwards.
+        """
+        try:
+            return self._apply_k_induction()
+        finally:
+            self.close()
+
+    def _apply_k_induction(self) -> bool:
+        for i in range(self._max_iterations):
+            depth = self._unrolling_depth
+            for index in self._undecided():
+                if self._checkers[index].is_k_inductive():
+                    print("%s is %s-inductive." % (self._upper_bound_expectations[index], depth))
+                    self._results[index] = {"status": "inductive", "k": depth,
+                                            "number_formulae": len(self._checkers[index].get_solver().assertions)}
+            if self._incremental_bmc is not None and self._undecided():
+                for index in self._incremental_bmc.check_candidates(self._undecided()):
+                    self._results[index] = {"status": "refuted", "k": depth,
+                                            "number_formulae": self._incremental_bmc.get_refuting_numbers_formulae()[index]}
+            if not self._undecided():
+                break
+
+            undecided = self._undecided()
+            for index in undecided:
+                self._checkers[index].prepare_shared_depth()
+            self._advance_unrolling(undecided)
+            self._unrolling_depth += 1
+        else:
+            print("Not all candidates decided until k=%s." % self._max_iterations)
+
+        self._statistics.total_time.stop_timer()
+        record_candidate_results(self._statistics, [
+            dict({"pre": upper_bound_expectation},
+                 **self._results.get(index, {"status": "undecided", "k": None, "number_formulae": None}))
+            for (index, upper_bound_expectation) in enumerate(self._upper_bound_expectations)])
+        print(self._statistics)
+        return all(result["status"] == "inductive" for result in self._statistics.candidates)
+
+    def close(self):
+        """
+        Release the solvers of all candidates.
+        """
+        for checker in self._checkers:
+            checker.close()
+        if self._incremental_bmc is not None:
+            self._incremental_bmc.close()
+
+    def was_refuted(self) -> bool:
+        """
+        Whether all candidates were refuted (only with bmc_if_not_k_inductive).
+        """
+        return self._statistics.candidates is not None and all(
+            result["status"] == "refuted" for result in self._statistics.candidates)
+
+    def _undecided(self) -> List[int]:
+        return [index for index in range(len(self._checkers)) if index not in self._results]
+
+    def _advance_unrolling(self, candidates: List[int]):
+        """
+        Advance the shared BMC formula generator and add the formulae of the next depth for the given candidates.
+        """
+        self._statistics.compute_formulae_time.start_timer()
+        self._bmc_formula_generator.prepare_next_depth()
+        self._statistics.compute_formulae_time.stop_timer()
+        for index in candidates:
+            self._checkers[index].add_prepared_depth()
+        if self._incremental_bmc is not None:
+            self._incremental_bmc.add_prepared_depth()
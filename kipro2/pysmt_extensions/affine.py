@@ -0,0 +1,178 @@
+"""
+A canonical form for linear (integer or real) arithmetic terms.
+
+A linear term is represented by its linear form, i.e., a map from atoms (symbols, function applications, non-linear
+products, ...) to non-zero Fraction coefficients plus a Fraction constant. Terms with the same linear form are
+translated to the same pysmt node, e.g. (x+1)+1, x+2 and 1+(x+1) all become x+2. Since pysmt hash-conses its nodes,
+equivalent applications P_i(x+1+1) and P_i(x+2) of uninterpreted functions then coincide as well.
+
+pGCL decrements are encoded with monus (x := x-1 becomes x := Monus(x, 1), see CharacteristicFunctional.monus_euf).
+Given the monus function and the atoms that are non-negative (the program variables), applications of monus whose
+value is known are rewritten as well, e.g. Monus(x+1, 1) becomes x. These rewrites hold in all states in which the
+program variables are non-negative, which the checkers assert.
+"""
+
+from fractions import Fraction
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from pysmt.environment import get_env
+from pysmt.fnode import FNode
+
+LinearForm = Tuple[Dict[FNode, Fraction], Fraction]
+
+
+class AffineNormalizer:
+    """
+    Translates linear terms to the canonical term
+        Times(a_1, c_1) + ... + Times(a_n, c_n) + c
+    where the atoms a_1, ..., a_n are sorted by their node id, Times(a, 1) is written as a, and the constant c is
+    omitted if it is 0 (unless there are no atoms).
+    """
+
+    def __init__(self, env=None, monus_euf: Optional[FNode] = None, non_negative_atoms: Iterable[FNode] = ()):
+        """
+        :param monus_euf: The uninterpreted function (Int x Int -> Int) encoding monus, if any (see normalize_monus).
+        :param non_negative_atoms: Integer atoms that are non-negative in all states of interest.
+        """
+        self.env = env if env is not None else get_env()
+        self.manager = self.env.formula_manager
+        self.monus_euf = monus_euf
+        self._non_negative_atoms: Set[FNode] = set(non_negative_atoms)
+
+    def linear_form(self, term: FNode) -> Optional[LinearForm]:
+        """
+        Compute the linear form of an arithmetic term.
+
+        :return: None if the term contains algebraic constants, which have no Fraction value.
+        """
+        return self._linear_form([(term, Fraction(1))])
+
+    def _linear_form(self, stack) -> Optional[LinearForm]:
+        coefficients = dict()
+        constant = Fraction(0)
+        while stack:
+            (term, factor) = stack.pop()
+            if term.is_constant():
+                if term.is_algebraic_constant():
+                    return None
+                constant += factor * Fraction(term.constant_value())
+            elif term.is_plus():
+                stack.extend((arg, factor) for arg in term.args())
+            elif term.is_minus():
+                stack.append((term.arg(0), factor))
+                stack.append((term.arg(1), -factor))
+            elif term.is_times() and sum(1 for arg in term.args() if not arg.is_constant()) <= 1:
+                for arg in term.args():
+                    if arg.is_constant():
+                        if arg.is_algebraic_constant():
+                            return None
+                        factor *= Fraction(arg.constant_value())
+                non_constant = [arg for arg in term.args() if not arg.is_constant()]
+                if len(non_constant) == 0:
+                    constant += factor
+                else:
+                    stack.append((non_constant[0], factor))
+            else:
+                # An atom. Products of several non-constant terms are atoms as well.
+                coefficients[term] = coefficients.get(term, Fraction(0)) + factor
+
+        return ({atom: coefficient for (atom, coefficient) in coefficients.items() if coefficient != 0}, constant)
+
+    def to_term(self, linear_form: LinearForm, is_real: bool) -> FNode:
+        """
+        Build the canonical term of a linear form.
+
+        :param is_real: Whether the term is of type Real (otherwise it is of type Int).
+        """
+        (coefficients, constant) = linear_form
+        monomials = []
+        for atom in sorted(coefficients, key=FNode.node_id):
+            coefficient = coefficients[atom]
+            if coefficient == 1:
+                monomials.append(atom)
+            else:
+                monomials.append(self.manager.Times(atom, self._constant(coefficient, is_real)))
+        if constant != 0 or len(monomials) == 0:
+            monomials.append(self._constant(constant, is_real))
+        if len(monomials) == 1:
+            return monomials[0]
+        return self.manager.Plus(monomials)
+
+    def _constant(self, value: Fraction, is_real: bool) -> FNode:
+        if is_real:
+            return self.manager.Real(value)
+        assert value.denominator == 1
+        return self.manager.Int(value.numerator)
+
+    def normalize(self, term: FNode) -> FNode:
+        """
+        Translate a linear term to its canonical term. Terms with algebraic constants are returned unchanged.
+        """
+        linear_form = self.linear_form(term)
+        if linear_form is None:
+            return term
+        return self.to_term(linear_form, self.env.stc.get_type(term).is_real_type())
+
+    def normalize_plus(self, args: Iterable[FNode]) -> Optional[FNode]:
+        """
+        The canonical term of Plus(args), or None if there is none.
+        """
+        args = list(args)
+        return self._normalize_stack([(arg, Fraction(1)) for arg in args], args[0])
+
+    def normalize_minus(self, lhs: FNode, rhs: FNode) -> Optional[FNode]:
+        """
+        The canonical term of Minus(lhs, rhs), or None if there is none.
+        """
+        return self._normalize_stack([(lhs, Fraction(1)), (rhs, Fraction(-1))], lhs)
+
+    def normalize_times(self, args: Iterable[FNode]) -> Optional[FNode]:
+        """
+        The canonical term of Times(args), or None if the product is not linear (or there is no canonical term).
+        """
+        args = list(args)
+        non_constant = [arg for arg in args if not arg.is_constant()]
+        if len(non_constant) > 1:
+            return None
+        factor = Fraction(1)
+        for arg in args:
+            if arg.is_constant():
+                if arg.is_algebraic_constant():
+                    return None
+                factor *= Fraction(arg.constant_value())
+        if len(non_constant) == 0:
+            return self._constant(factor, self.env.stc.get_type(args[0]).is_real_type())
+        return self._normalize_stack([(non_constant[0], factor)], args[0])
+
+    def _normalize_stack(self, stack, typed_arg: FNode) -> Optional[FNode]:
+        linear_form = self._linear_form(stack)
+        if linear_form is None:
+            return None
+        return self.to_term(linear_form, self.env.stc.get_type(typed_arg).is_real_type())
+
+    def is_monus(self, term: FNode) -> bool:
+        return self.monus_euf is not None and term.is_function_application() and term.function_name() == self.monus_euf
+
+    def normalize_monus(self, lhs: FNode, rhs: FNode) -> Optional[FNode]:
+        """
+        The canonical term of Monus(lhs, rhs) = max(lhs-rhs, 0) for a constant rhs, or None if it is not known:
+            Monus(a+k, j) = a+(k-j) if k >= j and a is a sum of non-negative atoms with positive coefficients and
+            Monus(k, j) = max(k-j, 0).
+        Applications of monus are non-negative atoms themselves. Nested applications are kept, since only the
+        applications occurring in the characteristic functional have a definition.
+        """
+        rhs_form = self.linear_form(rhs)
+        if rhs_form is None or rhs_form[0] or rhs_form[1] < 0:
+            return None
+        subtrahend = rhs_form[1]
+
+        lhs_form = self.linear_form(lhs)
+        if lhs_form is None:
+            return None
+        (coefficients, constant) = lhs_form
+        if len(coefficients) == 0:
+            return self._constant(max(constant - subtrahend, Fraction(0)), False)
+        if constant < subtrahend or not all(coefficient > 0 and (atom in self._non_negative_atoms or self.is_monus(atom))
+                                            for (atom, coefficient) in coefficients.items()):
+            return None
+        return self.to_term((coefficients, constant - subtrahend), False)
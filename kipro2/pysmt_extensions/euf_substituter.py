@@ -109,6 +109,73 @@ class EUFSubstituter(pysmt.walkers.IdentityDagWalker):
         if not formula.is_term():
             raise PysmtTypeError("substitute() can only be used on terms.")
 
+        self._check_substitutions(subs)
+
+        res = self.walk(formula, substitutions=subs)
+        return res
+
+    def substitute_all(self, formulae, subs):
+        """Replaces any subformula in every formula of formulae with the definition in subs.
+
+        Subterms shared by several formulae are substituted only once.
+        """
+        return self.substitute_many(formulae, [subs])[0]
+
+    def substitute_many(self, formulae, subs_list):
+        """Applies every substitution in subs_list to every formula of formulae.
+
+        All substitutions are applied in a single walk over the DAG of the
+        formulae. Subterms not containing any key of the substitutions
+        are detected once and kept as they are.
+
+        Returns a list containing, for every substitution in subs_list, the
+        list of substituted formulae (in the order of formulae).
+        """
+        formulae = list(formulae)
+        for formula in formulae:
+            if not formula.is_term():
+                raise PysmtTypeError("substitute() can only be used on terms.")
+        for subs in subs_list:
+            self._check_substitutions(subs)
+
+        keys = set()
+        for subs in subs_list:
+            keys.update(subs)
+
+        # Maps every visited node to None if no substitution changes it and
+        # to the tuple of its substitution results otherwise.
+        memoization = {}
+        stack = [(False, formula) for formula in formulae]
+        while stack:
+            (was_expanded, formula) = stack.pop()
+            if formula in memoization:
+                continue
+            if not was_expanded:
+                stack.append((True, formula))
+                for s in formula.args():
+                    if s not in memoization:
+                        stack.append((False, s))
+                continue
+
+            args = formula.args()
+            if formula not in keys and \
+                    not (formula.is_function_application() and formula.function_name() in keys) and \
+                    all(memoization[s] is None for s in args):
+                memoization[formula] = None
+                continue
+
+            f = self.functions[formula.node_type()]
+            results = []
+            for (i, subs) in enumerate(subs_list):
+                new_args = [s if memoization[s] is None else memoization[s][i] for s in args]
+                results.append(f(formula, args=new_args, substitutions=subs))
+            memoization[formula] = tuple(results)
+
+        return [[formula if memoization[formula] is None else memoization[formula][i]
+                 for formula in formulae]
+                for i in range(len(subs_list))]
+
+    def _check_substitutions(self, subs):
         for (i, k) in enumerate(subs):
             v = subs[k]
             # Check that substitutions are terms
@@ -128,9 +195,6 @@ class EUFSubstituter(pysmt.walkers.IdentityDagWalker):
                 raise PysmtTypeError(
                     "Value %d does not belong to the Formula Manager." % i)
 
-        res = self.walk(formula, substitutions=subs)
-        return res
-
 
 class EUFMGSubstituter(EUFSubstituter):
     """Performs Most Generic Substitution.
@@ -0,0 +1,200 @@
+"""
+Precompiled formulae with holes for the program variables and for uninterpreted functions.
+
+Unrolling the characteristic functional instantiates the same formulae (in the program variables and P_1, P_2) at many
+argument tuples and for many uninterpreted functions P_i. Substituting and simplifying walks the whole formula DAG twice
+per instance. A FormulaTemplate instead records, once, which nodes of a (simplified) formula depend on a hole. An
+instance is then built by reconstructing exactly these nodes bottom-up, simplifying each of them with the simplifier's
+node handler. Ground subterms are reused as they are.
+"""
+
+from typing import Iterable, List, Optional, Sequence, Set
+
+from pysmt.environment import get_env
+from pysmt.fnode import FNode
+
+from kipro2.pysmt_extensions.euf_substituter import EUFMGSubstituter
+from kipro2.pysmt_extensions.simplifier import Simplifier
+from kipro2.utils.utils import substitute_all_formulae, substitute_all_formulae_by_all
+
+INSTANTIATION_METHODS = ["substitute", "template"]
+
+
+class FormulaTemplate:
+    """
+    A formula whose variables (the holes) are replaced by the components of an argument tuple and whose uninterpreted
+    function names are replaced by other uninterpreted functions.
+
+    If a simplifier is given, instantiate(...) returns the same formula as simplifying the substituted formula,
+    provided that the given formula is already simplified.
+    """
+
+    def __init__(self, formula: FNode, variables: Sequence[FNode], functions: Sequence[FNode],
+                 simplifier: Optional[Simplifier] = None, env=None):
+        """
+        :param formula: The formula.
+        :param variables: The symbols that are replaced by the arguments of an instance.
+        :param functions: The uninterpreted function names that are replaced by the functions of an instance.
+        :param simplifier: If given, every reconstructed node is simplified.
+        """
+        self._manager = (env if env is not None else get_env()).formula_manager
+        self._simplifier = simplifier
+        self._functions = list(functions)
+
+        # Instantiating works on a list of values: first the ground operands, then the arguments of the instance and
+        # then the results of the instructions. An instruction (node, handler, operand indices, function index)
+        # reconstructs one node that depends on a hole.
+        self._constants: List[FNode] = []
+        self._instructions = []
+        self._result_index = None
+
+        variable_index = {var: i for (i, var) in enumerate(variables)}
+        function_index = {function: i for (i, function) in enumerate(self._functions)}
+        constant_index = dict()
+        # Index into the values list for every node depending on a hole (resp. None for ground nodes)
+        hole_index = dict()
+        # Ground nodes and holes are resolved when compiling the instructions, so we store them here first.
+        pending_instructions = []
+
+        stack = [(formula, False)]
+        while stack:
+            (node, children_visited) = stack.pop()
+            if node in hole_index:
+                continue
+            if not children_visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.args() if child not in hole_index)
+                continue
+
+            if node in variable_index:
+                hole_index[node] = ("argument", variable_index[node])
+            elif any(hole_index[child] is not None for child in node.args()) or \
+                    (node.is_function_application() and node.function_name() in function_index):
+                hole_index[node] = ("instruction", len(pending_instructions))
+                pending_instructions.append(node)
+            else:
+                hole_index[node] = None
+
+        def operand(child):
+            if hole_index[child] is None:
+                if child not in constant_index:
+                    constant_index[child] = len(self._constants)
+                    self._constants.append(child)
+                return ("constant", constant_index[child])
+            return hole_index[child]
+
+        operands = [[operand(child) for child in node.args()] for node in pending_instructions]
+
+        # Now that the number of constants is known, translate all operands to positions in the values list.
+        number_constants = len(self._constants)
+        number_arguments = len(variable_index)
+
+        def position(kind_index):
+            (kind, index) = kind_index
+            if kind == "constant":
+                return index
+            elif kind == "argument":
+                return number_constants + index
+            else:
+                return number_constants + number_arguments + index
+
+        for (node, node_operands) in zip(pending_instructions, operands):
+            self._instructions.append((node, self._handler(node), [position(o) for o in node_operands],
+                                       function_index.get(node.function_name()) if node.is_function_application()
+                                       else None))
+
+        root = hole_index[formula]
+        if root is None:
+            self._ground_formula = formula
+        else:
+            self._ground_formula = None
+            self._result_index = position(root)
+
+    def _handler(self, node):
+        if node.is_function_application() or self._simplifier is None:
+            return None
+        return self._simplifier.functions[node.node_type()]
+
+    def instantiate(self, arguments: Sequence[FNode], functions: Sequence[FNode]) -> FNode:
+        """
+        :param arguments: The terms replacing the variables (in the order of the variables given to the constructor).
+        :param functions: The uninterpreted functions replacing the (first len(functions)) functions given to the
+            constructor.
+        """
+        if self._ground_formula is not None:
+            return self._ground_formula
+
+        values = self._constants + list(arguments)
+        for (node, handler, positions, function_position) in self._instructions:
+            args = [values[p] for p in positions]
+            if function_position is not None or node.is_function_application():
+                function_name = functions[function_position] \
+                    if function_position is not None and function_position < len(functions) \
+                    else node.function_name()
+                values.append(self._manager.Function(function_name, args))
+            elif handler is not None:
+                values.append(handler(node, args=args))
+            else:
+                values.append(self._manager.create_node(node.node_type(), tuple(args), node._content.payload))
+        return values[self._result_index]
+
+
+class FormulaInstantiator:
+    """
+    A set of formulae in the program variables and some uninterpreted functions (e.g. P_1, P_2) that is instantiated at
+    argument tuples for other uninterpreted functions (e.g. P_i, P_{i+1}).
+
+    Depending on instantiation, instances are built by substituting (and simplifying) the formulae or from
+    precompiled FormulaTemplates.
+    """
+
+    def __init__(self, formulae: Iterable[FNode], variables: Sequence[FNode], functions: Sequence[FNode],
+                 instantiation: str, euf_substituter: EUFMGSubstituter, simplifier: Optional[Simplifier] = None):
+        """
+        :param formulae: The formulae. They should be simplified if a simplifier is given.
+        :param variables: The program variables.
+        :param functions: The uninterpreted functions that are replaced when instantiating.
+        :param instantiation: One of INSTANTIATION_METHODS.
+        :param euf_substituter: The substituter used for instantiation="substitute".
+        :param simplifier: If given, instances are simplified.
+        """
+        if instantiation not in INSTANTIATION_METHODS:
+            raise Exception("Unknown instantiation method %s." % instantiation)
+
+        self._formulae = set(formulae)
+        self._variables = list(variables)
+        self._functions = list(functions)
+        self._euf_substituter = euf_substituter
+        self._simplifier = simplifier
+        self._templates = [FormulaTemplate(formula, self._variables, self._functions, simplifier)
+                           for formula in self._formulae] if instantiation == "template" else None
+
+    def __len__(self):
+        return len(self._formulae)
+
+    def instantiate(self, frontier: Iterable[Sequence[FNode]], functions: Sequence[FNode]) -> Set[FNode]:
+        """
+        Instantiate every formula at every argument tuple of the frontier, replacing the i-th uninterpreted function
+        by functions[i]. functions may be shorter than the functions given to the constructor, in which case the
+        remaining ones are not replaced.
+        """
+        if len(self._formulae) == 0:
+            return set()
+
+        if self._templates is not None:
+            return {template.instantiate(argument, functions) for argument in frontier for template in self._templates}
+
+        # The EUF substituter also substitutes the result of a function name substitution (e.g. P_1 -> P_2 -> P_3
+        # for the substitution {P_1: P_2, P_2: P_3}), so we replace one function at a time, starting with the last.
+        formulae = self._formulae
+        for (old_function, new_function) in reversed(list(zip(self._functions[1:], functions[1:]))):
+            if old_function != new_function:
+                formulae = substitute_all_formulae(formulae, {old_function: new_function}, self._euf_substituter)
+
+        subs = []
+        for argument in frontier:
+            sub = dict(zip(self._variables, argument))
+            sub[self._functions[0]] = functions[0]
+            subs.append(sub)
+        return substitute_all_formulae_by_all(formulae, subs, self._euf_substituter, self._simplifier is not None,
+                                              self._simplifier)
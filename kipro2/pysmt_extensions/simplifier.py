@@ -16,6 +16,8 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 #
+from collections import OrderedDict
+
 from six.moves import xrange
 
 import pysmt.walkers
@@ -26,14 +28,34 @@ from pysmt.utils import set_bit
 from pysmt.exceptions import PysmtValueError
 from pysmt.fnode import FNode
 
+from kipro2.pysmt_extensions.affine import AffineNormalizer
+
+# Default bound on the number of memoized simplification results
+DEFAULT_SIMPLIFIER_CACHE_SIZE = 1000000
+
 
 class Simplifier(pysmt.walkers.DagWalker):
     """Perform basic simplifications of the input formula."""
 
-    def __init__(self, env=None):
+    def __init__(self, env=None, cache_size=None, normalize_affine=False, monus_euf=None, non_negative_atoms=()):
+        """The results are memoized across calls of simplify. If
+        ``cache_size`` is given, at most ``cache_size`` results are kept
+        after each call, evicting the least recently used ones.
+
+        If ``normalize_affine`` is set, linear arithmetic terms are
+        brought into the canonical form of
+        kipro2.pysmt_extensions.affine.AffineNormalizer. Applications of
+        ``monus_euf`` are rewritten as well if their value is known given
+        that the ``non_negative_atoms`` are non-negative.
+        """
         pysmt.walkers.DagWalker.__init__(self, env=env)
         self.manager = self.env.formula_manager
         self._validate_simplifications = None
+        self.memoization = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._affine_normalizer = AffineNormalizer(self.env, monus_euf, non_negative_atoms) if normalize_affine else None
         self.original_walk = self.walk
 
     @property
@@ -57,7 +79,36 @@ class Simplifier(pysmt.walkers.DagWalker):
 
     def simplify(self, formula):
         """Performs simplification of the given formula."""
-        return self.walk(formula)
+        res = self.walk(formula)
+        self._evict()
+        return res
+
+    def _evict(self):
+        if self.cache_size is not None:
+            while len(self.memoization) > self.cache_size:
+                self.memoization.popitem(last=False)
+
+    def walk(self, formula, **kwargs):
+        if formula in self.memoization:
+            self.cache_hits += 1
+            self.memoization.move_to_end(formula)
+            return self.memoization[formula]
+        return pysmt.walkers.DagWalker.walk(self, formula, **kwargs)
+
+    def _push_with_children_to_stack(self, formula, **kwargs):
+        """Add children to the stack (unless memoized)."""
+        self.stack.append((True, formula))
+        for s in self._get_children(formula):
+            if s in self.memoization:
+                self.cache_hits += 1
+                self.memoization.move_to_end(s)
+            else:
+                self.stack.append((False, s))
+
+    def _compute_node_result(self, formula, **kwargs):
+        if formula not in self.memoization:
+            self.cache_misses += 1
+        pysmt.walkers.DagWalker._compute_node_result(self, formula, **kwargs)
 
     def _get_key(self, formula, **kwargs):
         return formula
@@ -281,6 +332,10 @@ class Simplifier(pysmt.walkers.DagWalker):
         return self.manager.Exists(varset, sf)
 
     def walk_plus(self, formula, args, **kwargs):
+        if self._affine_normalizer is not None:
+            res = self._affine_normalizer.normalize_plus(args)
+            if res is not None:
+                return res
 
         is_real = any(x.is_real_constant() for x in args)
         is_int = any(x.is_int_constant() for x in args)
@@ -341,6 +396,11 @@ class Simplifier(pysmt.walkers.DagWalker):
         return self.manager.Plus(ns)
 
     def walk_times(self, formula, args, **kwargs):
+        if self._affine_normalizer is not None:
+            res = self._affine_normalizer.normalize_times(args)
+            if res is not None:
+                return res
+
         new_args = []
         constant_mul = 1
         stack = list(args)
@@ -400,6 +460,11 @@ class Simplifier(pysmt.walkers.DagWalker):
         sl = args[0]
         sr = args[1]
 
+        if self._affine_normalizer is not None:
+            res = self._affine_normalizer.normalize_minus(sl, sr)
+            if res is not None:
+                return res
+
         if sl.is_real_constant() and sr.is_real_constant():
             l = sl.constant_value()
             r = sr.constant_value()
@@ -422,6 +487,10 @@ class Simplifier(pysmt.walkers.DagWalker):
         return self.manager.Minus(sl, sr)
 
     def walk_function(self, formula, args, **kwargs):
+        if self._affine_normalizer is not None and self._affine_normalizer.is_monus(formula):
+            res = self._affine_normalizer.normalize_monus(args[0], args[1])
+            if res is not None:
+                return res
         return self.manager.Function(formula.function_name(), args)
 
     def walk_toreal(self, formula, args, **kwargs):
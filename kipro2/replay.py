@@ -0,0 +1,105 @@
+"""
+Replay an SMT-LIB2 script written with --dump-smt2 on an SMT-LIB2 solver and time every check.
+
+This separates the cost of solving from the cost of building the encoding: The same script can be replayed with
+different solvers, solver versions or options (e.g. "z3 -in smt.arith.solver=2").
+"""
+
+import select
+import shlex
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import attr
+import click
+
+from kipro2.solvers.smtlib_process import DEFAULT_SMTLIB_COMMAND
+from kipro2.solvers.trace import MARKER_PREFIX, RESULT_PREFIX
+
+
+@attr.s
+class CheckResult:
+    index: int = attr.ib()
+    marker: Optional[str] = attr.ib()
+    expected: Optional[str] = attr.ib()
+    result: str = attr.ib()
+    """"sat", "unsat", "unknown", "timeout" or an error message."""
+    seconds: float = attr.ib()
+
+
+def replay(lines: List[str], command: str, timeout: Optional[float] = None) -> List[CheckResult]:
+    """
+    Feed the script to the solver and time every check. The replay stops after a timeout.
+
+    :param lines: The lines of the script.
+    :param command: The command line of the SMT-LIB2 solver.
+    :param timeout: An optional time limit in seconds for every check.
+    """
+    process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    results = []
+    marker = None
+    try:
+        for (i, line) in enumerate(lines):
+            if line.startswith(MARKER_PREFIX):
+                marker = line[len(MARKER_PREFIX):].strip()
+                continue
+            if line.startswith(";") or line.strip() == "":
+                continue
+
+            process.stdin.write(line + "\n")
+            if not (line.startswith("(check-sat)") or line.startswith("(check-sat-assuming ")):
+                continue
+
+            expected = None
+            if i + 1 < len(lines) and lines[i + 1].startswith(RESULT_PREFIX):
+                expected = lines[i + 1][len(RESULT_PREFIX):].strip()
+
+            start = time.perf_counter()
+            process.stdin.flush()
+            if timeout is not None and not select.select([process.stdout], [], [], timeout)[0]:
+                results.append(CheckResult(len(results), marker, expected, "timeout", time.perf_counter() - start))
+                break
+            result = process.stdout.readline().strip()
+            results.append(CheckResult(len(results), marker, expected, result, time.perf_counter() - start))
+            if result not in ("sat", "unsat", "unknown"):
+                break
+    finally:
+        process.kill()
+        process.wait()
+    return results
+
+
+@click.command()
+@click.argument('trace', type=click.Path(exists=True, dir_okay=False))
+@click.option('--solver',
+              type=click.STRING,
+              default=DEFAULT_SMTLIB_COMMAND,
+              help="The command line of the SMT-LIB2 solver.")
+@click.option('--timeout',
+              type=click.FLOAT,
+              help="Time limit in seconds for every check.")
+def main(trace, solver, timeout):
+    with open(trace, 'r') as trace_file:
+        lines = trace_file.read().splitlines()
+
+    results = replay(lines, solver, timeout)
+
+    mismatches = 0
+    for res in results:
+        mismatch = res.expected is not None and res.result != res.expected
+        mismatches += 1 if mismatch else 0
+        print("Check %s (%s): %s in %.3f s%s" %
+              (res.index, res.marker, res.result, res.seconds,
+               " (recorded: %s)" % res.expected if mismatch else ""))
+
+    print("Checks: %s. Total time for checks: %.3f s. Mismatches: %s." %
+          (len(results), sum(res.seconds for res in results), mismatches))
+    if mismatches > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
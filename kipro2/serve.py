@@ -0,0 +1,331 @@
+"""
+A local verification service that answers check requests over a Unix domain socket.
+
+kipro2_serve keeps worker processes that have imported probably, pysmt and z3, and keeps the preprocessed
+characteristic functionals of the most recently checked programs in memory. Repeated checks of the same program (e.g.
+from an editor or CI hook) then neither pay for starting Python nor for preprocessing the program.
+
+The protocol is newline-delimited JSON. A client sends requests, one per line, with the keys of a kipro2_batch manifest
+entry (see kipro2.batch). Relative program paths are resolved against the working directory of the server. The server
+answers every request with one line in the output format of kipro2_batch, in the order of the requests. While a request
+runs, the client can send the line {"cancel": true}. The worker running the request is then killed and replaced, and
+the answer has the status "cancelled". Requests that cannot be parsed are answered with the status "invalid".
+
+The limits timeout and memory_limit of a request are enforced by the worker as in kipro2_batch. If a worker does not
+return within KILL_GRACE seconds after the timeout (e.g. because native code does not return), it is killed.
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import select
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import click
+
+from kipro2.batch import BatchTask, _init_worker, parse_task, run_batch_task
+from kipro2.utils.cache import CharacteristicFunctionalCache, InMemoryFunctionalCache
+from kipro2.utils.statistics import StatisticsEncoder
+
+# Seconds a worker may exceed the timeout of a request before it is killed
+KILL_GRACE = 10
+
+# Seconds between checks for cancellation while a request runs
+POLL_INTERVAL = 0.1
+
+
+class FunctionalLRU:
+    """
+    The payloads of preprocessed characteristic functionals (see InMemoryFunctionalCache) of the most recently used
+    pairs of program code and post-expectation.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str], default: Optional[Dict[str, dict]] = None) -> Optional[Dict[str, dict]]:
+        """
+        :return: A copy of the payloads of key, or default if they are not kept.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return dict(self._entries[key])
+
+    def put(self, key: Tuple[str, str], payloads: Dict[str, dict]):
+        if not payloads:
+            return
+        with self._lock:
+            self._entries[key] = payloads
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _worker_loop(connection):
+    _init_worker()
+    # Cancelling is the business of the server.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        record = run_batch_task(task)
+        connection.send((record, task.check_task.functional_cache.get_payloads()))
+
+
+class _Worker:
+
+    def __init__(self, context):
+        (self.connection, child_connection) = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(child_connection, ), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class _LineReader:
+    """
+    Reads lines from a socket, optionally without blocking.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self._socket = sock
+        self._buffer = b""
+        self._pending = deque()
+        self.closed = False
+
+    def read_line(self, block: bool = True) -> Optional[bytes]:
+        """
+        :return: The next line, or None at the end of the stream (or if no line is available and block is False).
+        """
+        if self._pending:
+            return self._pending.popleft()
+        while b"\n" not in self._buffer:
+            if self.closed:
+                (line, self._buffer) = (self._buffer, b"")
+                return line if line != b"" else None
+            if not block and not select.select([self._socket], [], [], 0)[0]:
+                return None
+            try:
+                data = self._socket.recv(65536)
+            except OSError:
+                data = b""
+            if data == b"":
+                self.closed = True
+            self._buffer += data
+        (line, self._buffer) = self._buffer.split(b"\n", 1)
+        return line
+
+    def unread(self, line: bytes):
+        self._pending.append(line)
+
+
+def _record(task: Optional[BatchTask], status: str, error: Optional[str] = None) -> dict:
+    """
+    The record of a request that did not finish on a worker.
+    """
+    return {"index": task.index if task is not None else None, "status": status, "error": error, "statistics": None}
+
+
+def _is_cancel(line: bytes) -> bool:
+    try:
+        return json.loads(line) == {"cancel": True}
+    except ValueError:
+        return False
+
+
+class VerificationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, jobs: int = 1, cache_size: int = 32, cache_dir: Optional[str] = None):
+        """
+        :param jobs: The number of worker processes, i.e., of requests that run at the same time.
+        :param cache_size: The number of pairs of program and post-expectation whose preprocessed characteristic
+            functionals are kept in memory.
+        :param cache_dir: A directory in which preprocessed characteristic functionals are also cached on disk.
+        """
+        # Workers are forked from a process that has imported everything, but not from this process, which runs threads.
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload(["kipro2.batch"])
+        # Workers are replaced by the threads handling requests, also while the server closes
+        self._workers = set()
+        self._workers_lock = threading.Lock()
+        self._closed = False
+        self._idle_workers = queue.Queue()
+        for _ in range(jobs):
+            self._start_worker()
+        self._functionals = FunctionalLRU(cache_size)
+        self._cache_dir = cache_dir
+        self._indices = itertools.count()
+        super().__init__(socket_path, _RequestHandler)
+
+    def _start_worker(self):
+        worker = _Worker(self._context)
+        with self._workers_lock:
+            if not self._closed:
+                self._workers.add(worker)
+                self._idle_workers.put(worker)
+                return
+        worker.kill()
+
+    def _replace_worker(self, worker: _Worker):
+        worker.kill()
+        with self._workers_lock:
+            self._workers.discard(worker)
+        self._start_worker()
+
+    def parse_request(self, line: bytes) -> BatchTask:
+        task = parse_task(json.loads(line), next(self._indices), Path.cwd())
+        fallback = CharacteristicFunctionalCache(self._cache_dir) if self._cache_dir is not None else None
+        task.check_task.functional_cache = InMemoryFunctionalCache(
+            fallback, self._functionals.get((task.check_task.program_code, task.check_task.post)))
+        return task
+
+    def run(self, task: BatchTask, reader: _LineReader) -> dict:
+        """
+        Run a task on the next idle worker.
+
+        :param reader: The requests of the client, which are watched for cancellation.
+        """
+        worker = self._idle_workers.get()
+        worker.connection.send(task)
+        deadline = time.monotonic() + task.timeout + KILL_GRACE if task.timeout is not None else None
+        # Requests that the client sends while this one runs
+        later_requests = []
+        try:
+            while True:
+                if worker.connection.poll(POLL_INTERVAL):
+                    try:
+                        (record, payloads) = worker.connection.recv()
+                    except EOFError:
+                        self._replace_worker(worker)
+                        return _record(task, "err",
+                                            "The worker died (exit code %s)." % worker.process.exitcode)
+                    self._idle_workers.put(worker)
+                    self._functionals.put((task.check_task.program_code, task.check_task.post), payloads)
+                    return record
+                if deadline is not None and time.monotonic() > deadline:
+                    self._replace_worker(worker)
+                    return _record(task, "timeout")
+                line = reader.read_line(block=False)
+                if line is not None:
+                    if _is_cancel(line):
+                        self._replace_worker(worker)
+                        return _record(task, "cancelled")
+                    later_requests.append(line)
+        finally:
+            for line in later_requests:
+                reader.unread(line)
+
+    def server_bind(self):
+        # Only the user running the server may connect to the socket. Creating it with the right mode (instead of
+        # changing the mode after binding) leaves no time in which others could connect.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        with self._workers_lock:
+            self._closed = True
+            (workers, self._workers) = (self._workers, set())
+        for worker in workers:
+            worker.kill()
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        reader = _LineReader(self.request)
+        while True:
+            line = reader.read_line()
+            if line is None:
+                return
+            if line.strip() == b"" or _is_cancel(line):
+                # Nothing to cancel
+                continue
+            try:
+                task = self.server.parse_request(line)
+            except Exception as e:
+                record = _record(None, "invalid", "%s: %s" % (type(e).__name__, e))
+            else:
+                record = self.server.run(task, reader)
+            try:
+                self.request.sendall((json.dumps(record, cls=StatisticsEncoder) + "\n").encode())
+            except OSError:
+                return
+
+
+def _remove_stale_socket(socket_path: str):
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+            return
+    raise Exception("Another server is listening on %s." % socket_path)
+
+
+@click.command()
+@click.option('--socket',
+              'socket_path',
+              type=click.Path(dir_okay=False),
+              default="kipro2.sock",
+              show_default=True,
+              help="The Unix domain socket to listen on.")
+@click.option('--jobs', type=click.INT, default=1, help="The number of worker processes.")
+@click.option('--cache-size',
+              type=click.INT,
+              default=32,
+              show_default=True,
+              help="The number of programs (with post-expectation) whose preprocessed characteristic functionals are "
+              "kept in memory.")
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    help="A directory in which preprocessed characteristic functionals are also cached on disk.")
+def main(socket_path, jobs, cache_size, cache_dir):
+    """
+    Answer check requests sent to a Unix domain socket (see kipro2.serve) until terminated.
+    """
+    _remove_stale_socket(socket_path)
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+    server = VerificationServer(socket_path, jobs, cache_size, cache_dir)
+    click.echo("Listening on %s" % socket_path, err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,96 @@
+"""
+Emulation of push/pop with activation literals.
+
+Popping a scope makes the solver forget everything it learned while the scope was open, although most of the lemmas
+are about formulae that stay on the solver. The ActivationSolver never pops: The assertions of every scope are
+guarded by a fresh Boolean activation literal (act -> formula), checks assume the literals of all open scopes, and
+popping a scope permanently asserts the negation of its literal. The assertion stack of the underlying solver only
+grows, so learned lemmas survive across unrolling depths.
+"""
+
+from typing import Iterable, List, Optional
+
+from pysmt.fnode import FNode
+from pysmt.shortcuts import FreshSymbol, Implies, Not
+from pysmt.typing import BOOL
+
+from kipro2.solvers.factory import close_solver
+from kipro2.solvers.trace import write_marker
+
+SCOPINGS = ["push-pop", "activation"]
+
+
+class ActivationSolver:
+    """
+    Wraps an incremental solver (with the part of the pysmt solver interface used by kipro2) whose solve supports
+    assumptions, and offers the same interface with push/pop emulated by activation literals.
+    """
+
+    def __init__(self, solver):
+        """
+        :param solver: The solver that does the actual work. It is never pushed or popped.
+        """
+        self._solver = solver
+        # The activation literals of the open scopes
+        self._activation_literals: List[FNode] = []
+        # Literals of popped scopes whose negation is not asserted yet. Asserting them right away would discard the
+        # model of the last check, which is still needed after is_sat.
+        self._retired_literals: List[FNode] = []
+        # The (unguarded) assertions of the open scopes and their number at every push
+        self._assertions: List[FNode] = []
+        self._assertion_stack: List[int] = []
+
+    def write_marker(self, text: str):
+        write_marker(self._solver, text)
+
+    def close(self):
+        close_solver(self._solver)
+
+    @property
+    def assertions(self) -> List[FNode]:
+        return self._assertions
+
+    def _retire_literals(self):
+        for literal in self._retired_literals:
+            self._solver.add_assertion(Not(literal))
+        self._retired_literals = []
+
+    def add_assertion(self, formula: FNode, named=None):
+        self._retire_literals()
+        self._assertions.append(formula)
+        if self._activation_literals:
+            formula = Implies(self._activation_literals[-1], formula)
+        self._solver.add_assertion(formula)
+
+    def add_assertions(self, formulae: Iterable[FNode]):
+        for formula in formulae:
+            self.add_assertion(formula)
+
+    def push(self, levels: int = 1):
+        for _ in range(levels):
+            self._assertion_stack.append(len(self._assertions))
+            self._activation_literals.append(FreshSymbol(BOOL, "kipro2_act_%d"))
+
+    def pop(self, levels: int = 1):
+        for _ in range(levels):
+            del self._assertions[self._assertion_stack.pop():]
+            self._retired_literals.append(self._activation_literals.pop())
+
+    def solve(self, assumptions: Optional[Iterable[FNode]] = None) -> bool:
+        self._retire_literals()
+        all_assumptions = list(self._activation_literals)
+        if assumptions is not None:
+            all_assumptions.extend(assumptions)
+        if not all_assumptions:
+            return self._solver.solve()
+        return self._solver.solve(all_assumptions)
+
+    def is_sat(self, formula: FNode) -> bool:
+        self.push()
+        self.add_assertion(formula)
+        res = self.solve()
+        self.pop()
+        return res
+
+    def get_model(self):
+        return self._solver.get_model()
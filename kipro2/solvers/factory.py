@@ -0,0 +1,78 @@
+"""
+Creation of the incremental solvers used by IncrementalBMC and IncrementalKInduction.
+"""
+
+from typing import Optional, Union
+
+import attr
+
+from kipro2.utils.statistics import Statistics, StatisticsSolver, time_sat_checks
+
+BACKENDS = ["pysmt", "z3-native", "smtlib"]
+
+
+@attr.s
+class SolverBackend:
+    """
+    A solver backend (one of BACKENDS) and its options.
+    """
+    name: str = attr.ib(default="pysmt")
+    smtlib_command: Optional[str] = attr.ib(default=None)
+    """For "smtlib": The command line of the solver (by default "z3 -in")."""
+    timeout: Optional[float] = attr.ib(default=None)
+    """For "smtlib": A time limit in seconds for every check."""
+    memory_limit: Optional[int] = attr.ib(default=None)
+    """For "smtlib": A memory limit in megabytes for the solver process."""
+    scoping: str = attr.ib(default="push-pop")
+    """How temporary assertions are scoped: "push-pop" or "activation" (see kipro2.solvers.activation)."""
+
+
+def make_solver(statistics: Statistics, backend: Union[str, SolverBackend] = "pysmt", logic=None,
+                trace: Optional[str] = None):
+    """
+    Create an incremental solver that updates the sat check timer of statistics.
+
+    :param backend: A SolverBackend or the name of one of BACKENDS. "pysmt" uses pysmt's z3 solver, "z3-native" the
+        Z3NativeSolver and "smtlib" the SmtLibProcessSolver.
+    :param logic: An optional pysmt logic.
+    :param trace: If given, the interaction with the solver is recorded to the file at this path as an SMT-LIB2
+        script. With activation scoping, the trace shows the guarded assertions and check-sat-assuming commands. The
+        file is closed by close_solver.
+    """
+    if isinstance(backend, str):
+        backend = SolverBackend(name=backend)
+
+    solver = _make_backend_solver(statistics, backend, logic)
+    if trace is not None:
+        from kipro2.solvers.trace import TracingSolver
+        solver = TracingSolver(solver, trace, logic)
+    if backend.scoping == "activation":
+        from kipro2.solvers.activation import ActivationSolver
+        solver = ActivationSolver(solver)
+    elif backend.scoping != "push-pop":
+        raise Exception("Unknown scoping %s." % backend.scoping)
+    return solver
+
+
+def close_solver(solver):
+    """
+    Release the resources of a solver created by make_solver (solver processes, trace files, ...).
+    """
+    if hasattr(solver, "close"):
+        solver.close()
+    elif hasattr(solver, "exit"):
+        # pysmt solvers
+        solver.exit()
+
+
+def _make_backend_solver(statistics: Statistics, backend: SolverBackend, logic):
+    if backend.name == "pysmt":
+        return StatisticsSolver(statistics, name="z3", logic=logic)
+    elif backend.name == "z3-native":
+        from kipro2.solvers.z3_native import Z3NativeSolver
+        return time_sat_checks(statistics, Z3NativeSolver(logic))
+    elif backend.name == "smtlib":
+        from kipro2.solvers.smtlib_process import SmtLibProcessSolver, DEFAULT_SMTLIB_COMMAND
+        command = backend.smtlib_command if backend.smtlib_command is not None else DEFAULT_SMTLIB_COMMAND
+        return time_sat_checks(statistics, SmtLibProcessSolver(command, logic, backend.timeout, backend.memory_limit))
+    raise Exception("Unknown solver backend %s." % backend.name)
@@ -0,0 +1,77 @@
+"""
+Overlapping formula generation with satisfiability checks.
+
+Generating the formulae for the next unrolling depth is pure Python, while the checks run in native code (z3 through
+ctypes) or in another process (SmtLibProcessSolver). Both release the GIL while they wait, so a background thread can
+generate the next formulae while the main thread waits for a check.
+
+pysmt's formula manager is not thread safe. While the background thread runs, the main thread must not create
+formulae. Therefore only solve runs concurrently; the query is asserted before and the model is read after it.
+"""
+
+import threading
+from typing import Any, Callable, Optional, Tuple
+
+from pysmt.fnode import FNode
+
+
+class BackgroundTask:
+    """
+    Runs a function in a background thread. Exceptions are raised again by result.
+    """
+
+    def __init__(self, function: Callable[[], Any]):
+        self._result = None
+        self._exception: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, args=(function,), daemon=True)
+        self._thread.start()
+
+    def _run(self, function: Callable[[], Any]):
+        try:
+            self._result = function()
+        except BaseException as e:
+            self._exception = e
+
+    def join(self):
+        """
+        Wait for the function to finish, ignoring its result.
+        """
+        self._thread.join()
+
+    def result(self):
+        """
+        Wait for the function to finish and return its result.
+        """
+        self.join()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+def is_sat_while(solver, formula: FNode, background: Optional[Callable[[], Any]] = None) -> Tuple[bool, Any]:
+    """
+    Like solver.is_sat(formula) followed by solver.get_model(), but run background in another thread while the solver
+    checks.
+
+    :param background: A function that must not touch the solver. It may create pysmt formulae.
+    :return: Whether the assertions of solver and formula are satisfiable, and the model (None if unsatisfiable).
+        If the check fails, its exception is raised (even if background fails as well), otherwise the exception of
+        background. The formula is popped in any case.
+    """
+    solver.push()
+    try:
+        solver.add_assertion(formula)
+        task = BackgroundTask(background) if background is not None else None
+        try:
+            res = solver.solve()
+        except BaseException:
+            if task is not None:
+                task.join()
+            raise
+        if task is not None:
+            task.result()
+        # The model has to be read before popping the formula.
+        model = solver.get_model() if res else None
+    finally:
+        solver.pop()
+    return (res, model)
@@ -0,0 +1,263 @@
+"""
+A solver that streams SMT-LIB2 commands to an external solver process (e.g. "z3 -in") over pipes.
+
+Every assertion is printed once, when it is added, and written to the solver's standard input. The script for the
+current assertion stack is kept on the Python side as well, so a solver process that exceeds its time limit (or
+crashes, e.g. by running out of memory) can be killed and replaced by a fresh process that replays the script.
+"""
+
+import select
+import shlex
+import subprocess
+from typing import Iterable, List, Optional
+
+from pysmt.fnode import FNode
+from pysmt.smtlib.printers import to_smtlib
+from pysmt.utils import quote
+
+from kipro2.utils.utils import set_max_memory
+
+DEFAULT_SMTLIB_COMMAND = "z3 -in"
+
+
+def smtlib_preamble(logic=None) -> List[str]:
+    """
+    The options (and logic) set at the start of the scripts written by kipro2.
+    """
+    preamble = ["(set-option :print-success false)", "(set-option :global-declarations true)",
+                "(set-option :produce-models true)"]
+    if logic is not None:
+        preamble.append("(set-logic %s)" % logic)
+    return preamble
+
+
+class SmtLibPrinter:
+    """
+    Prints assertions as SMT-LIB2 commands, one line per command, declaring every symbol the first time it is used.
+    Declarations are global (see smtlib_preamble), i.e., they are not undone by popping.
+    """
+
+    def __init__(self):
+        self._declared = set()
+
+    def declarations(self, formula: FNode) -> List[str]:
+        """
+        :return: The declarations of the symbols of formula that are not declared yet.
+        """
+        commands = []
+        for symbol in formula.get_free_variables():
+            if symbol not in self._declared:
+                self._declared.add(symbol)
+                commands.append(self._declaration(symbol))
+        return commands
+
+    def assertion(self, formula: FNode) -> List[str]:
+        """
+        :return: The declarations of the new symbols of formula and the assertion of formula.
+        """
+        return self.declarations(formula) + ["(assert %s)" % to_smtlib(formula, daggify=False)]
+
+    def check_sat_assuming(self, assumptions: List[FNode]) -> Optional[List[str]]:
+        """
+        :return: The declarations of the new symbols of the assumptions and a check-sat-assuming command, or None if
+            not all assumptions are literals (which is all check-sat-assuming accepts).
+        """
+        if not all(assumption.is_literal() for assumption in assumptions):
+            return None
+        commands = []
+        for assumption in assumptions:
+            commands.extend(self.declarations(assumption))
+        commands.append("(check-sat-assuming (%s))" % " ".join(to_smtlib(assumption, daggify=False)
+                                                                for assumption in assumptions))
+        return commands
+
+    @staticmethod
+    def _declaration(symbol: FNode) -> str:
+        symbol_type = symbol.symbol_type()
+        if symbol_type.is_function_type():
+            return "(declare-fun %s (%s) %s)" % (quote(symbol.symbol_name()),
+                                                 " ".join(str(t) for t in symbol_type.param_types),
+                                                 symbol_type.return_type)
+        return "(declare-fun %s () %s)" % (quote(symbol.symbol_name()), symbol_type)
+
+
+class SmtLibProcessSolver:
+    """
+    An incremental solver offering the part of the pysmt solver interface used by kipro2: add_assertion(s), push,
+    pop, solve, is_sat, get_model and assertions.
+
+    The solver process runs until close is called (or the solver is used as a context manager).
+    """
+
+    def __init__(self, command: str = DEFAULT_SMTLIB_COMMAND, logic=None, timeout: Optional[float] = None,
+                 memory_limit: Optional[int] = None):
+        """
+        :param command: The command line of an SMT-LIB2 solver reading commands from its standard input.
+        :param logic: An optional pysmt logic.
+        :param timeout: A limit in seconds for every check. If it is exceeded, the solver process is restarted and an
+            exception is raised.
+        :param memory_limit: A limit on the address space of the solver process in megabytes.
+        """
+        self._command = shlex.split(command)
+        self._timeout = timeout
+        self._memory_limit = memory_limit
+        self._assertions: List[FNode] = []
+        self._assertion_stack: List[int] = []
+        # The commands of the current assertion stack (without the preamble) and their number at every push
+        self._script: List[str] = []
+        self._script_stack: List[int] = []
+        self._printer = SmtLibPrinter()
+        # Like pysmt's solvers, is_sat pops lazily so that the model of the last check is still available.
+        self._pending_pop = False
+
+        self._preamble = smtlib_preamble(logic)
+        self._process = None
+        self._start()
+
+    def _start(self):
+        preexec_fn = None
+        if self._memory_limit is not None:
+            memory_limit = self._memory_limit
+            preexec_fn = lambda: set_max_memory(memory_limit)
+        self._process = subprocess.Popen(self._command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, universal_newlines=True,
+                                         preexec_fn=preexec_fn)
+        self._process.stdin.write("\n".join(self._preamble + self._script) + "\n")
+
+    def _stop(self):
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        for pipe in (self._process.stdin, self._process.stdout):
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                # Closing stdin flushes the commands that the killed process did not read anymore
+                pass
+
+    def _restart(self):
+        self._stop()
+        self._start()
+
+    def _write(self, command: str):
+        self._clear_pending_pop()
+        self._script.append(command)
+        self._process.stdin.write(command + "\n")
+
+    def _clear_pending_pop(self):
+        if self._pending_pop:
+            self._pending_pop = False
+            self.pop()
+
+    @property
+    def assertions(self) -> List[FNode]:
+        self._clear_pending_pop()
+        return self._assertions
+
+    def add_assertion(self, formula: FNode, named=None):
+        self._clear_pending_pop()
+        self._assertions.append(formula)
+        for command in self._printer.assertion(formula):
+            self._write(command)
+
+    def add_assertions(self, formulae: Iterable[FNode]):
+        for formula in formulae:
+            self.add_assertion(formula)
+
+    def push(self, levels: int = 1):
+        self._clear_pending_pop()
+        for _ in range(levels):
+            self._assertion_stack.append(len(self._assertions))
+            self._script_stack.append(len(self._script))
+            self._write("(push 1)")
+
+    def pop(self, levels: int = 1):
+        self._clear_pending_pop()
+        for _ in range(levels):
+            del self._assertions[self._assertion_stack.pop():]
+            # The replayed script does not need the popped commands. Global declarations survive popping though.
+            start = self._script_stack.pop()
+            popped = self._script[start:]
+            del self._script[start:]
+            self._script.extend(command for command in popped if command.startswith("(declare-fun"))
+            self._process.stdin.write("(pop 1)\n")
+
+    def solve(self, assumptions: Optional[Iterable[FNode]] = None) -> bool:
+        self._clear_pending_pop()
+        if assumptions is not None:
+            assumptions = list(assumptions)
+            commands = self._printer.check_sat_assuming(assumptions)
+            if commands is None:
+                self.push()
+                try:
+                    self.add_assertions(assumptions)
+                    return self._check("(check-sat)")
+                finally:
+                    # Also if the check fails, e.g. by a timeout: The restarted solver replays the script of the scope.
+                    self._pending_pop = True
+            for command in commands[:-1]:
+                self._write(command)
+            return self._check(commands[-1])
+        return self._check("(check-sat)")
+
+    def _check(self, command: str) -> bool:
+        self._process.stdin.write(command + "\n")
+        response = self._read_line(self._timeout)
+        if response == "sat":
+            return True
+        elif response == "unsat":
+            return False
+        raise Exception("Solver %s returned %s." % (" ".join(self._command), response))
+
+    def _read_line(self, timeout: Optional[float]) -> str:
+        try:
+            self._process.stdin.flush()
+        except BrokenPipeError:
+            self._restart()
+            raise Exception("Solver %s terminated unexpectedly." % " ".join(self._command))
+        # Responses are read completely, so nothing is left in the buffer of stdout and we can wait on the pipe.
+        if timeout is not None and not select.select([self._process.stdout], [], [], timeout)[0]:
+            self._restart()
+            raise Exception("Solver %s exceeded the time limit of %s seconds." % (" ".join(self._command), timeout))
+        line = self._process.stdout.readline()
+        if line == "":
+            self._restart()
+            raise Exception("Solver %s terminated unexpectedly." % " ".join(self._command))
+        return line.strip()
+
+    def is_sat(self, formula: FNode) -> bool:
+        self.push()
+        try:
+            self.add_assertion(formula)
+            return self.solve()
+        finally:
+            self._pending_pop = True
+
+    def get_model(self) -> str:
+        """
+        The model of the last (satisfiable) check as SMT-LIB2 text (used for logging).
+        """
+        self._process.stdin.write("(get-model)\n")
+        lines = [self._read_line(None)]
+        depth = lines[0].count("(") - lines[0].count(")")
+        while depth > 0:
+            lines.append(self._read_line(None))
+            depth += lines[-1].count("(") - lines[-1].count(")")
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        Terminate the solver process and close its pipes. The solver cannot be used afterwards.
+        """
+        if self._process is not None:
+            self._stop()
+            self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,121 @@
+"""
+Recording the solver interaction of a checker as an SMT-LIB2 script (see --dump-smt2 and kipro2_replay).
+
+The script contains exactly the assertions, push/pop commands and checks in the order the checker issued them, one
+command per line. Comments mark the unrolling depths and record the result of every check:
+
+    ; kipro2-marker: depth 3
+    (check-sat)
+    ; kipro2-result: unsat
+
+Checks whose assumptions are all literals are written as check-sat-assuming commands.
+"""
+
+from typing import Iterable, Optional
+
+from pysmt.fnode import FNode
+
+from kipro2.solvers.factory import close_solver
+from kipro2.solvers.smtlib_process import SmtLibPrinter, smtlib_preamble
+
+MARKER_PREFIX = "; kipro2-marker: "
+RESULT_PREFIX = "; kipro2-result: "
+
+
+class TracingSolver:
+    """
+    Wraps an incremental solver (with the part of the pysmt solver interface used by kipro2) and writes all
+    assertions, push/pop commands and checks to a trace file.
+    """
+
+    def __init__(self, solver, trace: str, logic=None):
+        """
+        :param solver: The solver that does the actual work.
+        :param trace: The path of the file the SMT-LIB2 script is written to. It is flushed after every check and
+            closed by close.
+        :param logic: An optional pysmt logic.
+        """
+        self._solver = solver
+        self._trace = open(trace, "w")
+        self._printer = SmtLibPrinter()
+        self._write_lines(smtlib_preamble(logic))
+
+    def _write_lines(self, lines):
+        for line in lines:
+            self._trace.write(line + "\n")
+
+    def write_marker(self, text: str):
+        self._trace.write(MARKER_PREFIX + text + "\n")
+        self._trace.flush()
+
+    def close(self):
+        """
+        Close the trace file and the wrapped solver.
+        """
+        self._trace.close()
+        close_solver(self._solver)
+
+    @property
+    def assertions(self):
+        return self._solver.assertions
+
+    def add_assertion(self, formula: FNode, named=None):
+        self._write_lines(self._printer.assertion(formula))
+        self._solver.add_assertion(formula, named)
+
+    def add_assertions(self, formulae: Iterable[FNode]):
+        for formula in formulae:
+            self.add_assertion(formula)
+
+    def push(self, levels: int = 1):
+        self._write_lines(["(push 1)"] * levels)
+        self._solver.push(levels)
+
+    def pop(self, levels: int = 1):
+        self._write_lines(["(pop 1)"] * levels)
+        self._solver.pop(levels)
+
+    def _write_check(self, res: bool, command: str = "(check-sat)"):
+        self._write_lines([command, RESULT_PREFIX + ("sat" if res else "unsat")])
+        self._trace.flush()
+
+    def solve(self, assumptions: Optional[Iterable[FNode]] = None) -> bool:
+        if assumptions is None:
+            res = self._solver.solve()
+            self._write_check(res)
+            return res
+
+        assumptions = list(assumptions)
+        commands = self._printer.check_sat_assuming(assumptions)
+        if commands is not None:
+            self._write_lines(commands[:-1])
+            res = self._solver.solve(assumptions)
+            self._write_check(res, commands[-1])
+            return res
+
+        self._write_lines(["(push 1)"])
+        for assumption in assumptions:
+            self._write_lines(self._printer.assertion(assumption))
+        res = self._solver.solve(assumptions)
+        self._write_check(res)
+        self._write_lines(["(pop 1)"])
+        return res
+
+    def is_sat(self, formula: FNode) -> bool:
+        self._write_lines(["(push 1)"])
+        self._write_lines(self._printer.assertion(formula))
+        res = self._solver.is_sat(formula)
+        self._write_check(res)
+        self._write_lines(["(pop 1)"])
+        return res
+
+    def get_model(self):
+        return self._solver.get_model()
+
+
+def write_marker(solver, text: str):
+    """
+    Write a marker comment to the trace if solver is a TracingSolver (or wraps one).
+    """
+    if hasattr(solver, "write_marker"):
+        solver.write_marker(text)
@@ -0,0 +1,193 @@
+"""
+A solver that builds z3 terms directly from pysmt formulae through the z3 Python API.
+
+pysmt's z3 solver converts and asserts one formula at a time and wraps every call in its own bookkeeping. The
+Z3NativeSolver instead caches the z3 term of every pysmt node (keyed by the node id), buffers assertions and adds them
+to z3 in bulk right before they are needed (i.e., before push, pop and solve).
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import z3
+import pysmt.operators as op
+from pysmt.fnode import FNode
+from pysmt.typing import BOOL, INT, REAL
+
+
+class Z3TermBuilder:
+    """
+    Converts pysmt formulae (of the theories used by kipro2: Booleans, linear and non-linear integer and real
+    arithmetic, uninterpreted functions) to z3 terms.
+
+    Terms are built with z3's low-level C API, which avoids the type checks and coercions of z3's Python
+    expression classes. The raw ASTs are reference counted by hand: Every cached AST holds one reference for the
+    lifetime of the builder.
+    """
+
+    def __init__(self, ctx: z3.Context):
+        self._ctx = ctx
+        self._ctx_ref = ctx.ref()
+        # pysmt node id -> z3 AST. Node ids are never reused within a pysmt environment.
+        self._asts: Dict[int, z3.Ast] = dict()
+        # pysmt function symbol -> z3 function declaration
+        self._declarations: Dict[FNode, z3.FuncDeclRef] = dict()
+        self._sorts = {
+            BOOL: z3.BoolSort(ctx),
+            INT: z3.IntSort(ctx),
+            REAL: z3.RealSort(ctx),
+        }
+
+        def nary(mk):
+            return lambda node, args: mk(self._ctx_ref, len(args), (z3.Ast * len(args))(*args))
+
+        def unary(mk):
+            return lambda node, args: mk(self._ctx_ref, args[0])
+
+        def binary(mk):
+            return lambda node, args: mk(self._ctx_ref, args[0], args[1])
+
+        self._operators = {
+            op.AND: nary(z3.Z3_mk_and),
+            op.OR: nary(z3.Z3_mk_or),
+            op.NOT: unary(z3.Z3_mk_not),
+            op.IMPLIES: binary(z3.Z3_mk_implies),
+            op.IFF: binary(z3.Z3_mk_eq),
+            op.EQUALS: binary(z3.Z3_mk_eq),
+            op.ITE: lambda node, args: z3.Z3_mk_ite(self._ctx_ref, args[0], args[1], args[2]),
+            op.LE: binary(z3.Z3_mk_le),
+            op.LT: binary(z3.Z3_mk_lt),
+            op.PLUS: nary(z3.Z3_mk_add),
+            op.MINUS: nary(z3.Z3_mk_sub),
+            op.TIMES: nary(z3.Z3_mk_mul),
+            op.DIV: binary(z3.Z3_mk_div),
+            op.TOREAL: unary(z3.Z3_mk_int2real),
+            op.FUNCTION: lambda node, args: z3.Z3_mk_app(self._ctx_ref, self._declaration(node.function_name()).ast,
+                                                         len(args), (z3.Ast * len(args))(*args)),
+        }
+
+    def convert(self, formula: FNode) -> z3.Ast:
+        """
+        :return: The raw z3 AST of formula (wrap it with z3.BoolRef etc. if needed).
+        """
+        asts = self._asts
+        stack = [(formula, False)]
+        while stack:
+            (node, children_converted) = stack.pop()
+            if node.node_id() in asts:
+                continue
+            if not children_converted:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.args() if child.node_id() not in asts)
+                continue
+            ast = self._convert_node(node, [asts[child.node_id()] for child in node.args()])
+            z3.Z3_inc_ref(self._ctx_ref, ast)
+            asts[node.node_id()] = ast
+        return asts[formula.node_id()]
+
+    def _convert_node(self, node: FNode, args: List[z3.Ast]) -> z3.Ast:
+        node_type = node.node_type()
+        if node_type in self._operators:
+            return self._operators[node_type](node, args)
+        elif node_type == op.SYMBOL:
+            return z3.Z3_mk_const(self._ctx_ref, z3.Z3_mk_string_symbol(self._ctx_ref, node.symbol_name()),
+                                  self._sort(node.symbol_type()).ast)
+        elif node_type == op.BOOL_CONSTANT:
+            return z3.Z3_mk_true(self._ctx_ref) if node.constant_value() else z3.Z3_mk_false(self._ctx_ref)
+        elif node_type == op.INT_CONSTANT:
+            return z3.Z3_mk_numeral(self._ctx_ref, str(node.constant_value()), self._sorts[INT].ast)
+        elif node_type == op.REAL_CONSTANT:
+            value = node.constant_value()
+            return z3.Z3_mk_numeral(self._ctx_ref, "%s/%s" % (value.numerator, value.denominator),
+                                    self._sorts[REAL].ast)
+        raise Exception("The z3-native backend does not support %s." % op.op_to_str(node_type))
+
+    def _declaration(self, function_symbol: FNode) -> z3.FuncDeclRef:
+        if function_symbol not in self._declarations:
+            function_type = function_symbol.symbol_type()
+            sorts = [self._sort(t) for t in function_type.param_types] + [self._sort(function_type.return_type)]
+            self._declarations[function_symbol] = z3.Function(function_symbol.symbol_name(), *sorts)
+        return self._declarations[function_symbol]
+
+    def _sort(self, pysmt_type) -> z3.SortRef:
+        if pysmt_type not in self._sorts:
+            raise Exception("The z3-native backend does not support the type %s." % pysmt_type)
+        return self._sorts[pysmt_type]
+
+
+class Z3NativeSolver:
+    """
+    An incremental z3 solver offering the part of the pysmt solver interface used by kipro2: add_assertion(s), push,
+    pop, solve, is_sat, get_model and assertions.
+    """
+
+    def __init__(self, logic=None):
+        """
+        :param logic: An optional pysmt logic that is passed on to z3.SolverFor.
+        """
+        self._ctx = z3.Context()
+        self._builder = Z3TermBuilder(self._ctx)
+        self.z3 = z3.SolverFor(str(logic), ctx=self._ctx) if logic is not None else z3.Solver(ctx=self._ctx)
+        self._assertions: List[FNode] = []
+        # Number of assertions at every push
+        self._assertion_stack: List[int] = []
+        # Assertions that are not yet added to z3
+        self._pending: List[FNode] = []
+        # The model of the last satisfiable check. It stays available after popping (as with pysmt's solvers).
+        self._model = None
+
+    @property
+    def assertions(self) -> List[FNode]:
+        return self._assertions
+
+    def add_assertion(self, formula: FNode, named=None):
+        self._assertions.append(formula)
+        self._pending.append(formula)
+
+    def add_assertions(self, formulae: Iterable[FNode]):
+        for formula in formulae:
+            self.add_assertion(formula)
+
+    def _flush(self):
+        for formula in self._pending:
+            z3.Z3_solver_assert(self._ctx.ref(), self.z3.solver, self._builder.convert(formula))
+        self._pending = []
+
+    def push(self, levels: int = 1):
+        self._flush()
+        for _ in range(levels):
+            self._assertion_stack.append(len(self._assertions))
+            self.z3.push()
+
+    def pop(self, levels: int = 1):
+        # Assertions that are popped before being added do not have to be converted.
+        self._pending = []
+        for _ in range(levels):
+            del self._assertions[self._assertion_stack.pop():]
+        self.z3.pop(levels)
+
+    def solve(self, assumptions: Optional[Iterable[FNode]] = None) -> bool:
+        self._flush()
+        if assumptions is not None:
+            res = self.z3.check(*[z3.BoolRef(self._builder.convert(assumption), self._ctx)
+                                  for assumption in assumptions])
+        else:
+            res = self.z3.check()
+        if res == z3.unknown:
+            raise Exception("z3 returned unknown: %s" % self.z3.reason_unknown())
+        self._model = self.z3.model() if res == z3.sat else None
+        return res == z3.sat
+
+    def is_sat(self, formula: FNode) -> bool:
+        self.push()
+        self.add_assertion(formula)
+        res = self.solve()
+        self.pop()
+        return res
+
+    def get_model(self) -> z3.ModelRef:
+        """
+        The z3 model of the last check (used for logging).
+        """
+        if self._model is None:
+            raise Exception("The last check was not satisfiable, so there is no model.")
+        return self._model
@@ -0,0 +1,166 @@
+"""
+A persistent, content-addressed on-disk cache for the preprocessing results of characteristic functionals.
+
+Computing the loop-execute/loop-terminated DNFs of a characteristic functional involves computing the summation normal
+form and many satisfiability checks. These results only depend on the program and the post-expectation, so we store
+them on disk and reuse them whenever we check another upper bound for the same program and post-expectation.
+
+Terms are stored as SMT-LIB2 (one define-fun per term) inside a JSON document describing the structure of the DNFs.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from io import StringIO
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from pysmt.environment import get_env
+from pysmt.fnode import FNode
+from pysmt.smtlib.parser import SmtLibParser
+from pysmt.smtlib.printers import to_smtlib
+
+logger = logging.getLogger("kipro2")
+
+# Increment whenever the format of the cached payloads changes.
+CACHE_FORMAT_VERSION = 2
+
+
+class SmtLibTermWriter:
+    """
+    Collects pysmt terms and assigns a name to each of them. The resulting SMT-LIB2 script declares all occurring
+    symbols and defines one (nullary) function per term.
+    """
+
+    def __init__(self):
+        self._names: Dict[FNode, str] = dict()
+        self._definitions: List[str] = []
+        self._symbols = set()
+
+    def add(self, term: FNode) -> str:
+        """
+        Add a term to the script (if it has not been added yet) and return its name.
+        """
+        if term in self._names:
+            return self._names[term]
+
+        # The name must not clash with a symbol of the terms. "!" cannot occur in a pGCL identifier, so the name is
+        # quoted in the script.
+        name = "kipro2!t%s" % len(self._names)
+        self._names[term] = name
+        self._symbols.update(term.get_free_variables())
+        self._definitions.append(
+            "(define-fun |%s| () %s %s)" % (name, term.get_type().as_smtlib(funstyle=False),
+                                          to_smtlib(term, daggify=False)))
+        return name
+
+    def script(self) -> str:
+        declarations = ["(declare-fun %s %s)" % (to_smtlib(symbol, daggify=False),
+                                                 symbol.symbol_type().as_smtlib(funstyle=True))
+                        for symbol in sorted(self._symbols, key=lambda symbol: symbol.symbol_name())]
+        return "\n".join(declarations + self._definitions)
+
+
+def read_smtlib_terms(script: str) -> Dict[str, FNode]:
+    """
+    Parse a script written by SmtLibTermWriter in the current pysmt environment.
+
+    :return: A map from term names to the parsed terms.
+    """
+    parser = SmtLibParser(environment=get_env())
+    commands = parser.get_script(StringIO(script)).commands
+    return {command.args[0]: parser.cache.get(command.args[0])
+            for command in commands if command.name == "define-fun"}
+
+
+class CharacteristicFunctionalCache:
+    """
+    A directory containing one JSON file per (program, post-expectation) pair.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self._directory = Path(directory)
+
+    @staticmethod
+    def key(program: str, post_expectation: str) -> str:
+        """
+        Compute the cache key for a program and a post-expectation.
+
+        :param program: The normalized program text (e.g. the pretty-printed parsed program).
+        :param post_expectation: The post-expectation. Whitespace is ignored.
+        """
+        content = json.dumps([CACHE_FORMAT_VERSION, program, " ".join(post_expectation.split())])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self._directory.joinpath("%s.json" % key)
+
+    def load(self, key: str) -> Optional[dict]:
+        """
+        Return the payload stored for key, or None if there is none (or it cannot be read).
+        """
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            with path.open("r") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read cached characteristic functional %s: %s", path, e)
+            return None
+        if payload.get("version") != CACHE_FORMAT_VERSION:
+            return None
+        logger.info("Loaded cached characteristic functional from %s", path)
+        return payload
+
+    def store(self, key: str, payload: dict):
+        """
+        Store payload under key. The file is replaced atomically, so concurrent readers never see partial files.
+        """
+        self._directory.mkdir(parents=True, exist_ok=True)
+        payload = dict(payload, version=CACHE_FORMAT_VERSION)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self._directory), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, str(self._path(key)))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logger.info("Stored characteristic functional in cache %s", self._path(key))
+
+
+class InMemoryFunctionalCache:
+    """
+    Keeps payloads of characteristic functionals in memory and offers the interface of CharacteristicFunctionalCache.
+    It is picklable, so a process can preprocess a functional once and pass the result on to worker processes, which
+    then only parse the SMT-LIB2 terms.
+    """
+
+    def __init__(self, fallback: Optional[CharacteristicFunctionalCache] = None,
+                 payloads: Optional[Dict[str, dict]] = None):
+        """
+        :param fallback: An optional on-disk cache that is consulted on misses and to which new payloads are stored.
+        :param payloads: Payloads to start with (see get_payloads).
+        """
+        self._payloads: Dict[str, dict] = dict(payloads) if payloads is not None else dict()
+        self._fallback = fallback
+
+    key = staticmethod(CharacteristicFunctionalCache.key)
+
+    def load(self, key: str) -> Optional[dict]:
+        if key not in self._payloads and self._fallback is not None:
+            payload = self._fallback.load(key)
+            if payload is not None:
+                self._payloads[key] = payload
+        return self._payloads.get(key)
+
+    def store(self, key: str, payload: dict):
+        self._payloads[key] = payload
+        if self._fallback is not None:
+            self._fallback.store(key, payload)
+
+    def get_payloads(self) -> Dict[str, dict]:
+        return self._payloads
@@ -0,0 +1,119 @@
+"""
+Enumeration of the satisfiable cells of a DNF, i.e., of all combinations of polarities of a list of Boolean expressions
+(the guards of a summation normal form) whose conjunction is satisfiable.
+"""
+
+from itertools import product
+from multiprocessing import Pool
+from typing import List, Sequence, Tuple
+
+from pysmt.fnode import FNode
+from pysmt.shortcuts import Not, Solver, reset_env
+
+from kipro2.utils.cache import SmtLibTermWriter, read_smtlib_terms
+
+Cell = Tuple[bool, ...]
+
+
+def satisfiable_polarities(solver, literals: Sequence[FNode], background: FNode,
+                           prefix: Cell = ()) -> Tuple[List[Cell], int]:
+    """
+    Computes all sequences bin_seq of truth values (in the order of itertools.product([True, False], repeat=n)) that
+    start with prefix and for which the cell
+            background AND lit_1 AND ... AND lit_n,   where lit_i = literals[i] if bin_seq[i] else Not(literals[i]),
+    is satisfiable.
+
+    Instead of checking each of the 2^n cells from scratch, we perform a depth-first search over the polarities of
+    the literals on the incremental solver, deciding one literal per push. If a prefix of decisions is already
+    unsatisfiable, all cells below it are pruned.
+
+    :param solver: An incremental solver. Its assertion stack is left unchanged.
+    :param literals: The Boolean expressions whose polarities are enumerated.
+    :param background: A formula that is conjoined to every cell.
+    :param prefix: Fixed polarities for the first len(prefix) literals.
+    :return: The list of satisfiable truth value sequences and the number of pruned cells.
+    """
+
+    result = []
+    pruned = 0
+
+    def search(decided):
+        nonlocal pruned
+        if len(decided) == len(literals):
+            result.append(tuple(decided))
+            return
+
+        literal = literals[len(decided)]
+        polarities = [prefix[len(decided)]] if len(decided) < len(prefix) else [True, False]
+        for bin_val in polarities:
+            solver.push()
+            solver.add_assertion(literal if bin_val else Not(literal))
+            if solver.solve():
+                search(decided + [bin_val])
+            else:
+                # Cells that do not start with prefix are counted by the shards they belong to.
+                pruned += 2 ** (len(literals) - max(len(decided) + 1, len(prefix)))
+            solver.pop()
+
+    solver.push()
+    solver.add_assertion(background)
+    if solver.solve():
+        search([])
+    else:
+        pruned += 2 ** (len(literals) - len(prefix))
+    solver.pop()
+
+    return result, pruned
+
+
+def cell_to_index(cell: Cell) -> int:
+    """
+    The position of cell in the order of itertools.product([True, False], repeat=len(cell)).
+    """
+    index = 0
+    for bin_val in cell:
+        index = 2 * index + (0 if bin_val else 1)
+    return index
+
+
+def index_to_cell(index: int, length: int) -> Cell:
+    return tuple(index & (1 << (length - 1 - i)) == 0 for i in range(length))
+
+
+def _satisfiable_cell_indices_of_shard(task) -> Tuple[List[int], int]:
+    """
+    Runs in a worker process: Parse the literals in a fresh pysmt environment and enumerate the satisfiable cells
+    below the given prefix on a separate z3 instance. Only the cell indices are sent back to the parent.
+    """
+    script, literal_names, background_name, prefix = task
+    reset_env()
+    terms = read_smtlib_terms(script)
+    solver = Solver(name="z3")
+    cells, pruned = satisfiable_polarities(solver, [terms[name] for name in literal_names], terms[background_name],
+                                           prefix)
+    return [cell_to_index(cell) for cell in cells], pruned
+
+
+def parallel_satisfiable_polarities(literals: Sequence[FNode], background: FNode,
+                                    jobs: int) -> Tuple[List[Cell], int]:
+    """
+    Like satisfiable_polarities, but the search space is split by the polarities of the first few literals into
+    shards, which are searched by a pool of jobs worker processes.
+    """
+
+    writer = SmtLibTermWriter()
+    literal_names = [writer.add(literal) for literal in literals]
+    background_name = writer.add(background)
+    script = writer.script()
+
+    # Use a few more shards than workers to balance uneven subtrees.
+    shard_depth = min(len(literals), (4 * jobs - 1).bit_length())
+    tasks = [(script, literal_names, background_name, prefix)
+             for prefix in product([True, False], repeat=shard_depth)]
+
+    with Pool(jobs) as pool:
+        results = pool.map(_satisfiable_cell_indices_of_shard, tasks)
+
+    cells = [index_to_cell(index, len(literals)) for (indices, _) in results for index in indices]
+    pruned = sum(shard_pruned for (_, shard_pruned) in results)
+    return cells, pruned
@@ -2,7 +2,7 @@ import json
 import pickle
 import time
 from types import MethodType
-from typing import Any, BinaryIO, Dict, Optional
+from typing import Any, BinaryIO, Dict, List, Optional
 
 import attr
 from pysmt.shortcuts import Solver
@@ -62,12 +62,22 @@ class Statistics:
     sat_check_time: Timer = attr.ib(factory=Timer)
     k: Optional[int] = attr.ib(default=None)
     number_formulae: Optional[int] = attr.ib(default=None)
+    dnf_cells_pruned: int = attr.ib(default=0)
+    refute_checks: int = attr.ib(default=0)
+    functional_cache_hit: Optional[bool] = attr.ib(default=None)
+    simplifier_cache_hits: int = attr.ib(default=0)
+    simplifier_cache_misses: int = attr.ib(default=0)
+    candidates: Optional[List[Dict[str, Any]]] = attr.ib(default=None)
+    """With several candidate upper bounds: The pre, status and k of every candidate."""
 
     def __str__(self) -> str:
         lines = [
             "------ Statistics ------", f"Total time = {self.total_time}.",
             f"Time for computing formulae = {self.compute_formulae_time}.",
-            f"Time for sat checks: {self.sat_check_time}."
+            f"Time for sat checks: {self.sat_check_time}.",
+            f"Refutation checks: {self.refute_checks}.",
+            f"DNF cells pruned: {self.dnf_cells_pruned}.",
+            f"Simplifier cache: {self.simplifier_cache_hits} hits, {self.simplifier_cache_misses} misses."
         ]
         return "\n".join(lines)
 
@@ -86,18 +96,48 @@ class StatisticsEncoder(json.JSONEncoder):
         return super(json.JSONEncoder, self).default(obj)
 
 
+def update_simplifier_statistics(statistics: Statistics, simplifier):
+    """Copy the cache hit and miss counters of a (kipro2.pysmt_extensions) Simplifier to statistics."""
+    statistics.simplifier_cache_hits = simplifier.cache_hits
+    statistics.simplifier_cache_misses = simplifier.cache_misses
+
+
+def record_candidate_results(statistics: Statistics, candidates: List[Dict[str, Any]]):
+    """
+    Record the pre, status, k and number_formulae of several candidate upper bounds. The k and number_formulae of
+    statistics are those of the candidate decided last.
+    """
+    statistics.candidates = candidates
+    decided = [candidate for candidate in candidates if candidate["k"] is not None]
+    if decided:
+        last = max(decided, key=lambda candidate: candidate["k"])
+        statistics.k = last["k"]
+        statistics.number_formulae = last["number_formulae"]
+
+
+def add_preprocessing_statistics(statistics: Statistics, preprocessing_statistics: Statistics):
+    """Add the sat check time and pruned DNF cells of preprocessing a characteristic functional elsewhere to statistics."""
+    statistics.sat_check_time = Timer(statistics.sat_check_time.value + preprocessing_statistics.sat_check_time.value)
+    statistics.dnf_cells_pruned += preprocessing_statistics.dnf_cells_pruned
+
+
 def StatisticsSolver(statistics: Statistics, name=None, logic=None, **kwargs):
     """Create a new PySMT solver which also updates the sat check timer automatically."""
-    solver = Solver(name, logic, **kwargs)
-    old_is_sat = solver.is_sat
+    return time_sat_checks(statistics, Solver(name, logic, **kwargs))
+
+
+def time_sat_checks(statistics: Statistics, solver):
+    """Let the solver update the sat check timer of statistics on every call of solve."""
+    # is_sat calls solve, so timing solve covers both kinds of checks.
+    old_solve = solver.solve
 
-    def _timing_is_sat(self, *args, **kwargs):
+    def _timing_solve(self, *args, **kwargs):
         statistics.sat_check_time.start_timer()
         try:
-            res = old_is_sat(*args, **kwargs)
+            res = old_solve(*args, **kwargs)
         finally:
             statistics.sat_check_time.stop_timer()
         return res
 
-    solver.is_sat = MethodType(_timing_is_sat, solver)
+    solver.solve = MethodType(_timing_solve, solver)
     return solver
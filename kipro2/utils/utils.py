@@ -15,12 +15,6 @@ import pickle
 
 logger = logging.getLogger("kipro2")
 
-# Store encountered monus expressions Monus(a,b) as pairs (a,b) to build the corrsponding formula
-# if b <=a then Monus(a,b) = a -b else Monus(a,b) = 0
-encountered_monus_pairs = set()
-encountered_real_monus_pairs = set()
-
-
 def parse_fraction(val):
     """
     If val is a string, parse it as a Fraction.
@@ -44,184 +38,222 @@ def probably_expr_to_pysmt(expr,
                            monus_euf=None,
                            toReal=False):
     """
-    Convert a Probably expression to a pysmt expression.
-    Infinity must not occur in a composed arithmetic expression.
-
-    :param expr: The Propbably expression that is to be converted.
-    :param pysmt_infinity_variable: The pysmt variable used to represent infinity.
-    :param toReal: Whether variables and NatLitExpr shall be cast to Real or not.
-    :param treat_minus_as_monus: Whether to repalace every expression of the form a - b by monus_euf(a,b)
-    :param monus_euf: The uninterpreted function that is to be used for monus.
-    :return: The resulting PySMT expression.
+    Convert a Probably expression to a pysmt expression using a fresh ProbablyExprConverter.
+    The encountered monus expressions are not recorded. Use a ProbablyExprConverter if they are needed.
     """
+    return ProbablyExprConverter().convert(expr, pysmt_infinity_variable,
+                                           treat_minus_as_monus, monus_euf,
+                                           toReal)
 
-    env = get_env()
-    if isinstance(expr, BoolLitExpr):
-        if expr.value == True:
-            return TRUE()
-
-        elif expr.value == False:
-            return FALSE()
 
-        else:
-            raise Exception("Unkown expression value.")
+class ProbablyExprConverter:
+    """
+    Converts Probably expressions to pysmt expressions and keeps track of the encountered monus expressions.
 
-    elif isinstance(expr, NatLitExpr):
-        return Int(expr.value) if not toReal else Real(expr.value)
+    Every conversion context (e.g. a characteristic functional) owns its converter, so that monus expressions
+    encountered in one verification task do not leak into another one.
 
-    elif isinstance(expr, FloatLitExpr):
-        # This value might be infinity
-        if expr.is_infinite():
-            if pysmt_infinity_variable == None:
+    Conversions are memoized: Structurally equal subexpressions (e.g. the same guard occurring in many tuples of a
+    summation normal form) are converted only once per combination of conversion flags. The expression tree is
+    traversed with an explicit stack, so deeply nested expressions do not hit Python's recursion limit.
+    """
+    def __init__(self):
+        # Store encountered monus expressions Monus(a,b) as pairs (a,b) to build the corrsponding formula
+        # if b <=a then Monus(a,b) = a -b else Monus(a,b) = 0
+        self.monus_pairs = set()
+        self.real_monus_pairs = set()
+
+        # Probably expressions are mutable and not hashable. We therefore assign an integer to every structurally
+        # distinct expression (hash consing) and key the memo on these integers. The structure of an expression is
+        # looked up by its id only within a single call of convert (see convert), since expressions may be mutated or
+        # freed afterwards.
+        self._structure_ids = dict()
+        # (structure id, pysmt_infinity_variable, treat_minus_as_monus, monus_euf, toReal) -> pysmt expression
+        self._memo = dict()
+
+    def convert(self,
+                expr,
+                pysmt_infinity_variable=None,
+                treat_minus_as_monus=False,
+                monus_euf=None,
+                toReal=False):
+        """
+        Convert a Probably expression to a pysmt expression.
+        Infinity must not occur in a composed arithmetic expression.
+
+        :param expr: The Propbably expression that is to be converted.
+        :param pysmt_infinity_variable: The pysmt variable used to represent infinity.
+        :param toReal: Whether variables and NatLitExpr shall be cast to Real or not.
+        :param treat_minus_as_monus: Whether to repalace every expression of the form a - b by monus_euf(a,b)
+        :param monus_euf: The uninterpreted function that is to be used for monus.
+        :return: The resulting PySMT expression.
+        """
+
+        flags = (pysmt_infinity_variable, treat_minus_as_monus, monus_euf, toReal)
+        # id(expr) -> structure id for the subexpressions of expr, which are alive and unchanged during this call
+        expr_ids = dict()
+
+        stack = [(expr, False)]
+        while stack:
+            (current, children_converted) = stack.pop()
+            if not children_converted:
+                if self._is_memoized(current, flags, expr_ids):
+                    continue
+                stack.append((current, True))
+                for child in self._children(current):
+                    stack.append((child, False))
+            else:
+                children = self._children(current)
+                structure_id = self._structure_id(current, children, expr_ids)
+                if (structure_id,) + flags not in self._memo:
+                    self._memo[(structure_id,) + flags] = self._convert_node(
+                        current, [self._memo[(expr_ids[id(child)],) + flags] for child in children],
+                        pysmt_infinity_variable, treat_minus_as_monus, monus_euf, toReal)
+
+        return self._memo[(expr_ids[id(expr)],) + flags]
+
+    def _is_memoized(self, expr, flags, expr_ids):
+        structure_id = expr_ids.get(id(expr))
+        return structure_id is not None and (structure_id,) + flags in self._memo
+
+    @staticmethod
+    def _children(expr):
+        if isinstance(expr, TickExpr):
+            if not isinstance(expr.expr, NatLitExpr):
                 raise Exception(
-                    "If infinity occurs in an arithmetic expression, then pysmt_infinity_variable must not be none."
+                    "Currently we allow for constants in tick(..) expressions only."
                 )
-            return pysmt_infinity_variable
-
+            return [expr.expr]
+        elif isinstance(expr, BinopExpr):
+            return [expr.lhs, expr.rhs]
+        elif isinstance(expr, UnopExpr):
+            return [expr.expr]
         else:
-            return Real(expr.to_fraction())
-
-    elif isinstance(expr, VarExpr):
-        return env.formula_manager.get_symbol(
-            expr.var) if not toReal else ToReal(
-                env.formula_manager.get_symbol(expr.var))
-
-    elif isinstance(expr, TickExpr):
-        if not isinstance(expr.expr, NatLitExpr):
-            raise Exception(
-                "Currently we allow for constants in tick(..) expressions only."
-            )
+            return []
+
+    def _structure_id(self, expr, children, expr_ids):
+        """
+        The integer identifying the structure of expr. The structure ids of all children must already be in expr_ids.
+        """
+        structure_id = expr_ids.get(id(expr))
+        if structure_id is not None:
+            return structure_id
+
+        if isinstance(expr, (BinopExpr, UnopExpr)):
+            label = expr.operator
+        elif isinstance(expr, (BoolLitExpr, NatLitExpr, FloatLitExpr)):
+            label = expr.value
+        elif isinstance(expr, VarExpr):
+            label = expr.var
         else:
-            return probably_expr_to_pysmt(expr.expr, pysmt_infinity_variable,
-                                          treat_minus_as_monus, monus_euf,
-                                          toReal)
-
-    elif isinstance(expr, BinopExpr):
-        if expr.operator == Binop.OR:
-            return Or(
-                probably_expr_to_pysmt(expr.lhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal),
-                probably_expr_to_pysmt(expr.rhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal))
-
-        if expr.operator == Binop.AND:
-            return And(
-                probably_expr_to_pysmt(expr.lhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal),
-                probably_expr_to_pysmt(expr.rhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal))
-
-        if expr.operator == Binop.LEQ:
-            return LE(
-                probably_expr_to_pysmt(expr.lhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal),
-                probably_expr_to_pysmt(expr.rhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal))
-
-        if expr.operator == Binop.LE:
-            return LT(
-                probably_expr_to_pysmt(expr.lhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal),
-                probably_expr_to_pysmt(expr.rhs, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal))
-
-        if expr.operator == Binop.EQ:
-            lhs = probably_expr_to_pysmt(expr.lhs, pysmt_infinity_variable,
-                                         treat_minus_as_monus, monus_euf,
-                                         toReal)
-            rhs = probably_expr_to_pysmt(expr.rhs, pysmt_infinity_variable,
-                                         treat_minus_as_monus, monus_euf,
-                                         toReal)
-            return EqualsOrIff(lhs, rhs)
-
-        if expr.operator == Binop.PLUS:
-            summand_1 = probably_expr_to_pysmt(expr.lhs,
-                                               pysmt_infinity_variable,
-                                               treat_minus_as_monus, monus_euf,
-                                               toReal)
-            summand_2 = probably_expr_to_pysmt(expr.rhs,
-                                               pysmt_infinity_variable,
-                                               treat_minus_as_monus, monus_euf,
-                                               toReal)
-
-            if summand_1 == pysmt_infinity_variable or summand_2 == pysmt_infinity_variable:
-                raise Exception(
-                    "Infinity must not occur in a composed arithmetic expression."
-                )
+            label = None
 
-            return Plus(summand_1, summand_2)
+        structure = (type(expr), label) + tuple(expr_ids[id(child)] for child in children)
+        structure_id = self._structure_ids.setdefault(structure, len(self._structure_ids))
+        expr_ids[id(expr)] = structure_id
+        return structure_id
 
-        if expr.operator == Binop.MINUS:
-            min_1 = probably_expr_to_pysmt(expr.lhs, pysmt_infinity_variable,
-                                           treat_minus_as_monus, monus_euf,
-                                           toReal)
-            min_2 = probably_expr_to_pysmt(expr.rhs, pysmt_infinity_variable,
-                                           treat_minus_as_monus, monus_euf,
-                                           toReal)
+    def _convert_node(self, expr, converted_children, pysmt_infinity_variable, treat_minus_as_monus, monus_euf,
+                      toReal):
+        """
+        Convert expr to a pysmt expression, given the already converted children of expr.
+        """
 
-            if min_1 == pysmt_infinity_variable or min_2 == pysmt_infinity_variable:
-                raise Exception(
-                    "Infinity must not occur in a composed arithmetic expression."
-                )
+        env = get_env()
+        if isinstance(expr, BoolLitExpr):
+            if expr.value == True:
+                return TRUE()
+
+            elif expr.value == False:
+                return FALSE()
+
+            else:
+                raise Exception("Unkown expression value.")
 
-            # Do we have to treat minus as monus?
-            if treat_minus_as_monus:
-                if monus_euf == None:
+        elif isinstance(expr, NatLitExpr):
+            return Int(expr.value) if not toReal else Real(expr.value)
+
+        elif isinstance(expr, FloatLitExpr):
+            # This value might be infinity
+            if expr.is_infinite():
+                if pysmt_infinity_variable == None:
                     raise Exception(
-                        "If minus is to be treated as monus, then a monus_euf has to be provided."
+                        "If infinity occurs in an arithmetic expression, then pysmt_infinity_variable must not be none."
                     )
+                return pysmt_infinity_variable
 
-                monus_expr = Function(monus_euf, (min_1, min_2))
+            else:
+                return Real(expr.to_fraction())
 
-                if toReal:
-                    encountered_real_monus_pairs.add((min_1, min_2))
-                else:
-                    encountered_monus_pairs.add((min_1, min_2))
+        elif isinstance(expr, VarExpr):
+            return env.formula_manager.get_symbol(
+                expr.var) if not toReal else ToReal(
+                    env.formula_manager.get_symbol(expr.var))
 
-                return monus_expr
-            else:
-                return Minus(min_1, min_2)
+        elif isinstance(expr, TickExpr):
+            return converted_children[0]
 
-        if expr.operator == Binop.TIMES:
-            fac_1 = probably_expr_to_pysmt(expr.lhs, pysmt_infinity_variable,
-                                           treat_minus_as_monus, monus_euf,
-                                           toReal)
-            fac_2 = probably_expr_to_pysmt(expr.rhs, pysmt_infinity_variable,
-                                           treat_minus_as_monus, monus_euf,
-                                           toReal)
+        elif isinstance(expr, BinopExpr):
+            (lhs, rhs) = converted_children
 
-            if fac_1 == pysmt_infinity_variable or fac_2 == pysmt_infinity_variable:
-                raise Exception(
-                    "Infinity must not occur in a composed arithmetic expression."
-                )
+            if expr.operator == Binop.OR:
+                return Or(lhs, rhs)
 
-            return Times(fac_1, fac_2)
+            if expr.operator == Binop.AND:
+                return And(lhs, rhs)
 
-    elif isinstance(expr, UnopExpr):
-        if expr.operator == Unop.NEG:
-            return Not(
-                probably_expr_to_pysmt(expr.expr, pysmt_infinity_variable,
-                                       treat_minus_as_monus, monus_euf,
-                                       toReal))
+            if expr.operator == Binop.LEQ:
+                return LE(lhs, rhs)
 
-        elif expr.operator == Unop.IVERSON:
-            return probably_expr_to_pysmt(expr.expr, pysmt_infinity_variable,
-                                          treat_minus_as_monus, monus_euf,
-                                          toReal)
+            if expr.operator == Binop.LE:
+                return LT(lhs, rhs)
 
-        else:
-            raise Exception("Unsupported Unop Operator")
+            if expr.operator == Binop.EQ:
+                return EqualsOrIff(lhs, rhs)
 
-    else:
-        raise Exception("Invalid expression {expr}")
+            if expr.operator in (Binop.PLUS, Binop.MINUS, Binop.TIMES):
+                if lhs == pysmt_infinity_variable or rhs == pysmt_infinity_variable:
+                    raise Exception(
+                        "Infinity must not occur in a composed arithmetic expression."
+                    )
+
+            if expr.operator == Binop.PLUS:
+                return Plus(lhs, rhs)
+
+            if expr.operator == Binop.MINUS:
+                # Do we have to treat minus as monus?
+                if treat_minus_as_monus:
+                    if monus_euf == None:
+                        raise Exception(
+                            "If minus is to be treated as monus, then a monus_euf has to be provided."
+                        )
+
+                    monus_expr = Function(monus_euf, (lhs, rhs))
+
+                    if toReal:
+                        self.real_monus_pairs.add((lhs, rhs))
+                    else:
+                        self.monus_pairs.add((lhs, rhs))
+
+                    return monus_expr
+                else:
+                    return Minus(lhs, rhs)
+
+            if expr.operator == Binop.TIMES:
+                return Times(lhs, rhs)
+
+        elif isinstance(expr, UnopExpr):
+            if expr.operator == Unop.NEG:
+                return Not(converted_children[0])
+
+            elif expr.operator == Unop.IVERSON:
+                return converted_children[0]
+
+            else:
+                raise Exception("Unsupported Unop Operator")
+
+        else:
+            raise Exception("Invalid expression {expr}")
 
 
 def print_all_formulae(solver, where_to_print):
@@ -244,18 +276,35 @@ def substitute_all_formulae(formulae,
                             simplifier=None):
     """
     Apply the substitution sub to every formula in formulae using the euf_substituter.
+    Subterms shared by several formulae are substituted only once.
 
     :param formulae: The set of formulae that is to be substituted.
     :param sub: The substitution that is to be applied.
     :param euf_substituter:
     :param simplify: Whether to simplify the resulting formulae using simplifier.
     """
+    return substitute_all_formulae_by_all(formulae, [sub], euf_substituter,
+                                          simplify, simplifier)
+
+
+def substitute_all_formulae_by_all(formulae,
+                                   subs,
+                                   euf_substituter,
+                                   simplify=False,
+                                   simplifier=None):
+    """
+    Apply every substitution in subs to every formula in formulae using a single walk of the euf_substituter.
+
+    :param formulae: The set of formulae that is to be substituted.
+    :param subs: The list of substitutions that are to be applied.
+    :param euf_substituter:
+    :param simplify: Whether to simplify the resulting formulae using simplifier.
+    :return: The set of all substituted formulae.
+    """
     result = set()
-    for formula in formulae:
-        new_formula = simplifier.simplify(
-            euf_substituter.substitute(formula, sub)) if simplify \
-            else euf_substituter.substitute(formula, sub)
-        result.add(new_formula)
+    for substituted_formulae in euf_substituter.substitute_many(formulae, subs):
+        for new_formula in substituted_formulae:
+            result.add(simplifier.simplify(new_formula) if simplify else new_formula)
     return result
 
 
@@ -92,4 +92,28 @@ while(running = 0){
     }{
         skip
     }
-}"""
\ No newline at end of file
+}"""
+
+
+# The inner branch x<2 can never be taken
+contradictory_guards = """nat x;
+nat c;
+
+while(c=1){
+    if(x<3){
+        x:=x+1;
+    }{
+        if(x<2){
+            x:=x+2;
+        }{
+            c:=0;
+        }
+    }
+}"""
+
+
+random_walk = """nat x;
+
+while(0<x){
+   {x := x-1}[0.5]{x := x+1}
+}"""
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from kipro2.batch import read_manifest, run_batch_task
+
+from tests.programs import *
+
+
+def test_batch(tmp_path):
+    tmp_path.joinpath("geo.pgcl").write_text(geo)
+    tasks = [{"program": "geo.pgcl", "post": "c", "pre": "c+1", "checker": "kind"},
+             {"program": "geo.pgcl", "post": "c", "pre": "c+0.99", "checker": "bmc", "assert_refute": 11},
+             {"program": "geo.pgcl", "post": "c", "pre": "c+0.99", "timeout": 60}]
+    manifest = tmp_path.joinpath("manifest.jsonl")
+    manifest.write_text("\n".join(json.dumps(task) for task in tasks))
+
+    results = [run_batch_task(task) for task in read_manifest(str(manifest))]
+    assert [result["status"] for result in results] == ["inductive", "refuted", "refuted"]
+    assert [result["statistics"]["args"]["checker"] for result in results] == ["kind", "bmc", "combined"]
+
+
+def test_manifest_errors(tmp_path):
+    manifest = tmp_path.joinpath("manifest.jsonl")
+    manifest.write_text(json.dumps({"program": "geo.pgcl", "post": "c", "pre": "c+1", "checker": "both"}))
+    with pytest.raises(Exception, match="Unknown checker"):
+        read_manifest(str(manifest))
+
+    manifest.write_text(json.dumps({"program": "geo.pgcl", "post": "c", "pre": "c+1", "timelimit": 5}))
+    with pytest.raises(Exception, match="Unknown keys timelimit"):
+        read_manifest(str(manifest))
@@ -1,9 +1,19 @@
 # TODO: Test infty, test monus
+import pickle
+
 import pytest
+from click.testing import CliRunner
 from pysmt.shortcuts import *
 
 from kipro2.incremental_bmc.incremental_bmc import *
-from kipro2.utils.statistics import Statistics
+from kipro2.incremental_bmc.check_schedule import parse_check_schedule
+from kipro2.incremental_bmc.formula_generator import FormulaGenerator
+from kipro2.pysmt_extensions.euf_substituter import EUFMGSubstituter
+from kipro2.replay import main as replay_main, replay
+from kipro2.solvers.factory import SolverBackend
+from kipro2.solvers.smtlib_process import DEFAULT_SMTLIB_COMMAND
+from kipro2.utils.statistics import Statistics, Timer
+from kipro2.utils.cache import CharacteristicFunctionalCache, InMemoryFunctionalCache, SmtLibTermWriter, read_smtlib_terms
 
 from tests.programs import *
 
@@ -49,3 +59,248 @@ def test_rabin():
 
 
 
+
+def test_cached_characteristic_functional(tmp_path):
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker both
+    cache = CharacteristicFunctionalCache(tmp_path)
+    for expected_cache_hit in [False, True]:
+        statistics = Statistics(dict())
+        res = IncrementalBMC(brp, "totalFailed", "totalFailed +1", statistics,
+                             500, 1, True, cache=cache).apply_bmc()
+        reset_env()
+        assert res == False
+        assert statistics.functional_cache_hit == expected_cache_hit
+
+
+def test_cached_terms_named_like_variables(tmp_path):
+    # The names of cached terms must not capture program variables
+    t0 = Symbol("t0", INT)
+    writer = SmtLibTermWriter()
+    names = [writer.add(Plus(Symbol("x", INT), Int(5))), writer.add(LT(Int(1), t0))]
+    terms = read_smtlib_terms(writer.script())
+    assert terms[names[1]] == LT(Int(1), t0)
+
+    # // ARGS: --post t0 --pre "t0+0.99" --checker both
+    geo_t0 = geo.replace("c", "t0")
+    cache = CharacteristicFunctionalCache(tmp_path)
+    for expected_cache_hit in [False, True]:
+        statistics = Statistics(dict())
+        res = IncrementalBMC(geo_t0, "t0", "t0+0.99", statistics, 500, 1, True, cache=cache).apply_bmc()
+        reset_env()
+        assert res == False
+        assert statistics.functional_cache_hit == expected_cache_hit
+        assert statistics.k == 11
+
+
+def test_in_memory_characteristic_functional_cache():
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker both
+    cache = InMemoryFunctionalCache()
+    CharacteristicFunctional(brp, "totalFailed", Statistics(dict()), cache)
+    reset_env()
+    # As the workers of --checker both receive it
+    cache = pickle.loads(pickle.dumps(cache))
+    statistics = Statistics(dict())
+    res = IncrementalBMC(brp, "totalFailed", "totalFailed +1", statistics,
+                         500, 1, True, cache=cache).apply_bmc()
+    reset_env()
+    assert res == False
+    assert statistics.functional_cache_hit == True
+    assert statistics.k == 13
+
+
+@pytest.mark.parametrize("instantiation", ["substitute", "template"])
+def test_instantiation(instantiation):
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker both
+    statistics = Statistics(dict())
+    res = IncrementalBMC(brp, "totalFailed", "totalFailed +1", statistics,
+                         500, 1, True, instantiation=instantiation).apply_bmc()
+    reset_env()
+    assert res == False
+    assert statistics.k == 13
+
+
+def _applications(formula, euf):
+    if formula.is_function_application() and formula.function_name() == euf:
+        return {formula.args()}
+    return set().union(*[_applications(arg, euf) for arg in formula.args()])
+
+
+def test_frontier():
+    # Instantiating at the frontier gives the formulae of substituting every formula by every substitution, up to
+    # equivalence
+    functional = CharacteristicFunctional(brp, "totalFailed", Statistics(dict()))
+    formula_generator = FormulaGenerator(functional, "totalFailed +1", True, False)
+    substituter = EUFMGSubstituter(get_env())
+    simplifier = formula_generator.get_simplifier()
+    full_formulae = formula_generator.get_loop_terminate_formulae()
+    for _ in range(4):
+        (current_euf, next_euf) = formula_generator.get_eufs()[-2:]
+        subs_list = [{**sub, current_euf: next_euf} for sub in functional.get_pysmt_loop_execute_substitutions()]
+        full_formulae = {simplifier.simplify(formula)
+                         for formulae in substituter.substitute_many(full_formulae, subs_list) for formula in formulae}
+        formula_generator.prepare_next_depth()
+        formulae = formula_generator.get_loop_terminate_formulae()
+
+        assert set().union(*[_applications(formula, next_euf) for formula in full_formulae]) == \
+            set(formula_generator.get_frontier())
+        assert is_valid(Iff(And(full_formulae), And(formulae)))
+        # Full instantiation only adds formulae that are syntactically different but equivalent
+        distinct_full_formulae = []
+        for formula in full_formulae:
+            if not any(is_valid(Iff(formula, other)) for other in distinct_full_formulae):
+                distinct_full_formulae.append(formula)
+        assert len(formulae) == len(distinct_full_formulae)
+    reset_env()
+
+
+def test_frontier_monus():
+    # Decrements are encoded by monus, Monus(x+1, 1) and x give the same argument tuple
+    functional = CharacteristicFunctional(random_walk, "1", Statistics(dict()))
+    formula_generator = FormulaGenerator(functional, "1", True, False)
+    x = functional.get_pysmt_program_variables_argument()
+    sizes = []
+    for _ in range(3):
+        formula_generator.prepare_next_depth()
+        sizes.append(len(formula_generator.get_frontier()))
+        if len(sizes) == 2:
+            assert x in formula_generator.get_frontier()
+    assert sizes == [2, 4, 6]
+
+    statistics = Statistics(dict())
+    assert IncrementalBMC(random_walk, "[x=0]", "[x=0] + [0<x]*0.5", statistics, 20, 1, True).apply_bmc() == False
+    assert statistics.k == 3
+    reset_env()
+
+
+def _checked_depths(schedule, depths, statistics=None):
+    statistics = statistics if statistics is not None else Statistics(dict())
+    return [depth for depth in depths if schedule.should_check(depth, statistics)]
+
+
+@pytest.mark.parametrize("schedule", ["fixed:3", "geometric:2", "cost-ratio:0.5", "explicit:5,10,12"])
+def test_check_schedule(schedule):
+    #// ARGS: --post c --pre "c+0.999999999999" --checker both
+    refuting_depth = 46
+    statistics = Statistics(dict())
+    res = IncrementalBMC(geo, "c", "c+0.999999999999", statistics, 500, 1, True,
+                         check_schedule=parse_check_schedule(schedule)).apply_bmc()
+    reset_env()
+    assert res == False
+    assert statistics.k >= refuting_depth
+    if schedule.startswith("cost-ratio"):
+        # The checked depths depend on the timings, but a check is skipped only until the depth doubles
+        assert statistics.refute_checks <= statistics.k
+        assert statistics.k < 2 * refuting_depth
+    else:
+        checked_depths = _checked_depths(parse_check_schedule(schedule), range(1, statistics.k + 1))
+        # The refutation is found at the first check after the last unsatisfiable one
+        assert checked_depths[-1] == statistics.k
+        assert checked_depths[-2] < refuting_depth
+        assert statistics.refute_checks == len(checked_depths)
+
+
+def test_check_schedule_depths():
+    depths = range(1, 21)
+    assert _checked_depths(parse_check_schedule("fixed:3"), depths) == [3, 6, 9, 12, 15, 18]
+    assert _checked_depths(parse_check_schedule("fixed:1"), depths) == list(depths)
+    assert _checked_depths(parse_check_schedule("geometric:2"), depths) == [1, 2, 4, 8, 16]
+    assert _checked_depths(parse_check_schedule("geometric:1.5"), depths) == [1, 2, 3, 5, 8, 12, 18]
+    # After the last depth, the distance between the last two depths is kept
+    assert _checked_depths(parse_check_schedule("explicit:12,5,10"), depths) == [5, 10, 12, 14, 16, 18, 20]
+    assert _checked_depths(parse_check_schedule("explicit:18"), depths) == [18, 19, 20]
+
+    # Check while SAT checks take at most half the time of computing formulae, otherwise once the depth doubled
+    schedule = parse_check_schedule("cost-ratio:0.5")
+    statistics = Statistics(dict(), compute_formulae_time=Timer(1.0), sat_check_time=Timer(0.4))
+    assert _checked_depths(schedule, range(1, 4), statistics) == [1, 2, 3]
+    statistics.sat_check_time = Timer(2.0)
+    assert _checked_depths(schedule, range(4, 13), statistics) == [6, 12]
+    statistics.sat_check_time = Timer(0.5)
+    assert _checked_depths(schedule, range(13, 15), statistics) == [13, 14]
+
+
+@pytest.mark.parametrize("backend", ["pysmt", "z3-native", "smtlib"])
+def test_backend(backend):
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker both
+    statistics = Statistics(dict())
+    res = IncrementalBMC(brp, "totalFailed", "totalFailed +1", statistics,
+                         500, 1, True, backend=backend).apply_bmc()
+    reset_env()
+    assert res == False
+    assert statistics.k == 13
+
+
+@pytest.mark.parametrize("backend", ["pysmt", "z3-native", "smtlib"])
+def test_activation_scoping(backend):
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker both
+    statistics = Statistics(dict())
+    res = IncrementalBMC(brp, "totalFailed", "totalFailed +1", statistics,
+                         500, 1, True, backend=SolverBackend(name=backend, scoping="activation")).apply_bmc()
+    reset_env()
+    assert res == False
+    assert statistics.k == 13
+
+
+@pytest.mark.parametrize("backend", ["pysmt", "smtlib"])
+def test_pipeline(backend):
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker both
+    statistics = Statistics(dict())
+    res = IncrementalBMC(brp, "totalFailed", "totalFailed +1", statistics,
+                         500, 1, True, backend=backend, pipeline=True).apply_bmc()
+    reset_env()
+    assert res == False
+    assert statistics.k == 13
+
+
+def test_replay(tmp_path):
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker bmc --dump-smt2 brp.smt2
+    trace = tmp_path / "brp.smt2"
+    statistics = Statistics(dict())
+    res = IncrementalBMC(brp, "totalFailed", "totalFailed +1", statistics,
+                         500, 1, True, dump_smt2=str(trace)).apply_bmc()
+    reset_env()
+    assert res == False
+    assert statistics.k == 13
+
+    # kipro2_replay brp.smt2
+    results = replay(trace.read_text().splitlines(), DEFAULT_SMTLIB_COMMAND)
+    assert [result.expected for result in results] == ["unsat"] * 12 + ["sat"]
+    assert [result.result for result in results] == [result.expected for result in results]
+    assert CliRunner().invoke(replay_main, [str(trace)]).exit_code == 0
+
+
+def test_multi_candidate():
+    # // ARGS: --post c --pre "c+0.99" --pre "c+1" --checker bmc
+    from kipro2.incremental_bmc.multi_candidate_bmc import MultiCandidateBMC
+    statistics = Statistics(dict())
+    res = MultiCandidateBMC(geo, "c", ["c+0.99", "c+1"], statistics, max_iterations=30).apply_bmc()
+    reset_env()
+    assert res == True
+    assert [(candidate["status"], candidate["k"]) for candidate in statistics.candidates] == [("refuted", 11),
+                                                                                             ("undecided", None)]
+    # As for c+0.99 alone
+    assert (statistics.k, statistics.number_formulae) == (11, 103)
+
+
+def test_multi_candidate_monus():
+    # // ARGS: --post c --pre "c+0.99" --pre "c+2-1" --checker bmc
+    from kipro2.incremental_bmc.multi_candidate_bmc import MultiCandidateBMC
+    # Only the second candidate subtracts. It is c+1, which is not refutable, if its Monus is defined on the solver.
+    statistics = Statistics(dict())
+    MultiCandidateBMC(geo, "c", ["c+0.99", "c+2-1"], statistics, max_iterations=12).apply_bmc()
+    reset_env()
+    assert [(candidate["status"], candidate["k"]) for candidate in statistics.candidates] == [("refuted", 11),
+                                                                                             ("undecided", None)]
+
+
+def test_multi_candidate_logic(tmp_path):
+    # // ARGS: --post c --pre "c+0.99" --pre "c*c+1" --checker bmc --dump-smt2 ...
+    from kipro2.incremental_bmc.multi_candidate_bmc import MultiCandidateBMC
+    trace = tmp_path.joinpath("geo.smt2")
+    # The solver is only restricted to linear arithmetic if all candidates are linear
+    for (candidates, linear) in [(["c+0.99", "c+1"], True), (["c+0.99", "c*c+1"], False)]:
+        statistics = Statistics(dict())
+        MultiCandidateBMC(geo, "c", candidates, statistics, max_iterations=12, dump_smt2=str(trace)).apply_bmc()
+        reset_env()
+        assert statistics.candidates[0]["k"] == 11
+        assert ("(set-logic QF_UFLIRA)" in trace.read_text().splitlines()) == linear
@@ -0,0 +1,34 @@
+import json
+
+from click.testing import CliRunner
+from pysmt.shortcuts import reset_env
+
+from kipro2.characteristic_functional import CharacteristicFunctional
+from kipro2.cmd import main
+from kipro2.utils.statistics import Statistics
+
+from tests.programs import *
+
+
+def test_both_statistics(tmp_path):
+    # // ARGS: --post x --pre x --checker both
+    program = tmp_path.joinpath("guards.pgcl")
+    program.write_text(contradictory_guards)
+    preprocessing = Statistics(dict())
+    CharacteristicFunctional(contradictory_guards, "x", preprocessing)
+    reset_env()
+
+    # The checkers load the functional preprocessed by the parent process, whose statistics are part of theirs
+    result = CliRunner().invoke(main, [str(program), "--post", "x", "--pre", "x", "--checker", "both",
+                                       "--stats-path", str(tmp_path.joinpath("stats"))])
+    assert result.exit_code == 0
+    statistics = json.loads(tmp_path.joinpath("stats-bmc.json").read_text())
+    assert statistics["status"] == "refuted"
+    assert statistics["dnf_cells_pruned"] == preprocessing.dnf_cells_pruned > 0
+
+    # If preprocessing fails, the checkers do not start
+    result = CliRunner().invoke(main, [str(program), "--post", "x +", "--pre", "x", "--checker", "both",
+                                       "--stats-path", str(tmp_path.joinpath("failed"))])
+    assert result.exit_code != 0
+    for checker in ["bmc", "kind"]:
+        assert json.loads(tmp_path.joinpath("failed-%s.json" % checker).read_text())["status"] == "err"
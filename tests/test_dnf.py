@@ -0,0 +1,89 @@
+import multiprocessing
+from itertools import product
+
+from pysmt.shortcuts import *
+
+from kipro2.characteristic_functional import CharacteristicFunctional, MIN_LITERALS_FOR_PARALLEL_PREPROCESSING
+from kipro2.utils.dnf import parallel_satisfiable_polarities, satisfiable_polarities
+from kipro2.utils.statistics import Statistics
+
+from tests.programs import contradictory_guards
+
+
+def _brute_force_polarities(literals, background):
+    return [cell for cell in product([True, False], repeat=len(literals))
+            if is_sat(And([background] + [literal if bin_val else Not(literal) for (literal, bin_val) in
+                                          zip(literals, cell)]))]
+
+
+def test_satisfiable_polarities():
+    x = Symbol("x", INT)
+    literals = [LT(x, Int(3)), LT(x, Int(5)), GE(x, Int(5)), LT(x, Int(1))]
+    background = GE(x, Int(0))
+
+    cells, pruned = satisfiable_polarities(Solver(name="z3"), literals, background)
+    expected = _brute_force_polarities(literals, background)
+    assert cells == expected
+    assert pruned == 2 ** len(literals) - len(expected)
+
+    # With a prefix, only the cells below it are enumerated and counted
+    cells, pruned = satisfiable_polarities(Solver(name="z3"), literals, background, (True, ))
+    assert cells == [cell for cell in expected if cell[0]]
+    assert pruned == 2 ** (len(literals) - 1) - len(cells)
+    reset_env()
+
+
+def test_dnf_cells_pruned():
+    statistics = Statistics(dict())
+    functional = CharacteristicFunctional(contradictory_guards, "x", statistics)
+    assert statistics.dnf_cells_pruned > 0
+
+    variables = {variable.symbol_name(): variable for variable in functional.get_pysmt_program_variables()}
+    guards = [guard for (guard, _) in functional.get_loop_execute_guard_and_prob_sub_pairs()]
+    # One cell for x<3 and one for x>=3, none for the contradictory branch
+    assert len(guards) == 2
+    for (i, guard) in enumerate(guards):
+        assert is_sat(And(functional.non_negative_constraint, guard))
+        for other in guards[i + 1:]:
+            assert is_unsat(And(guard, other))
+    assert is_valid(Implies(functional.non_negative_constraint,
+                            Iff(Or(guards), Equals(variables["c"], Int(1)))))
+    reset_env()
+
+
+def _many_literals():
+    x = Symbol("x", INT)
+    y = Symbol("y", INT)
+    literals = [LT(x, Int(bound)) for bound in range(1, 5)] + [LT(y, x), Equals(y, Int(2)), LT(Plus(x, y), Int(4))]
+    assert len(literals) >= MIN_LITERALS_FOR_PARALLEL_PREPROCESSING
+    return (literals, And(GE(x, Int(0)), GE(y, Int(0))))
+
+
+def test_parallel_satisfiable_polarities():
+    (literals, background) = _many_literals()
+    assert parallel_satisfiable_polarities(literals, background, 2) == \
+        satisfiable_polarities(Solver(name="z3"), literals, background)
+    reset_env()
+
+
+def _satisfiable_polarities_in_daemon(results):
+    functional = CharacteristicFunctional.__new__(CharacteristicFunctional)
+    functional._statistics = Statistics(dict())
+    functional._sat_solver = Solver(name="z3")
+    functional._preprocess_jobs = 2
+    (literals, background) = _many_literals()
+    cells = functional._satisfiable_polarities(literals, background)
+    results.put((cells, functional._statistics.dnf_cells_pruned))
+
+
+def test_parallel_preprocessing_in_daemon():
+    # Daemonic processes (e.g. the workers of --checker both) cannot start workers and check sequentially instead.
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=_satisfiable_polarities_in_daemon, args=(results, ), daemon=True)
+    process.start()
+    (cells, pruned) = results.get(timeout=60)
+    process.join()
+    (literals, background) = _many_literals()
+    assert (cells, pruned) == satisfiable_polarities(Solver(name="z3"), literals, background)
+    reset_env()
@@ -0,0 +1,97 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+from pysmt.shortcuts import *
+
+from kipro2.explicit.value_iteration import *
+from kipro2.explicit.value_iteration import _Iteration
+from kipro2.explicit.simulation import *
+from kipro2.explicit.compiler import *
+from kipro2.utils.statistics import Statistics
+
+from tests.programs import *
+
+
+def run_explicit(program, post_exp, pre_exp, box=None, exact=False):
+    statistics = Statistics(dict())
+    res = ExplicitValueIteration(program, post_exp, pre_exp, statistics, box, 500, exact=exact).apply_value_iteration()
+    reset_env()
+    return res, statistics
+
+
+def test_brp():
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker explicit --box "toSend<=10, maxFailed<=5"
+    res, statistics = run_explicit(brp, "totalFailed", "totalFailed + 1", "toSend<=10, maxFailed<=5")
+    assert res == False
+    # BMC refutes at the same depth
+    assert statistics.k == 13
+
+
+@pytest.mark.parametrize("exact", [False, True])
+@pytest.mark.parametrize("pre_exp, expected_result", [("c+0.99", False), ("c+0.999999999999", False), ("c+1", True)])
+def test_geo(pre_exp, expected_result, exact):
+    # The refutation of c+0.999999999999 needs about 46 loop iterations, so c must be able to grow that far.
+    res, _ = run_explicit(geo, "c", pre_exp, "c<=60", exact)
+    assert res == expected_result
+
+
+@pytest.mark.parametrize("exact", [False, True])
+def test_infinite_successors(exact):
+    # From x=0 the loop moves to x=2, which terminates with an infinite value. x=1 terminates with value 0.
+    x = Symbol("x", INT)
+    box = StateBox([x], {"x": (0, 2)})
+
+    class Functional:
+        def evaluate(self, values):
+            (xs,) = values
+            return FunctionalValues([(xs == 2, float("inf")), (xs == 1, 0)], [(xs == 0, [(1, 0, 0)])],
+                                    [[np.full(box.size, 2)]], [])
+
+    iteration = _Iteration(Functional(), box, False, exact)
+    for _ in range(2):
+        iteration.step()
+    assert list(iteration.values) == [float("inf"), 0, float("inf")]
+    reset_env()
+
+
+def test_parse_box():
+    assert parse_box("toSend<=10, maxFailed < 5,2<=sent<=4, failed=1") == \
+           {"toSend": (0, 10), "maxFailed": (0, 4), "sent": (2, 4), "failed": (1, 1)}
+    with pytest.raises(Exception):
+        parse_box("toSend>=10")
+
+
+@pytest.mark.parametrize("pre_exp, expected_result", [("c+0.5", False), ("c+1", True)])
+def test_simulate_geo(pre_exp, expected_result):
+    # // ARGS: --post c --pre "c+0.5" --checker simulate --box "c<=5"
+    statistics = Statistics(dict())
+    res = MonteCarloSimulation(geo, "c", pre_exp, statistics, "c<=5", seed=0).apply_simulation()
+    reset_env()
+    assert res == expected_result
+
+
+def test_simulate_brp():
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker simulate --box "toSend<=20, maxFailed<=5, sent=0, failed=0, totalFailed=0"
+    statistics = Statistics(dict())
+    res = MonteCarloSimulation(brp, "totalFailed", "totalFailed + 1", statistics,
+                               "toSend<=20, maxFailed<=5, sent=0, failed=0, totalFailed=0", seed=0).apply_simulation()
+    reset_env()
+    assert res == False
+
+
+def test_compile_terms():
+    x, y = Symbol("x", INT), Symbol("y", INT)
+    monus = Symbol("Monus", FunctionType(INT, [INT, INT]))
+    terms = [And(LE(x, y), Not(Equals(x, Int(2)))), Function(monus, [x, y]),
+             Times(Real(Fraction(1, 3)), ToReal(Plus(x, y))), Ite(LT(x, y), Int(1), Int(0))]
+    exact = compile_terms(terms, [x, y], exact=True)
+    assert exact(1, 3) == (True, 0, Fraction(4, 3), 1)
+    assert exact(4, 3) == (False, 1, Fraction(7, 3), 0)
+    floating = compile_terms(terms, [x, y])
+    (guard, difference, third, ite) = floating(np.array([1, 2, 4]), np.array([3, 3, 3]))
+    assert list(guard) == [True, False, False]
+    assert list(difference) == [0, 0, 1]
+    assert np.allclose(third, [4 / 3, 5 / 3, 7 / 3])
+    assert list(ite) == [1, 1, 0]
+    reset_env()
@@ -99,3 +99,53 @@ def test_unifgen():
     pre_exp = "[elow+4=ehigh & n=ehigh-elow+1 & v=1 & c=0 & running=0 & (not (i < elow)) & (i <= ehigh)]*(1/5) + [not (elow+4=ehigh & n=ehigh-elow+1 & v=1 & c=0 & running=0 & (not (i < elow)) & (i <= ehigh))]*1"
     assert run_kinduction(program, post_exp, pre_exp) == True
 
+
+
+def test_pipeline():
+    #// ARGS: --post "totalFailed" --pre "[toSend <= 10]*(totalFailed + 3) + [not (toSend <= 10)]*\\infty" --checker both
+    statistics = Statistics(dict())
+    res = IncrementalKInduction(brp, "totalFailed", "[toSend <= 10]*(totalFailed + 3) + [not (toSend <= 10)]*\\infty",
+                                statistics, 30, True, pipeline=True).apply_k_induction()
+    reset_env()
+    assert res == True
+    assert statistics.k == 11
+
+
+def test_bmc_if_not_k_inductive():
+    # // ARGS: --post "totalFailed" --pre "totalFailed + 1" --checker combined
+    statistics = Statistics(dict())
+    checker = IncrementalKInduction(brp, "totalFailed", "totalFailed +1", statistics, 30, True,
+                                    bmc_if_not_k_inductive=True)
+    assert checker.apply_k_induction() == False
+    reset_env()
+    assert checker.was_refuted()
+    assert statistics.k == 13
+
+    #// ARGS: --post c --pre "c+1" --checker combined
+    checker = IncrementalKInduction(geo, "c", "c+1", Statistics(dict()), 30, True, bmc_if_not_k_inductive=True)
+    assert checker.apply_k_induction() == True
+    reset_env()
+    assert not checker.was_refuted()
+
+
+def test_multi_candidate():
+    from kipro2.k_induction.multi_candidate_k_induction import MultiCandidateKInduction
+    # // ARGS: --post "totalFailed" --pre "[toSend <= 4]*(totalFailed + 1) + ..." --pre "[toSend <= 10]*(totalFailed + 3) + ..." --checker kind
+    statistics = Statistics(dict())
+    pre_exps = ["[toSend <= 4]*(totalFailed + 1) + [not (toSend <= 4)]*\\infty",
+                "[toSend <= 10]*(totalFailed + 3) + [not (toSend <= 10)]*\\infty"]
+    assert MultiCandidateKInduction(brp, "totalFailed", pre_exps, statistics, 30).apply_k_induction() == True
+    reset_env()
+    assert [candidate["status"] for candidate in statistics.candidates] == ["inductive", "inductive"]
+    # The depth and number of formulae of the candidate decided last
+    assert (statistics.k, statistics.number_formulae) == (statistics.candidates[1]["k"],
+                                                          statistics.candidates[1]["number_formulae"])
+
+    # // ARGS: --post c --pre "c+1" --pre "c+0.99" --checker combined
+    statistics = Statistics(dict())
+    checker = MultiCandidateKInduction(geo, "c", ["c+1", "c+0.99"], statistics, 30, bmc_if_not_k_inductive=True)
+    assert checker.apply_k_induction() == False
+    reset_env()
+    assert [(candidate["status"], candidate["k"]) for candidate in statistics.candidates] == [("inductive", 2),
+                                                                                             ("refuted", 11)]
+    assert statistics.k == 11
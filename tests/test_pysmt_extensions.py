@@ -0,0 +1,100 @@
+from pysmt.shortcuts import *
+
+from kipro2.pysmt_extensions.affine import AffineNormalizer
+from kipro2.pysmt_extensions.euf_substituter import EUFMGSubstituter
+from kipro2.pysmt_extensions.simplifier import Simplifier
+
+
+def test_substitute_many():
+    x = Symbol("x", INT)
+    y = Symbol("y", INT)
+    p = Symbol("P", FunctionType(REAL, [INT, INT]))
+    q = Symbol("Q", FunctionType(REAL, [INT, INT]))
+    shared = Function(p, (Plus(x, Int(1)), y))
+    formulae = [Equals(shared, Real(1)),
+                Implies(LT(x, y), GE(Plus(shared, Function(p, (x, Int(0)))), ToReal(y))),
+                LT(y, Int(3))]
+    subs_list = [{x: Plus(y, Int(1))},
+                 {p: q, y: Int(0)},
+                 {x: y, y: x},
+                 {}]
+
+    substituter = EUFMGSubstituter(get_env())
+    expected = [[substituter.substitute(formula, subs) for formula in formulae] for subs in subs_list]
+    assert substituter.substitute_many(formulae, subs_list) == expected
+    # Formulae that no substitution changes are kept as they are
+    assert substituter.substitute_many([LT(y, Int(3))], [{x: Int(2)}]) == [[LT(y, Int(3))]]
+    reset_env()
+
+
+def test_simplifier_cache():
+    x = Symbol("x", INT)
+    y = Symbol("y", INT)
+    shifted = Plus(x, Int(0))
+    bounded = LT(y, Int(1))
+    simplifier = Simplifier(get_env(), cache_size=3)
+
+    assert simplifier.simplify(shifted) == x
+    assert (simplifier.cache_hits, simplifier.cache_misses) == (0, 3)
+    assert simplifier.simplify(shifted) == x
+    assert (simplifier.cache_hits, simplifier.cache_misses) == (1, 3)
+
+    # The three nodes of bounded evict the least recently used nodes of shifted
+    simplifier.simplify(bounded)
+    assert len(simplifier.memoization) == 3
+    assert shifted not in simplifier.memoization
+    assert bounded in simplifier.memoization
+    assert simplifier.simplify(shifted) == x
+    assert (simplifier.cache_hits, simplifier.cache_misses) == (1, 9)
+    assert len(simplifier.memoization) == 3
+
+    # Without a cache size, nothing is evicted
+    simplifier = Simplifier(get_env())
+    simplifier.simplify(shifted)
+    simplifier.simplify(bounded)
+    assert len(simplifier.memoization) == 6
+    reset_env()
+
+
+def test_affine_normalizer():
+    x = Symbol("x", INT)
+    y = Symbol("y", INT)
+    normalizer = AffineNormalizer(get_env())
+
+    normalized = [normalizer.normalize(term) for term in
+                  [Plus(Plus(x, Int(1)), Int(1)), Plus(x, Int(2)), Plus(Int(1), Plus(x, Int(1)))]]
+    assert normalized[0] is normalized[1] is normalized[2]
+    assert normalized[0] == Plus(x, Int(2))
+    assert normalizer.normalize(Plus(Minus(x, Int(1)), Int(1))) == x
+
+    distributed = normalizer.normalize(Times(Int(2), Plus(x, y)))
+    assert normalizer.linear_form(distributed) == ({x: 2, y: 2}, 0)
+    assert distributed == Plus(Times(x, Int(2)), Times(y, Int(2)))
+
+    # Applications of uninterpreted functions to equivalent arguments coincide after simplification
+    p = Symbol("P", FunctionType(REAL, [INT]))
+    simplifier = Simplifier(get_env(), normalize_affine=True)
+    assert simplifier.simplify(Function(p, [Plus(Int(1), Plus(x, Int(1)))])) is \
+        simplifier.simplify(Function(p, [Plus(x, Int(2))]))
+    reset_env()
+
+
+def test_affine_normalizer_monus():
+    x = Symbol("x", INT)
+    y = Symbol("y", INT)
+    monus = Symbol("Monus", FunctionType(INT, [INT, INT]))
+    simplifier = Simplifier(get_env(), normalize_affine=True, monus_euf=monus, non_negative_atoms=[x])
+    decremented = Function(monus, (x, Int(1)))
+
+    assert simplifier.simplify(Function(monus, (Plus(x, Int(1)), Int(1)))) == x
+    assert simplifier.simplify(Function(monus, (Plus(Times(Int(2), x), Int(3)), Int(1)))) == \
+        Plus(Times(x, Int(2)), Int(2))
+    assert simplifier.simplify(Function(monus, (Plus(decremented, Int(1)), Int(1)))) == decremented
+    assert simplifier.simplify(Function(monus, (Int(2), Int(5)))) == Int(0)
+    # The value is not known if the constant is too small or an atom may be negative
+    assert simplifier.simplify(decremented) == decremented
+    assert simplifier.simplify(Function(monus, (decremented, Int(1)))).arg(0) == decremented
+    assert simplifier.simplify(Function(monus, (Plus(y, Int(1)), Int(1)))).is_function_application()
+    assert simplifier.simplify(Function(monus, (Minus(Int(1), x), Int(1)))).is_function_application()
+    reset_env()
+
@@ -0,0 +1,47 @@
+import json
+import os
+import socket
+import threading
+
+from kipro2.serve import FunctionalLRU, VerificationServer
+
+from tests.programs import *
+
+
+def test_functional_lru():
+    functionals = FunctionalLRU(2)
+    functionals.put(("geo", "c"), {"a": {}})
+    functionals.put(("brp", "c"), {"b": {}})
+    assert functionals.get(("geo", "c")) == {"a": {}}
+    functionals.put(("ber", "c"), {"c": {}})
+    assert len(functionals) == 2
+    assert functionals.get(("brp", "c")) is None
+    assert functionals.get(("brp", "c"), dict()) == dict()
+    assert functionals.get(("geo", "c")) == {"a": {}}
+
+
+def test_serve(tmp_path):
+    program = tmp_path.joinpath("geo.pgcl")
+    program.write_text(geo)
+    server = VerificationServer(str(tmp_path.joinpath("kipro2.sock")))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert os.stat(str(tmp_path.joinpath("kipro2.sock"))).st_mode & 0o777 == 0o600
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(tmp_path.joinpath("kipro2.sock")))
+            responses = client.makefile("rb")
+            requests = [{"program": str(program), "post": "c", "pre": "c+1", "checker": "kind"},
+                        {"program": str(program), "post": "c", "pre": "c+0.99", "checker": "bmc"},
+                        {"program": str(program), "post": "c", "pre": "c+1", "checker": "both"}]
+            client.sendall("".join(json.dumps(request) + "\n" for request in requests).encode())
+            results = [json.loads(responses.readline()) for _ in requests]
+            assert [result["status"] for result in results] == ["inductive", "refuted", "invalid"]
+            # The second request reuses the characteristic functional of the first one
+            assert [result["statistics"]["functional_cache_hit"] for result in results[:2]] == [False, True]
+
+            client.sendall((json.dumps({"program": str(program), "post": "c", "pre": "c+1", "checker": "bmc"}) +
+                            "\n{\"cancel\": true}\n").encode())
+            assert json.loads(responses.readline())["status"] == "cancelled"
+    finally:
+        server.shutdown()
+        server.server_close()
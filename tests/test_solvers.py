@@ -0,0 +1,87 @@
+import pytest
+from pysmt.shortcuts import *
+
+from kipro2.solvers.factory import SolverBackend, close_solver, make_solver
+from kipro2.solvers.pipeline import is_sat_while
+from kipro2.solvers.smtlib_process import SmtLibProcessSolver
+from kipro2.utils.statistics import Statistics
+
+
+def _cubes():
+    x = Symbol("x", INT)
+    y = Symbol("y", INT)
+    z = Symbol("z", INT)
+    # Too hard for z3 within a second (no positive solutions exist)
+    return And(GT(x, Int(0)), GT(y, Int(0)), GT(z, Int(0)),
+               Equals(Plus(Times(x, x, x), Times(y, y, y)), Times(z, z, z)))
+
+
+def _fail():
+    raise ValueError("background failed")
+
+
+def test_smtlib_solver_timeout():
+    # // ARGS: --backend smtlib --solver-timeout 1
+    x = Symbol("x", INT)
+    cubes = _cubes()
+    statistics = Statistics(dict())
+    solver = make_solver(statistics, SolverBackend(name="smtlib", timeout=1))
+    solver.add_assertion(LT(x, Int(5)))
+
+    for check in [lambda: solver.is_sat(cubes), lambda: solver.solve([cubes])]:
+        with pytest.raises(Exception, match="time limit"):
+            check()
+        # The query of the failed check is popped, also from the script replayed by the restarted solver
+        assert solver.assertions == [LT(x, Int(5))]
+        assert solver.is_sat(Equals(x, Int(4)))
+        assert not solver.is_sat(Equals(x, Int(5)))
+        assert solver.solve()
+    assert statistics.sat_check_time.value >= 2
+    close_solver(solver)
+    reset_env()
+
+
+def test_is_sat_while_exceptions():
+    x = Symbol("x", INT)
+    solver = make_solver(Statistics(dict()), SolverBackend(name="smtlib", timeout=1))
+    solver.add_assertion(LT(x, Int(5)))
+
+    # The exception of the check takes precedence over the one of the background task
+    with pytest.raises(Exception, match="time limit"):
+        is_sat_while(solver, _cubes(), _fail)
+    assert solver.assertions == [LT(x, Int(5))]
+
+    with pytest.raises(ValueError, match="background failed"):
+        is_sat_while(solver, Equals(x, Int(5)), _fail)
+    assert solver.assertions == [LT(x, Int(5))]
+
+    assert is_sat_while(solver, Equals(x, Int(4)), lambda: Int(3))[0]
+    assert solver.assertions == [LT(x, Int(5))]
+    close_solver(solver)
+    reset_env()
+
+
+def test_smtlib_solver_close():
+    x = Symbol("x", INT)
+    with SmtLibProcessSolver() as solver:
+        assert solver.is_sat(LT(x, Int(5)))
+        process = solver._process
+    assert process.returncode is not None
+    assert process.stdin.closed and process.stdout.closed
+    # Closing twice does nothing
+    solver.close()
+    reset_env()
+
+
+def test_trace_closed(tmp_path):
+    trace = tmp_path / "trace.smt2"
+    x = Symbol("x", INT)
+    solver = make_solver(Statistics(dict()), trace=str(trace))
+    solver.add_assertion(GT(x, Int(0)))
+    solver.push()
+    solver.add_assertion(LT(x, Int(0)))
+    solver.pop()
+    close_solver(solver)
+    # Everything is written once the solver is closed, including the commands after the last check
+    assert trace.read_text().splitlines()[-3:] == ["(push 1)", "(assert (< x 0))", "(pop 1)"]
+    reset_env()
@@ -0,0 +1,27 @@
+import gc
+import weakref
+
+from probably.pgcl.ast import *
+from pysmt.shortcuts import *
+
+from kipro2.utils.utils import ProbablyExprConverter
+
+
+def test_converter_mutated_expressions():
+    converter = ProbablyExprConverter()
+    x = Symbol("x", INT)
+    expr = BinopExpr(Binop.PLUS, VarExpr("x"), NatLitExpr(1))
+    assert converter.convert(expr) == Plus(x, Int(1))
+
+    # A mutated expression is converted anew
+    expr.rhs = NatLitExpr(2)
+    assert converter.convert(expr) == Plus(x, Int(2))
+
+    # Structurally equal expressions share their conversion, but converted expressions are not kept alive
+    other = BinopExpr(Binop.PLUS, VarExpr("x"), NatLitExpr(1))
+    assert converter.convert(other) == Plus(x, Int(1))
+    other_ref = weakref.ref(other)
+    del other
+    gc.collect()
+    assert other_ref() is None
+    reset_env()